@@ -0,0 +1,212 @@
+import os
+import json
+import random
+import time
+import signal
+import asyncio
+import datetime
+from typing import Dict, Any, List, Optional
+
+class AsyncEmailBot:
+    def __init__(self, bot, name: Optional[str] = None):
+        """
+        Run an EmailBot's send loop on asyncio
+
+        The Sheets, Graph and OpenAI clients are blocking, so every call to them
+        is handed to a worker thread with asyncio.to_thread. Interval, jitter and
+        midnight-reset waits are asyncio timers that end as soon as shutdown is
+        requested, so many campaigns can share one event loop.
+
+        Args:
+            bot: EmailBot to drive (not initialized yet)
+            name: Campaign name used in logs and health output
+        """
+        self.bot = bot
+        self.name = name or bot.recipient_source.name or 'campaign'
+        self.state = 'created'
+        self.error = None
+
+    async def _sleep(self, seconds: float, shutdown: asyncio.Event) -> bool:
+        """
+        Wait without blocking the event loop
+
+        Returns:
+            True if shutdown was requested during the wait
+        """
+        try:
+            await asyncio.wait_for(shutdown.wait(), timeout=max(0, seconds))
+            return True
+        except asyncio.TimeoutError:
+            return shutdown.is_set()
+
+    async def run(self, shutdown: asyncio.Event) -> None:
+        """Initialize the bot, send until done or shut down, then clean up"""
+        reset_task = None
+        try:
+            self.state = 'initializing'
+            await asyncio.to_thread(self.bot.initialize, False)
+            reset_task = asyncio.create_task(self._reset_at_midnight(shutdown))
+
+            self.state = 'sending'
+            print(f"[{self.name}] Starting to send emails...")
+            await self.send_emails(shutdown)
+            self.state = 'stopped' if shutdown.is_set() else 'finished'
+            print(f"[{self.name}] Email sending process completed.")
+        except Exception as e:
+            self.state = 'error'
+            self.error = str(e)
+            print(f"[{self.name}] Error running email bot: {str(e)}")
+        finally:
+            if reset_task:
+                reset_task.cancel()
+            await asyncio.to_thread(self.bot.shutdown)
+
+    async def send_emails(self, shutdown: asyncio.Event) -> None:
+        """asyncio version of EmailBot.send_emails"""
+        bot = self.bot
+        schedule = bot.send_schedule
+        while bot.emails_sent_today < bot.daily_limit and not shutdown.is_set():
+            if schedule is not None:
+                wait_time = schedule.time_until_available()
+                if wait_time == float('inf'):
+                    print(f"[{self.name}] No send slots left today.")
+                    break
+            else:
+                wait_time = bot._seconds_until_next_send()
+            if wait_time > 0:
+                print(f"[{self.name}] Waiting {wait_time:.1f} seconds until next email...")
+                if await self._sleep(wait_time, shutdown):
+                    break
+                continue
+            if schedule is not None and not schedule.try_acquire():
+                continue
+
+            # Take the next recipient who hasn't been emailed yet
+            recipient = await self._next_recipient(shutdown)
+            if not recipient:
+                if not shutdown.is_set():
+                    print(f"[{self.name}] No more recipients to email.")
+                break
+
+            # Add some randomness to avoid exact same timing (planned slots are already jittered)
+            if schedule is None and await self._sleep(random.randint(1, 30), shutdown):
+                break
+
+            success = await asyncio.to_thread(bot._send_email_to_recipient, recipient)
+            await asyncio.to_thread(bot._record_result, recipient, success)
+            if not success and schedule is not None:
+                schedule.refund_total()
+
+            if bot.emails_sent_today >= bot.daily_limit:
+                print(f"[{self.name}] Daily limit of {bot.daily_limit} emails reached.")
+
+    async def _next_recipient(self, shutdown: asyncio.Event) -> Optional[Dict[str, Any]]:
+        """
+        Take the next recipient, waiting on the event loop for a held recipient's window
+
+        When only recipients held for their local send window are left, waits
+        until the first one's window opens, if that's before today's windows
+        close, like EmailBot._next_recipient does without blocking a thread.
+
+        Returns:
+            Recipient record, or None when no recipient can be emailed today or
+            shutdown was requested
+        """
+        bot = self.bot
+        schedule = bot.send_schedule
+        while True:
+            recipient = await asyncio.to_thread(bot._next_recipient, None, False)
+            if recipient or schedule is None:
+                return recipient
+            due = schedule.next_deferred_time()
+            closes_at = schedule.closes_at()
+            if due is None or closes_at is None or due >= closes_at:
+                return None
+            wait_time = max(0.0, due - time.time())
+            print(f"[{self.name}] Waiting {wait_time:.1f} seconds for the next recipient's local send window...")
+            if await self._sleep(wait_time, shutdown):
+                return None
+
+    async def _reset_at_midnight(self, shutdown: asyncio.Event) -> None:
+        """Reset the daily counter every midnight (replaces the APScheduler job)"""
+        # Midnight in the send windows' time zone, so the count and the planned day start together
+        timezone = self.bot.reset_timezone
+        while not shutdown.is_set():
+            now = datetime.datetime.now(timezone)
+            midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                                 tzinfo=timezone)
+            if await self._sleep((midnight - now).total_seconds(), shutdown):
+                return
+            self.bot._reset_daily_counter()
+
+    def health(self) -> Dict[str, Any]:
+        """Current state of the campaign"""
+        bot = self.bot
+        return {
+            'name': self.name,
+            'state': self.state,
+            'error': self.error,
+            'emails_sent_today': bot.emails_sent_today,
+            'daily_limit': bot.daily_limit,
+            'pending': len(bot.recipient_queue) if bot.recipient_queue else None,
+            'last_sent_time': bot.last_sent_time.isoformat() if bot.last_sent_time else None
+        }
+
+
+async def _serve_health(campaigns: List[AsyncEmailBot], port: int) -> asyncio.AbstractServer:
+    """Answer every HTTP request on the port with the campaigns' health as JSON"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Read and ignore the request line and headers
+            while True:
+                line = await reader.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+            body = json.dumps({'campaigns': [campaign.health() for campaign in campaigns]}).encode('utf-8')
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('ascii')
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    print(f"Health check available at http://127.0.0.1:{port}/")
+    return server
+
+
+async def run_campaigns(bots, health_port: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Run several EmailBots side by side on one event loop
+
+    SIGINT and SIGTERM stop every campaign at its next wait.
+
+    Args:
+        bots: EmailBot instances, one per campaign
+        health_port: Port for the JSON health endpoint (defaults to HEALTH_PORT, off if unset)
+
+    Returns:
+        Final health of every campaign
+    """
+    shutdown = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, shutdown.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on Windows event loops; Ctrl+C still cancels the run
+
+    campaigns = [AsyncEmailBot(bot) for bot in bots]
+
+    health_port = health_port or (int(os.environ['HEALTH_PORT']) if os.environ.get('HEALTH_PORT') else None)
+    server = await _serve_health(campaigns, health_port) if health_port else None
+    try:
+        await asyncio.gather(*(campaign.run(shutdown) for campaign in campaigns))
+    finally:
+        if server:
+            server.close()
+            await server.wait_closed()
+
+    return [campaign.health() for campaign in campaigns]
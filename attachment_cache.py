@@ -0,0 +1,139 @@
+import os
+import json
+import base64
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+class Attachment:
+    """A file attached to every email of a campaign, identified by the hash of its content"""
+    __slots__ = ('path', 'name', 'content_type', 'size', 'digest', 'inline')
+
+    def __init__(self, path: str, size: int, digest: str, inline: bool):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.size = size
+        self.digest = digest
+        self.inline = inline
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[Tuple[int, bytes]]:
+        """
+        Read the file one chunk at a time, for an upload session
+
+        Yields:
+            Tuple of (offset of the chunk, chunk bytes)
+        """
+        with open(self.path, 'rb') as attachment_file:
+            offset = 0
+            while True:
+                chunk = attachment_file.read(chunk_size)
+                if not chunk:
+                    return
+                yield offset, chunk
+                offset += len(chunk)
+
+
+class AttachmentCache:
+    def __init__(self, inline_max_bytes=None):
+        """
+        Attachment files, hashed and encoded once for every email that carries them
+
+        Files are identified by the SHA-256 of their content, so copies of a
+        file with the same name share one encoding, and a file that changes on
+        disk is picked up (it is re-hashed when its size or modification time
+        changes). Small files are sent inline: their base64 encoding and the
+        JSON of the attachment list are built once and reused for every
+        recipient. Files larger than inline_max_bytes are uploaded through a
+        Graph upload session instead and are never held in memory whole.
+
+        Args:
+            inline_max_bytes: Largest file sent inline (defaults to
+                ATTACHMENT_INLINE_MAX_BYTES, 2.9 MB, which is just under
+                Graph's 4 MB request limit once base64 adds a third)
+        """
+        self.inline_max_bytes = inline_max_bytes or int(os.environ.get('ATTACHMENT_INLINE_MAX_BYTES',
+                                                                       int(2.9 * 1024 * 1024)))
+
+        # path -> (modification time, size, Attachment)
+        self._files = {}
+        # (content hash, name) of each inline attachment -> JSON of the attachment list,
+        # which holds the only copy of the base64 text
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as attachment_file:
+            for block in iter(lambda: attachment_file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, path: str) -> Attachment:
+        """Look up an attachment file, hashing it only if it is new or changed"""
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                return cached[2]
+
+        attachment = Attachment(path, stat.st_size, self._hash_file(path), stat.st_size <= self.inline_max_bytes)
+        with self._lock:
+            previous = self._files.get(path)
+            self._files[path] = (stat.st_mtime_ns, stat.st_size, attachment)
+            if previous is not None and previous[2].digest != attachment.digest:
+                self._forget(previous[2].digest)
+        return attachment
+
+    def _forget(self, digest: str) -> None:
+        """Drop the encoded attachment lists of a file's old content, unless another path still has it (lock held)"""
+        if any(cached[2].digest == digest for cached in self._files.values()):
+            return
+        for key in [key for key in self._fragments if any(entry[0] == digest for entry in key)]:
+            del self._fragments[key]
+
+    def resolve(self, paths: List[str]) -> List[Attachment]:
+        """Look up several attachment files"""
+        return [self.get(path) for path in paths]
+
+    @staticmethod
+    def _encode(attachment: Attachment) -> str:
+        with open(attachment.path, 'rb') as attachment_file:
+            return base64.b64encode(attachment_file.read()).decode('ascii')
+
+    def json_fragment(self, attachments: List[Attachment]) -> Optional[bytes]:
+        """
+        JSON array of the inline attachments in Graph's fileAttachment format
+
+        Built once per set of attachments, so sending a multi-MB attachment to
+        every recipient costs neither a base64 encoding nor a JSON encoding per email.
+
+        Returns:
+            The JSON as UTF-8 bytes, or None if none of the attachments is inline
+        """
+        inline = [attachment for attachment in attachments if attachment.inline]
+        if not inline:
+            return None
+        key = tuple((attachment.digest, attachment.name) for attachment in inline)
+        with self._lock:
+            fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = json.dumps([
+                {
+                    '@odata.type': '#microsoft.graph.fileAttachment',
+                    'name': attachment.name,
+                    'contentType': attachment.content_type,
+                    'contentBytes': self._encode(attachment)
+                }
+                for attachment in inline
+            ]).encode('utf-8')
+            with self._lock:
+                fragment = self._fragments.setdefault(key, fragment)
+        return fragment
+
+    def stats(self) -> Dict[str, int]:
+        """Number of attachment files seen and of encoded attachment lists"""
+        with self._lock:
+            return {'files': len(self._files), 'fragments': len(self._fragments)}
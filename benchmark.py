@@ -0,0 +1,378 @@
+import os
+import csv
+import sys
+import json
+import math
+import time
+import tempfile
+import argparse
+import contextlib
+import threading
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, Any, List
+from unittest import mock
+
+import openai
+
+import email_bot
+from email_bot import EmailBot
+from fake_backends import FakeSheetsService, FakeGraphSession, FakeMsalApp, FakeOpenAI, NoJitter, build_grid
+from google_sheets import GoogleSheetsHandler
+from local_sources import ParquetRecipientSource, SqliteRecipientSource
+from outlook_sender import OutlookSender
+from recipient_queue import RecipientQueue
+from recipient_source import open_recipient_source
+from template_handler import TemplateHandler
+
+BENCHMARK_RANGE = 'Sheet1!A1:F'
+
+def _percentile(samples: List[float], percent: float) -> float:
+    if not samples:
+        return 0.0
+    # Nearest-rank percentile
+    ordered = sorted(samples)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+class StageTimer:
+    def __init__(self):
+        """Collect how long each call of every pipeline stage took"""
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, func):
+        """Wrap a function so every call is timed under the stage name"""
+        timer = self
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with timer._lock:
+                    timer.samples[stage].append(elapsed)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean, p50 and p99 (in milliseconds) of every stage"""
+        return {
+            stage: {
+                'count': len(samples),
+                'mean_ms': 1000 * sum(samples) / len(samples),
+                'p50_ms': 1000 * _percentile(samples, 50),
+                'p99_ms': 1000 * _percentile(samples, 99),
+            }
+            for stage, samples in self.samples.items() if samples
+        }
+
+def write_local_source(path: str, grid: List[List[str]]) -> None:
+    """Write sheet contents to a local recipient file, its kind taken from the extension"""
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as target:
+            csv.writer(target, lineterminator='\n').writerows(grid)
+    elif path.endswith('.parquet'):
+        pyarrow, parquet = ParquetRecipientSource._pyarrow()
+        table = pyarrow.table({header: [row[i] for row in grid[1:]] for i, header in enumerate(grid[0])})
+        parquet.write_table(table, path, row_group_size=5000)
+    else:
+        source = SqliteRecipientSource(path)
+        source.import_rows(grid[0], grid[1:])
+        source.close()
+
+def _count_statuses(headers: List[str], rows) -> Dict[str, int]:
+    status_column = headers.index('Status')
+    statuses = defaultdict(int)
+    for row in rows:
+        statuses[row[status_column] if len(row) > status_column else ''] += 1
+    return dict(statuses)
+
+def run_end_to_end(recipients=200, sectors=10, send_mode='pipeline', sheets_options=None,
+                   graph_options=None, openai_options=None, env=None, verbose=False,
+                   source='sheets') -> Dict[str, Any]:
+    """
+    Run an EmailBot end to end against the in-process fakes
+
+    Nothing leaves the machine: Sheets, Graph and OpenAI are fakes with the given
+    latency and failure settings, the send interval and jitter are switched off,
+    and the journal, spool and cache files go to a temporary directory.
+
+    Args:
+        recipients: Number of pending recipients in the fake sheet
+        sectors: Number of distinct sectors (drives the ChatGPT cache hit rate)
+        send_mode: 'serial' or 'pipeline'
+        sheets_options / graph_options / openai_options: Keyword arguments for the fakes
+        env: Extra environment variables, e.g. {'GRAPH_BATCH_SEND': 'true', 'SEND_BURST': '20'}
+        verbose: Keep the bot's own log output
+        source: Where the recipients are read from: 'sheets' (the fake sheet), or
+            'csv', 'parquet' or 'sqlite' for a local file with the same rows
+
+    Returns:
+        Throughput, per-stage latency and API call counts
+    """
+    sheets = FakeSheetsService(build_grid(recipients, sectors), **(sheets_options or {}))
+    graph = FakeGraphSession(**(graph_options or {}))
+    ai = FakeOpenAI(**(openai_options or {}))
+    timer = StageTimer()
+
+    with tempfile.TemporaryDirectory(prefix='email-bot-bench-') as workdir:
+        settings = {
+            'GOOGLE_SHEET_ID': 'benchmark',
+            'GOOGLE_SHEET_RANGE': BENCHMARK_RANGE,
+            'OPENAI_API_KEY': 'benchmark',
+            'DAILY_EMAIL_LIMIT': str(recipients),
+            'EMAIL_INTERVAL_MINUTES': '0',
+            'SEND_MODE': send_mode,
+            'RETRY_BASE_DELAY': '0.01',
+            'SEND_JOURNAL_FILE': os.path.join(workdir, 'journal.sqlite3'),
+            'SHEETS_WRITE_SPOOL_FILE': os.path.join(workdir, 'spool.jsonl'),
+            'RECIPIENT_SYNC_SPOOL_FILE': os.path.join(workdir, 'sync_spool.jsonl'),
+            'AI_SUGGESTION_CACHE_FILE': os.path.join(workdir, 'suggestions.sqlite3'),
+            'MS_SENDER_MAILBOXES': '',
+        }
+        if source != 'sheets':
+            local_path = os.path.join(workdir, f'recipients.{source}')
+            write_local_source(local_path, sheets.grid)
+            settings['RECIPIENT_SOURCE'] = local_path
+        settings.update(env or {})
+
+        patches = [
+            mock.patch.dict(os.environ, settings),
+            mock.patch.object(GoogleSheetsHandler, '_authenticate', lambda self: None),
+            mock.patch('msal.ConfidentialClientApplication', FakeMsalApp),
+            mock.patch.object(openai, 'chat', ai.chat),
+            mock.patch.object(email_bot, 'random', NoJitter),
+            mock.patch.object(RecipientQueue, 'next', timer.wrap('load', RecipientQueue.next)),
+            mock.patch.object(EmailBot, '_enrich_recipient', timer.wrap('enrich', EmailBot._enrich_recipient)),
+            mock.patch.object(EmailBot, '_render_email', timer.wrap('render', EmailBot._render_email)),
+            mock.patch.object(OutlookSender, 'send_email', timer.wrap('send', OutlookSender.send_email)),
+            mock.patch.object(OutlookSender, 'send_batch', timer.wrap('send_batch', OutlookSender.send_batch)),
+            mock.patch.object(EmailBot, '_record_result', timer.wrap('write_back', EmailBot._record_result)),
+        ]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+
+            bot = EmailBot()
+            if bot.sheets_handler:
+                bot.sheets_handler.service = sheets
+            bot.outlook_sender.session = graph
+            for mailbox in (bot.sender_pool.mailboxes if bot.sender_pool else []):
+                mailbox.sender.session = graph
+
+            started = time.perf_counter()
+            bot.run()
+            elapsed = time.perf_counter() - started
+
+        if source == 'sheets':
+            statuses = _count_statuses(sheets.grid[0], sheets.grid[1:])
+        else:
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                local = open_recipient_source(local_path)
+                statuses = _count_statuses(['Status'], ([record['Status']] for record in local.iter_recipients()))
+                local.close()
+    sent = statuses.get('Sent', 0)
+    per_email = max(1, sent)
+
+    return {
+        'recipients': recipients,
+        'send_mode': send_mode,
+        'source': source,
+        'elapsed_seconds': elapsed,
+        'sent': sent,
+        'statuses': statuses,
+        'sends_per_second': sent / elapsed if elapsed else 0.0,
+        'stages': timer.summary(),
+        'api_calls': {
+            'sheets': dict(sheets.calls),
+            'graph': dict(graph.calls),
+            'openai': dict(ai.calls),
+        },
+        'api_calls_per_email': {
+            'sheets': sheets.total_calls / per_email,
+            'graph': graph.total_calls / per_email,
+            'openai': ai.total_calls / per_email,
+        },
+    }
+
+def benchmark_fill_template(template_path='email_template.html', renders=10000) -> Dict[str, Any]:
+    """
+    Time TemplateHandler.fill_template on the real template
+
+    Args:
+        template_path: Template to fill
+        renders: Number of fill_template calls
+    """
+    handler = TemplateHandler(template_path)
+    data = {field: f'value of {field}' for field in handler.get_required_fields()}
+
+    started = time.perf_counter()
+    for i in range(renders):
+        data['name'] = f'Contact {i}'
+        handler.fill_template(data)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'renders': renders,
+        'elapsed_seconds': elapsed,
+        'renders_per_second': renders / elapsed if elapsed else 0.0,
+        'us_per_render': 1e6 * elapsed / renders,
+    }
+
+def benchmark_row_parsing(rows=10000, repeat=3, pending_share=0.1) -> Dict[str, Any]:
+    """
+    Time and measure reading recipients from a large sheet
+
+    Compares get_recipients, which returns every matching row in one list,
+    iter_recipients, which streams them page by page, and iter_pending_chunks,
+    which scans the status column and fetches only the pending rows. Times
+    include the fake sheet slicing out each range, like the API returning it.
+    The same rows are also streamed from local CSV and SQLite sources (and
+    Parquet when pyarrow is installed).
+
+    Args:
+        rows: Number of recipient rows in the sheet
+        repeat: Number of timed runs; the fastest is reported
+        pending_share: Share of rows still "Not Sent"
+    """
+    grid = build_grid(rows, sectors=10, status='Sent')
+    status_column_index = grid[0].index('Status')
+    if pending_share:
+        for row in grid[1::max(1, round(1 / pending_share))]:
+            row[status_column_index] = 'Not Sent'
+
+    with mock.patch.object(GoogleSheetsHandler, '_authenticate', lambda self: None):
+        handler = GoogleSheetsHandler(sheet_id='benchmark', sheet_range=BENCHMARK_RANGE)
+    handler.service = FakeSheetsService(grid)
+
+    def read_list():
+        return len(handler.get_recipients(status_column_index=status_column_index))
+
+    def read_stream():
+        return sum(1 for _ in handler.iter_recipients(status_column_index=status_column_index))
+
+    def read_scan():
+        return sum(len(records) for _, records, _ in
+                   handler.iter_pending_chunks(status_column_index=status_column_index))
+
+    readers = [('list', read_list), ('stream', read_stream), ('scan', read_scan)]
+    workdir = tempfile.TemporaryDirectory(prefix='email-bot-bench-')
+    local_sources = []
+    for kind in ('csv', 'sqlite', 'parquet'):
+        path = os.path.join(workdir.name, f'recipients.{kind}')
+        try:
+            write_local_source(path, grid)
+        except ImportError:
+            continue
+        source = open_recipient_source(path)
+        local_sources.append(source)
+        readers.append((kind, lambda source=source: sum(1 for _ in source.iter_recipients(
+            status_column_index=status_column_index))))
+
+    result = {'rows': rows, 'chunk_rows': handler.read_chunk_rows, 'fetch_batch_rows': handler.fetch_batch_rows}
+    for name, read in readers:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result['recipients'] = read()
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        read()
+        result[f'{name}_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        result[f'{name}_seconds'] = min(timings)
+        result[f'{name}_rows_per_second'] = rows / min(timings) if min(timings) else 0.0
+
+    for source in local_sources:
+        source.close()
+    workdir.cleanup()
+    return result
+
+def _print_end_to_end(result: Dict[str, Any]) -> None:
+    print(f"{result['send_mode']} ({result['source']}): {result['sent']}/{result['recipients']} sent in "
+          f"{result['elapsed_seconds']:.2f}s ({result['sends_per_second']:.1f} sends/sec), "
+          f"statuses {result['statuses']}")
+    print(f"  {'stage':<12}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, stats in result['stages'].items():
+        print(f"  {stage:<12}{stats['count']:>8}{stats['mean_ms']:>10.2f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    for api, per_email in result['api_calls_per_email'].items():
+        print(f"  {api} calls per email: {per_email:.3f} {result['api_calls'][api]}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the email bot offline against in-process fakes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    e2e = subparsers.add_parser('e2e', help='Drive EmailBot end to end against fake Sheets, Graph and OpenAI')
+    e2e.add_argument('--recipients', type=int, default=200)
+    e2e.add_argument('--sectors', type=int, default=10)
+    e2e.add_argument('--mode', choices=['serial', 'pipeline'], default='pipeline')
+    e2e.add_argument('--source', choices=['sheets', 'csv', 'parquet', 'sqlite'], default='sheets',
+                     help='Read recipients from the fake sheet or from a local file with the same rows')
+    e2e.add_argument('--sheets-latency', type=float, default=0.05)
+    e2e.add_argument('--graph-latency', type=float, default=0.1)
+    e2e.add_argument('--openai-latency', type=float, default=0.5)
+    e2e.add_argument('--jitter', type=float, default=0.0, help='Extra random latency (seconds) for every fake')
+    e2e.add_argument('--error-rate', type=float, default=0.0, help='Share of calls failing with 503')
+    e2e.add_argument('--throttle-rate', type=float, default=0.0, help='Share of calls throttled with 429')
+    e2e.add_argument('--permanent-error-rate', type=float, default=0.0, help='Share of emails rejected with 400')
+    e2e.add_argument('--retry-after', type=float, default=0.05)
+    e2e.add_argument('--seed', type=int, default=1)
+    e2e.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                     help='Extra environment setting, e.g. --set GRAPH_BATCH_SEND=true (repeatable)')
+    e2e.add_argument('--json', help='Also write the results to this file')
+    e2e.add_argument('--verbose', action='store_true', help="Show the bot's own output")
+
+    micro = subparsers.add_parser('micro', help='Micro-benchmarks for template filling and row parsing')
+    micro.add_argument('--renders', type=int, default=10000)
+    micro.add_argument('--rows', default='10000,100000',
+                       help='Comma-separated sheet sizes to parse, e.g. 10000,100000,1000000')
+    micro.add_argument('--template', default='email_template.html')
+    micro.add_argument('--json', help='Also write the results to this file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'e2e':
+        common = {'jitter': args.jitter, 'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+                  'retry_after': args.retry_after, 'seed': args.seed}
+        result = run_end_to_end(
+            recipients=args.recipients,
+            sectors=args.sectors,
+            send_mode=args.mode,
+            sheets_options=dict(common, latency=args.sheets_latency),
+            graph_options=dict(common, latency=args.graph_latency, permanent_error_rate=args.permanent_error_rate),
+            openai_options=dict(common, latency=args.openai_latency),
+            env=dict(setting.split('=', 1) for setting in args.set),
+            verbose=args.verbose,
+            source=args.source
+        )
+        _print_end_to_end(result)
+    else:
+        result = {
+            'fill_template': benchmark_fill_template(args.template, args.renders),
+            'row_parsing': [benchmark_row_parsing(int(rows)) for rows in args.rows.split(',')],
+        }
+        fill = result['fill_template']
+        print(f"fill_template: {fill['renders']} renders, {fill['us_per_render']:.1f} us/render "
+              f"({fill['renders_per_second']:.0f}/sec)")
+        for parsed in result['row_parsing']:
+            print(f"{parsed['rows']} rows ({parsed['recipients']} pending): "
+                  f"get_recipients {parsed['list_seconds']:.3f}s, peak {parsed['list_peak_mb']:.1f} MB; "
+                  f"iter_recipients {parsed['stream_seconds']:.3f}s, peak {parsed['stream_peak_mb']:.1f} MB; "
+                  f"status scan {parsed['scan_seconds']:.3f}s, peak {parsed['scan_peak_mb']:.1f} MB")
+            for kind in ('csv', 'sqlite', 'parquet'):
+                if f'{kind}_seconds' in parsed:
+                    print(f"  local {kind}: {parsed[f'{kind}_seconds']:.3f}s, peak {parsed[f'{kind}_peak_mb']:.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump(result, output, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,62 +3,219 @@ import sys
 import time
 import datetime
 import random
-import re
-import openai
-from typing import List, Dict, Any
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
 
 from google_sheets import GoogleSheetsHandler
+from lease_store import LeaseStore
+from metrics import metrics, MetricsExporter
 from outlook_sender import OutlookSender
+from rate_limiter import TokenBucket
+from recipient_queue import RecipientQueue
+from recipient_source import open_recipient_source
+from retry_policy import RetryPolicy
+from send_journal import SendJournal
+from send_pipeline import SendPipeline
+from send_schedule import SendSchedule
+from sender_pool import SenderPool
+from suggestion_cache import SuggestionCache, normalize_sector
+from sheets_writer import BufferedSheetsWriter
+from suppression_index import SuppressionIndex
 from template_handler import TemplateHandler
+from template_watcher import TemplateWatcher
 
 # Load environment variables from .env.local
 load_dotenv('.env.local')
 
+# Template fields the bot fills in itself rather than reading from the sheet
+COMPUTED_TEMPLATE_FIELDS = {'sector', 'sector_specific_ai_idea'}
+
+def email_subject(extracted_subject: Optional[str], recipient_sector: str) -> str:
+    """
+    Pick the subject line for a rendered email
+
+    Args:
+        extracted_subject: Filled <title> text of the template, or None without a <title>
+        recipient_sector: Recipient's sector ('' if unknown)
+
+    Returns:
+        The filled title, or a fallback subject when it's missing or still has a {sector} placeholder
+    """
+    # Fallback subject if title tag is missing or empty, or if sector was empty
+    current_subject = f"AI Automation Idea for {recipient_sector if recipient_sector else 'Your Business'}"
+    if extracted_subject is not None:
+        extracted_subject = extracted_subject.strip()
+        if extracted_subject and "{sector}" not in extracted_subject: # Check if placeholder was filled
+            current_subject = extracted_subject
+        elif not recipient_sector: # if sector is empty, title might be "automation in {} idea"
+            current_subject = "AI Automation Idea"
+    return current_subject
+
 class EmailBot:
-    def __init__(self):
+    def __init__(self, sheet_id=None, sheet_range=None, template_path=None):
+        """
+        Args:
+            sheet_id: Google Sheet to read recipients from (defaults to GOOGLE_SHEET_ID)
+            sheet_range: Range to read (defaults to GOOGLE_SHEET_RANGE)
+            template_path: Email template file (defaults to email_template.html)
+        """
         # Initialize components
-        self.sheets_handler = GoogleSheetsHandler()
+        # Recipients come from the Google Sheet, or from a local file or database (RECIPIENT_SOURCE)
+        self.recipient_source = open_recipient_source(sheet_id=sheet_id, sheet_range=sheet_range)
+        # With a local source the sheet can still be kept up to date as the human-facing view
+        if isinstance(self.recipient_source, GoogleSheetsHandler):
+            self.sheets_handler = self.recipient_source
+        elif os.environ.get('RECIPIENT_SYNC_TO_SHEETS', 'false').lower() in ('1', 'true', 'yes'):
+            self.sheets_handler = GoogleSheetsHandler(sheet_id=sheet_id, sheet_range=sheet_range)
+        else:
+            self.sheets_handler = None
+        self.sheets_sync = None
         self.outlook_sender = OutlookSender()
-        self.template_handler = TemplateHandler()
+        self.template_handler = TemplateHandler(template_path or 'email_template.html')
+        self.template_watcher = None
         
         # Email settings
         self.daily_limit = int(os.environ.get('DAILY_EMAIL_LIMIT', 10))
         self.interval_minutes = int(os.environ.get('EMAIL_INTERVAL_MINUTES', 2))
         
+        # Several sending mailboxes (MS_SENDER_MAILBOXES) each have their own
+        # limit and interval, enforced by the pool, so the bot only caps the total
+        self.sender_pool = SenderPool.from_env(self.outlook_sender)
+        if self.sender_pool:
+            self.daily_limit = self.sender_pool.daily_limit
+            self.interval_minutes = 0
+        self.mail_sender = self.sender_pool or self.outlook_sender
+        
+        # Send mode: 'serial' sends one email at a time, 'pipeline' runs the
+        # stages concurrently with a pool of send workers
+        self.send_mode = os.environ.get('SEND_MODE', 'serial').lower()
+        # With SEND_WINDOWS, sends go out in slots planned over the day's business hours
+        self.send_schedule = SendSchedule.from_env(daily_limit=self.daily_limit, interval_minutes=self.interval_minutes)
+        if self.send_schedule is not None:
+            self.rate_limiter = self.send_schedule
+        else:
+            self.rate_limiter = TokenBucket.from_interval(
+                self.interval_minutes,
+                burst=int(os.environ.get('SEND_BURST', 1)),
+                daily_limit=self.daily_limit
+            )
+        
         # OpenAI API Key
         self.openai_api_key = os.environ.get('OPENAI_API_KEY')
         if not self.openai_api_key:
             print("Warning: OPENAI_API_KEY not found in .env.local. ChatGPT integration will not work.")
-        else:
-            openai.api_key = self.openai_api_key
+        self.retry_policy = RetryPolicy(name='openai')
+        
+        # ChatGPT suggestions only depend on the sector, so keep a pool per sector
+        self.suggestion_cache = SuggestionCache()
 
         # Status column in Google Sheet
         self.status_column = os.environ.get('STATUS_COLUMN', 'Status')
         self.status_column_index = None
+        self.recipient_queue = None
+        self.status_writer = None
         
-        # Scheduler
-        self.scheduler = BackgroundScheduler()
+        # Several workers on one recipient list only email the rows they hold a lease on
+        self.lease_store = None
+        campaign = self.recipient_source.name
+        if os.environ.get('WORKER_LEASE_FILE'):
+            self.lease_store = LeaseStore(campaign=campaign)
+            # Each worker replays only its own sends, not those other workers are making right now
+            campaign = f"{campaign or ''}:{self.lease_store.worker_id}"
+        
+        # Local record of every send, so a restart neither repeats nor forgets one
+        self.campaign = campaign
+        self.send_journal = SendJournal(campaign=campaign)
+        # Status for rows whose send was interrupted, so it's unknown if the email went out
+        self.in_doubt_status = os.environ.get('SEND_JOURNAL_IN_DOUBT_STATUS', 'Unconfirmed')
+        
+        # Bounced/unsubscribed contacts and addresses already emailed are skipped before any work
+        self.suppression_index = SuppressionIndex()
+        self.skip_statuses = {
+            'suppressed': os.environ.get('SUPPRESSED_STATUS', 'Suppressed'),
+            'duplicate': os.environ.get('DUPLICATE_STATUS', 'Duplicate'),
+        }
+        
+        # Scheduler, created when it is started
+        self.scheduler = None
         self.emails_sent_today = 0
         self.last_sent_time = None
     
-    def initialize(self):
-        """Initialize the bot and set up the scheduler"""
+    def initialize(self, start_scheduler=True):
+        """
+        Initialize the bot and set up the scheduler
+        
+        Args:
+            start_scheduler: Start the background scheduler for the midnight counter
+                reset. The asyncio runner schedules the reset itself.
+        """
         print("Initializing Email Bot...")
         
         # Find or create status column
-        self.status_column_index = self.sheets_handler.find_status_column_index(self.status_column)
+        self.status_column_index = self.recipient_source.find_status_column_index(self.status_column)
+        
+        # Pending recipients are read once; later sends only fetch newly added rows
+        self.recipient_queue = RecipientQueue(
+            self.recipient_source,
+            status_column_index=self.status_column_index,
+            status_filter="Not Sent",
+            screen=self._screen_recipients,
+            rescan=self.lease_store.should_rescan if self.lease_store else None
+        )
+        
+        # Buffer status/date write-back and flush it in batches
+        # Spools are per campaign, so campaigns sharing a process never touch each other's updates
+        self.status_writer = BufferedSheetsWriter(self.recipient_source, campaign=self.campaign)
+        self.status_writer.start()
+        
+        # Mirror statuses from a local source to the sheet every few minutes, in large batches
+        if self.sheets_handler is not None and self.sheets_handler is not self.recipient_source:
+            self.sheets_handler.find_status_column_index(self.status_column)
+            self.sheets_sync = BufferedSheetsWriter(
+                self.sheets_handler,
+                max_pending=int(os.environ.get('RECIPIENT_SYNC_BATCH_SIZE', 500)),
+                flush_interval=float(os.environ.get('RECIPIENT_SYNC_SECONDS', 300)),
+                spool_file=os.environ.get('RECIPIENT_SYNC_SPOOL_FILE', '.sheets_sync_writes.jsonl'),
+                campaign=self.campaign
+            )
+            self.sheets_sync.start()
+        
+        # Restore today's count and finish whatever the previous run left half done
+        self._replay_journal()
+        self._load_emailed_addresses()
+        if self.lease_store:
+            self.lease_store.start()
+        self.recipient_queue.load()
         
         # Log the required fields from the template
         required_fields = self.template_handler.get_required_fields()
         print(f"Required fields in email template: {', '.join(required_fields)}")
         
+        # Optionally pick up template edits without restarting
+        if os.environ.get('TEMPLATE_HOT_RELOAD', 'false').lower() in ('1', 'true', 'yes'):
+            self.template_watcher = TemplateWatcher(
+                self.template_handler,
+                available_fields=lambda: set(self.recipient_source.get_headers()) | COMPUTED_TEMPLATE_FIELDS
+            )
+            self.template_watcher.start()
+        
+        if start_scheduler:
+            self._start_scheduler()
+    
+    def _start_scheduler(self) -> None:
+        """Start the background scheduler that resets the daily counter at midnight"""
+        # Imported here since runs with nothing to send never need it
+        from apscheduler.schedulers.background import BackgroundScheduler
+        from apscheduler.triggers.cron import CronTrigger
+        
+        self.scheduler = BackgroundScheduler()
         # Schedule the daily reset of email counter
         self.scheduler.add_job(
             self._reset_daily_counter,
-            CronTrigger(hour=0, minute=0),  # Reset at midnight
+            CronTrigger(hour=0, minute=0, timezone=self.reset_timezone),  # Reset at midnight
             id='reset_counter'
         )
         
@@ -66,16 +223,88 @@ class EmailBot:
         self.scheduler.start()
         print("Scheduler started.")
     
+    @property
+    def reset_timezone(self):
+        """Time zone whose midnight starts a new sending day: the send windows' (SEND_TIMEZONE), else local time"""
+        return self.send_schedule.timezone if self.send_schedule is not None else None
+    
+    def _replay_journal(self) -> None:
+        """Apply the send journal left by previous runs"""
+        state = self.send_journal.replay()
+        
+        in_doubt = [row_index for row_index, status in state['statuses'].items() if status is None]
+        for row_index in in_doubt:
+            # Never resend: the email may already have been delivered
+            self.send_journal.record_result({'_row_index': row_index}, self.in_doubt_status)
+            state['statuses'][row_index] = self.in_doubt_status
+            state['unwritten'][row_index] = self.in_doubt_status
+        
+        for row_index, status in state['statuses'].items():
+            self.recipient_queue.mark(row_index, status)
+        for row_index, status in state['unwritten'].items():
+            self._write_status(row_index, status)
+            self.send_journal.record_written(row_index, status)
+        if self.lease_store:
+            # Rows this worker was sending when it stopped keep their lease until now
+            self.lease_store.complete(state['unwritten'])
+        
+        # Interrupted sends count towards the daily limit, since they may have gone out
+        self.emails_sent_today = state['sent_today'] + len(in_doubt)
+        self.last_sent_time = state['last_sent_time']
+        self.rate_limiter.charge_total(self.emails_sent_today)
+        if self.sender_pool:
+            # Each mailbox's own daily limit holds across restarts too
+            self.sender_pool.charge_sent(state['sent_today_by_mailbox'])
+        
+        if state['statuses']:
+            print(f"Send journal: {self.emails_sent_today} emails already sent today, "
+                  f"{len(state['unwritten'])} statuses re-queued for the sheet, "
+                  f"{len(in_doubt)} interrupted sends marked '{self.in_doubt_status}'.")
+    
     def _reset_daily_counter(self):
         """Reset the daily email counter"""
         self.emails_sent_today = 0
+        self.rate_limiter.reset_total()
+        if self.sender_pool:
+            self.sender_pool.reset_daily()
         print(f"Daily email counter reset to 0 at {datetime.datetime.now()}")
     
+    @metrics.timed('ai_suggestion')
+    def _get_sector_suggestion(self, sector: str) -> str:
+        """Get a suggestion for a sector from the cache, asking ChatGPT only when the sector's pool isn't full"""
+        suggestion = self.suggestion_cache.get(sector)
+        if suggestion is not None:
+            print(f"Using cached ChatGPT suggestion for {sector}: {suggestion}")
+            return suggestion
+        
+        suggestion = self._get_chatgpt_suggestion(sector)
+        self.suggestion_cache.add(sector, suggestion)
+        return suggestion
+    
     def _get_chatgpt_suggestion(self, sector: str) -> str:
         if not self.openai_api_key or not sector:
             print("Skipping ChatGPT suggestion: OpenAI API key not configured or sector is missing.")
             return "" 
 
+        try:
+            return self.retry_policy.call(
+                self._request_chatgpt_suggestion, sector,
+                description=f"ChatGPT suggestion for {sector}"
+            )
+        except Exception as e:
+            print(f"Error getting ChatGPT suggestion for {sector}: {str(e)}")
+            return ""
+    
+    def _openai(self):
+        """The openai module, imported on first use since importing it takes most of a second"""
+        import openai
+        openai.api_key = self.openai_api_key
+        # Retries are handled by our own policy, shared with Sheets and Graph
+        openai.max_retries = 0
+        return openai
+    
+    def _request_chatgpt_suggestion(self, sector: str) -> str:
+        """Ask ChatGPT for a sector suggestion, raising on API errors"""
         prompt = f"You're writing a very short, casual follow-up sentence for an email. The recipient is in the {sector} industry. " \
                  f"After the main offer ('...we help identify and implement tailor-made solutions.'), add one brief, practical idea for a small AI automation they might find helpful. " \
                  f"Use a friendly, approachable tone. " \
@@ -85,28 +314,90 @@ class EmailBot:
                  f"For example, for a 'Law Firm' sector, a good suggestion might be: 'Just thinking, AI could probably help with organizing discovery documents or even drafting routine client updates.' " \
                  f"Now, generate a similar type of casual, practical, single sentence for the {sector} industry."
         
-        try:
-            print(f"Requesting ChatGPT suggestion for sector: {sector}...")
-            response = openai.chat.completions.create(
-                model="gpt-4.1", 
-                messages=[
-                    {"role": "system", "content": "You are an assistant that generates concise and relevant AI automation ideas for email outreach."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=70, 
-                temperature=0.75 
-            )
-            suggestion = response.choices[0].message.content.strip()
-            # Ensure it's a single sentence and doesn't have unwanted prefixes/suffixes if any.
-            suggestion = suggestion.split('\n')[0] # Take first line if multiple
-            if suggestion.startswith('"') and suggestion.endswith('"'):
-                suggestion = suggestion[1:-1]
+        print(f"Requesting ChatGPT suggestion for sector: {sector}...")
+        metrics.inc('email_bot_api_calls_total', api='openai', operation='chat.completions')
+        response = self._openai().chat.completions.create(
+            model="gpt-4.1", 
+            messages=[
+                {"role": "system", "content": "You are an assistant that generates concise and relevant AI automation ideas for email outreach."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=70, 
+            temperature=0.75 
+        )
+        suggestion = response.choices[0].message.content.strip()
+        # Ensure it's a single sentence and doesn't have unwanted prefixes/suffixes if any.
+        suggestion = suggestion.split('\n')[0] # Take first line if multiple
+        if suggestion.startswith('"') and suggestion.endswith('"'):
+            suggestion = suggestion[1:-1]
 
-            print(f"ChatGPT suggestion for {sector}: {suggestion}")
-            return suggestion
-        except Exception as e:
-            print(f"Error getting ChatGPT suggestion for {sector}: {str(e)}")
-            return ""
+        print(f"ChatGPT suggestion for {sector}: {suggestion}")
+        return suggestion
+    
+    def prewarm_suggestions(self, max_workers=None, retries=None) -> Dict[str, int]:
+        """
+        Generate ChatGPT suggestions for every sector in the pending recipients ahead of sending
+
+        Suggestions are stored in the suggestion cache, so the send loop only
+        does a lookup for these sectors.
+
+        Args:
+            max_workers: Maximum number of concurrent ChatGPT requests
+            retries: Attempts per suggestion before giving up
+
+        Returns:
+            Counts of sectors found, suggestions generated and suggestions that failed
+        """
+        max_workers = max_workers or int(os.environ.get('AI_PREWARM_WORKERS', 8))
+        retries = retries or int(os.environ.get('AI_PREWARM_RETRIES', 4))
+        
+        if not self.openai_api_key:
+            print("Skipping pre-warm: OpenAI API key not configured.")
+            return {'sectors': 0, 'generated': 0, 'failed': 0}
+        
+        status_column_index = self.recipient_source.find_status_column_index(self.status_column)
+        # Stream the recipients so only the sectors are kept in memory
+        recipients = self.recipient_source.iter_recipients(
+            status_column_index=status_column_index,
+            status_filter="Not Sent"
+        )
+        
+        # One entry per normalized sector, keeping the first spelling seen
+        sectors = {}
+        for recipient in recipients:
+            sector = self._recipient_sector(recipient)
+            if sector:
+                sectors.setdefault(normalize_sector(sector), sector)
+        
+        jobs = []
+        for sector in sectors.values():
+            jobs.extend([sector] * self.suggestion_cache.missing_variants(sector))
+        print(f"Pre-warming {len(jobs)} suggestions for {len(sectors)} sectors with {max_workers} workers...")
+        
+        retry_policy = RetryPolicy(max_attempts=retries, name='openai')
+        
+        def generate(sector):
+            try:
+                suggestion = retry_policy.call(
+                    self._request_chatgpt_suggestion, sector,
+                    description=f"ChatGPT suggestion for {sector}"
+                )
+            except Exception as e:
+                print(f"Giving up on ChatGPT suggestion for {sector}: {str(e)}")
+                return False
+            self.suggestion_cache.add(sector, suggestion)
+            return True
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(generate, jobs))
+        
+        summary = {
+            'sectors': len(sectors),
+            'generated': sum(1 for ok in results if ok),
+            'failed': sum(1 for ok in results if not ok)
+        }
+        print(f"Pre-warm finished: {summary}")
+        return summary
     
     def _can_send_email(self):
         """Check if we can send an email (limits and timing)"""
@@ -122,112 +413,221 @@ class EmailBot:
         
         return True
     
+    def _seconds_until_next_send(self) -> float:
+        """Seconds to wait before the next email is allowed by the interval (0 if it can go now)"""
+        if self._can_send_email():
+            return 0.0
+        
+        wait_time = self.interval_minutes * 60
+        if self.last_sent_time:
+            elapsed = (datetime.datetime.now() - self.last_sent_time).total_seconds()
+            wait_time = max(0, (self.interval_minutes * 60) - elapsed)
+        return wait_time
+    
     def send_emails(self):
         """Main function to send emails"""
         while self.emails_sent_today < self.daily_limit:
-            if not self._can_send_email():
+            if self.send_schedule is not None:
+                # Sleep until the next planned slot, which already includes the jitter
+                if not self.send_schedule.acquire():
+                    print("No send slots left today. Exiting.")
+                    break
+            elif not self._can_send_email():
                 # If we can't send now, wait until next interval
-                wait_time = self.interval_minutes * 60
-                if self.last_sent_time:
-                    elapsed = (datetime.datetime.now() - self.last_sent_time).total_seconds()
-                    wait_time = max(0, (self.interval_minutes * 60) - elapsed)
-                
+                wait_time = self._seconds_until_next_send()
                 print(f"Waiting {wait_time:.1f} seconds until next email...")
                 time.sleep(wait_time)
                 continue
             
-            # Get recipients who haven't been emailed yet
-            recipients = self.sheets_handler.get_recipients(
-                status_column_index=self.status_column_index,
-                status_filter="Not Sent"
-            )
+            # Take the next recipient who hasn't been emailed yet
+            recipient = self._next_recipient()
             
-            if not recipients:
+            if not recipient:
                 print("No more recipients to email. Exiting.")
                 break
             
-            # Take the first available recipient
-            recipient = recipients[0]
-            
-            # Add some randomness to avoid exact same timing
-            jitter = random.randint(1, 30)  # Random 1-30 second jitter
-            time.sleep(jitter)
+            if self.send_schedule is None:
+                # Add some randomness to avoid exact same timing
+                jitter = random.randint(1, 30)  # Random 1-30 second jitter
+                time.sleep(jitter)
             
             # Send the email
             success = self._send_email_to_recipient(recipient)
-            
-            if success:
-                self.emails_sent_today += 1
-                self.last_sent_time = datetime.datetime.now()
-                print(f"Emails sent today: {self.emails_sent_today}/{self.daily_limit}")
-                
-                # Update status in spreadsheet
-                self.sheets_handler.update_status(
-                    row_index=recipient['_row_index'],
-                    status_column=self.status_column,
-                    status="Sent"
-                )
-            else:
-                # Mark as failed in spreadsheet
-                self.sheets_handler.update_status(
-                    row_index=recipient['_row_index'],
-                    status_column=self.status_column,
-                    status="Failed"
-                )
+            self._record_result(recipient, success)
+            if not success and self.send_schedule is not None:
+                # Only sent emails use up the daily allowance; the slot is planned again
+                self.send_schedule.refund_total()
             
             # If we've reached the daily limit, stop
             if self.emails_sent_today >= self.daily_limit:
                 print(f"Daily limit of {self.daily_limit} emails reached.")
                 break
     
-    def _send_email_to_recipient(self, recipient: Dict[str, Any]) -> bool:
-        """Send an email to a specific recipient"""
+    def _next_recipient(self, stop_event=None, wait=True) -> Optional[Dict[str, Any]]:
+        """
+        Take the next recipient to email, holding back those outside their local send window
+
+        Without SEND_TIMEZONE_COLUMN this is just the recipient queue. With it,
+        recipients whose own time zone is outside the send windows are held by
+        the send schedule and handed out once their window opens. Once the
+        schedule holds as many as it may, no more are taken from the queue
+        until a held one is sent.
+
+        Args:
+            stop_event: Event that aborts waiting for a held recipient
+            wait: When only held recipients are left, wait for the first one's
+                window to open (if that's before today's windows close)
+
+        Returns:
+            Recipient record, or None when no recipient can be emailed
+        """
+        schedule = self.send_schedule
+        if schedule is None or not schedule.timezone_column:
+            return self.recipient_queue.next()
+        
+        while True:
+            recipient = schedule.pop_due_deferred()
+            if recipient is not None:
+                return recipient
+            
+            # Recipients beyond the cap stay in the queue instead of piling up in memory
+            recipient = None if schedule.deferred_full else self.recipient_queue.next()
+            if recipient is None:
+                due = schedule.next_deferred_time()
+                closes_at = schedule.closes_at()
+                if not wait or due is None or closes_at is None or due >= closes_at:
+                    return None
+                wait_time = max(0.0, due - time.time())
+                print(f"Waiting {wait_time:.1f} seconds for the next recipient's local send window...")
+                if stop_event is not None:
+                    if stop_event.wait(wait_time):
+                        return None
+                else:
+                    time.sleep(wait_time)
+                continue
+            
+            wait_time = schedule.recipient_wait(recipient)
+            if wait_time <= 0:
+                return recipient
+            schedule.defer(recipient, time.time() + wait_time)
+    
+    def _record_result(self, recipient: Dict[str, Any], success: Optional[bool]) -> None:
+        """
+        Update the counters and the recipient's status after a send attempt
+
+        A success of None means the email wasn't sent because another worker
+        took over the row, which then gets its status from that worker.
+        """
+        if success is None:
+            return
+        if success:
+            self.emails_sent_today += 1
+            self.last_sent_time = datetime.datetime.now()
+            print(f"Emails sent today: {self.emails_sent_today}/{self.daily_limit}")
+            status = "Sent"
+        else:
+            # Mark as failed in spreadsheet
+            status = "Failed"
+        
+        # With several mailboxes, the journal keeps which one sent it, to restore its daily count
+        mailbox = self.sender_pool.pop_sent_from(recipient['email']) if self.sender_pool and success else None
+        self.send_journal.record_result(recipient, status, mailbox=mailbox)
+        metrics.inc('email_bot_emails_total', status=status)
+        
+        # Update status in spreadsheet
+        self._write_status(recipient['_row_index'], status)
+        self.send_journal.record_written(recipient['_row_index'], status)
+        self.recipient_queue.mark(recipient['_row_index'], status)
+        if self.lease_store:
+            self.lease_store.complete({recipient['_row_index']: status})
+    
+    def _screen_recipients(self, recipients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drop suppressed and duplicate addresses from a page of recipients
+
+        Called by the recipient queue before the recipients reach the ChatGPT
+        call or the send. The skipped rows get their status in one batch.
+
+        Returns:
+            The recipients that may be emailed
+        """
+        kept = []
+        skipped = []
+        if self.lease_store:
+            # Rows another worker holds are left to it; rows whose sender stopped mid-send are in doubt
+            recipients, interrupted = self.lease_store.claim(recipients)
+            skipped.extend((recipient, self.in_doubt_status) for recipient in interrupted)
+        for recipient in recipients:
+            reason = self.suppression_index.claim(recipient.get('email', ''))
+            if reason is None:
+                kept.append(recipient)
+            else:
+                skipped.append((recipient, self.skip_statuses[reason]))
+        
+        if skipped:
+            statuses = {recipient['_row_index']: status for recipient, status in skipped}
+            self.send_journal.record_results(skipped)
+            self.status_writer.update_statuses(statuses, self.status_column)
+            if self.sheets_sync is not None:
+                self.sheets_sync.update_statuses(statuses, self.status_column)
+            self.send_journal.record_written_rows(statuses)
+            for row_index, status in statuses.items():
+                self.recipient_queue.mark(row_index, status)
+                metrics.inc('email_bot_emails_total', status=status)
+            if self.lease_store:
+                self.lease_store.complete(statuses)
+            print(f"Skipped {len(skipped)} suppressed, duplicate or interrupted recipients.")
+        return kept
+    
+    def _load_emailed_addresses(self) -> None:
+        """Let the suppression index skip addresses this campaign already emailed, or may have"""
+        self.suppression_index.add_emailed(self.send_journal.emailed_addresses(('Sent', self.in_doubt_status)))
+    
+    def _write_status(self, row_index: int, status: str) -> None:
+        """Queue a status update for the recipient source, and for the sheet when mirroring to it"""
+        self.status_writer.update_status(row_index=row_index, status_column=self.status_column, status=status)
+        if self.sheets_sync is not None:
+            self.sheets_sync.update_status(row_index=row_index, status_column=self.status_column, status=status)
+    
+    def _begin_sends(self, recipients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Record the intent to email these recipients, right before handing them to Graph
+
+        Returns:
+            The recipients that may be sent; with worker leases, rows whose lease
+            was taken over by another worker are left out
+        """
+        if self.lease_store:
+            held = self.lease_store.begin_sending(recipients)
+            if len(held) < len(recipients):
+                print(f"Lost the lease on {len(recipients) - len(held)} rows to another worker; not sending them.")
+            recipients = held
+        if recipients:
+            self.send_journal.record_intents(recipients)
+        return recipients
+    
+    def send_emails_pipelined(self):
+        """Send emails with the concurrent pipeline, paced by the shared rate limiter"""
+        pipeline = SendPipeline(self, self.rate_limiter)
+        pipeline.run()
+        
+        if self.emails_sent_today >= self.daily_limit:
+            print(f"Daily limit of {self.daily_limit} emails reached.")
+    
+    def _send_email_to_recipient(self, recipient: Dict[str, Any]) -> Optional[bool]:
+        """Send an email to a specific recipient (None if another worker took over the row)"""
         try:
             # Check if recipient has email
             if 'email' not in recipient or not recipient['email']:
                 print(f"No email address for recipient in row {recipient['_row_index']}")
                 return False
             
-            # Ensure 'sector' key exists, even if empty, for template filling
-            recipient_sector = recipient.get('Sector', '')
-            if isinstance(recipient_sector, list): # Handle potential list type from sheets
-                recipient_sector = recipient_sector[0] if recipient_sector else ''
-
-            recipient['sector'] = recipient_sector if recipient_sector else "your industry" # Provide fallback for subject
-
-            # --- DEBUG PRINT --- 
-            print(f"DEBUG: For recipient {recipient.get('email')}, Sector: '{recipient_sector}', OpenAI Key Loaded: {bool(self.openai_api_key)}")
-            # --- END DEBUG PRINT ---
+            self._enrich_recipient(recipient)
+            current_subject, current_email_body = self._render_email(recipient)
 
-            chatgpt_suggestion = ""
-            if recipient_sector and self.openai_api_key:
-                chatgpt_suggestion = self._get_chatgpt_suggestion(recipient_sector)
-            
-            recipient['sector_specific_ai_idea'] = chatgpt_suggestion
-            
-            full_filled_html = self.template_handler.fill_template(recipient)
-            
-            subject_match = re.search(r'<title>(.*?)</title>', full_filled_html, re.IGNORECASE | re.DOTALL)
-            # Fallback subject if title tag is missing or empty, or if sector was empty
-            default_subject = f"AI Automation Idea for {recipient_sector if recipient_sector else 'Your Business'}"
-            current_subject = default_subject
-            if subject_match:
-                extracted_subject = subject_match.group(1).strip()
-                if extracted_subject and "{sector}" not in extracted_subject: # Check if placeholder was filled
-                    current_subject = extracted_subject
-                elif not recipient_sector: # if sector is empty, title might be "automation in {} idea"
-                     current_subject = "AI Automation Idea"
-
-
-            email_content_match = re.search(r'<body>(.*?)</body>', full_filled_html, re.IGNORECASE | re.DOTALL)
-            current_email_body = full_filled_html 
-            if email_content_match:
-                current_email_body = email_content_match.group(1).strip()
-            else: # If no body tag, maybe it's a fragment, use as is but log.
-                print(f"Warning: <body> tag not found in template for recipient {recipient.get('email')}. Sending full template content.")
-
-
-            success = self.outlook_sender.send_email(
+            if not self._begin_sends([recipient]):
+                return None
+            success = self.mail_sender.send_email(
                 to_email=recipient['email'],
                 subject=current_subject,
                 content_html=current_email_body
@@ -238,15 +638,65 @@ class EmailBot:
             print(f"Error sending email to {recipient.get('email', 'unknown')}: {str(e)}")
             return False
 
+    def _enrich_recipient(self, recipient: Dict[str, Any]) -> None:
+        """Add the sector and the ChatGPT suggestion to the recipient's template data"""
+        # Ensure 'sector' key exists, even if empty, for template filling
+        recipient_sector = self._recipient_sector(recipient)
+
+        recipient['_sector'] = recipient_sector
+        recipient['sector'] = recipient_sector if recipient_sector else "your industry" # Provide fallback for subject
+
+        # --- DEBUG PRINT --- 
+        print(f"DEBUG: For recipient {recipient.get('email')}, Sector: '{recipient_sector}', OpenAI Key Loaded: {bool(self.openai_api_key)}")
+        # --- END DEBUG PRINT ---
+
+        chatgpt_suggestion = ""
+        if recipient_sector and self.openai_api_key:
+            chatgpt_suggestion = self._get_sector_suggestion(recipient_sector)
+        
+        recipient['sector_specific_ai_idea'] = chatgpt_suggestion
+
+    def _recipient_sector(self, recipient: Dict[str, Any]) -> str:
+        """Get the recipient's sector from the sheet row, or '' if it has none"""
+        recipient_sector = recipient.get('Sector', '')
+        if isinstance(recipient_sector, list): # Handle potential list type from sheets
+            recipient_sector = recipient_sector[0] if recipient_sector else ''
+        return recipient_sector
+
+    @metrics.timed('render')
+    def _render_email(self, recipient: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Fill the template for an enriched recipient
+
+        Returns:
+            Tuple of (subject, HTML body)
+        """
+        extracted_subject, current_email_body = self.template_handler.render_email(recipient)
+        current_subject = email_subject(extracted_subject, recipient.get('_sector', ''))
+
+        if not self.template_handler.has_body: # If no body tag, maybe it's a fragment, use as is but log.
+            print(f"Warning: <body> tag not found in template for recipient {recipient.get('email')}. Sending full template content.")
+
+        return current_subject, current_email_body
+
     def run(self):
         """Run the email bot"""
         try:
             # Initialize the bot
-            self.initialize()
+            self.initialize(start_scheduler=False)
+            
+            # Cron-triggered runs usually find nothing to do; stop before starting anything else
+            if not len(self.recipient_queue):
+                print("No pending recipients. Exiting.")
+                return
+            self._start_scheduler()
             
             # Main email sending loop
             print("Starting to send emails...")
-            self.send_emails()
+            if self.send_mode == 'pipeline':
+                self.send_emails_pipelined()
+            else:
+                self.send_emails()
             
             print("Email sending process completed.")
         except KeyboardInterrupt:
@@ -254,13 +704,94 @@ class EmailBot:
         except Exception as e:
             print(f"Error running email bot: {str(e)}")
         finally:
-            # Shutdown the scheduler
-            if self.scheduler.running:
-                self.scheduler.shutdown()
-                print("Scheduler shut down.")
+            self.shutdown()
+    
+    def shutdown(self):
+        """Stop background work and flush everything still buffered"""
+        if self.template_watcher:
+            self.template_watcher.stop()
+        if self.sender_pool:
+            self.sender_pool.stop_event.set()
+        
+        # Write any buffered status updates before exiting
+        if self.status_writer is not None:
+            self.status_writer.close()
+            print("Pending sheet updates flushed.")
+        if self.sheets_sync is not None:
+            self.sheets_sync.close()
+        self.recipient_source.close()
+        self.suggestion_cache.close()
+        self.send_journal.close()
+        if self.lease_store:
+            # Rows still queued here go back to the other workers straight away
+            self.lease_store.close()
+        
+        # Shutdown the scheduler
+        if self.scheduler is not None and self.scheduler.running:
+            self.scheduler.shutdown()
+            print("Scheduler shut down.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send personalized emails to the contacts in a Google Sheet.")
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help="Send emails (default)")
+    run_parser.add_argument('--async', dest='use_async', action='store_true',
+                            help="Run on asyncio so waits don't block; required for several --sheet campaigns")
+    run_parser.add_argument('--sheet', action='append', default=[],
+                            help="Google Sheet ID to run a campaign for (repeatable, defaults to GOOGLE_SHEET_ID)")
+    run_parser.add_argument('--health-port', type=int, default=None,
+                            help="Port for the JSON health endpoint in --async mode (defaults to HEALTH_PORT)")
+    run_parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Port for the Prometheus /metrics endpoint (defaults to METRICS_PORT)")
+    prewarm_parser = subparsers.add_parser('prewarm', help="Generate ChatGPT suggestions for pending recipients ahead of sending")
+    prewarm_parser.add_argument('--workers', type=int, default=None, help="Maximum number of concurrent ChatGPT requests")
+    prewarm_parser.add_argument('--retries', type=int, default=None, help="Attempts per suggestion before giving up")
+    export_parser = subparsers.add_parser('export', help="Render every pending email to files without sending")
+    export_parser.add_argument('output', help="A .jsonl or .mbox file, or a directory to write one .eml file per email to")
+    export_parser.add_argument('--format', dest='export_format', choices=['jsonl', 'eml', 'mbox'], default=None,
+                               help="Output format (defaults to the output's extension, else eml)")
+    export_parser.add_argument('--workers', type=int, default=None, help="Number of render processes")
+    export_parser.add_argument('--batch-size', type=int, default=None, help="Recipients per batch sent to a render process")
+    args = parser.parse_args(argv)
+    
+    if args.command == 'export':
+        from campaign_export import CampaignExporter
+        bot = EmailBot()
+        try:
+            CampaignExporter(bot, args.output, export_format=args.export_format,
+                             workers=args.workers, batch_size=args.batch_size).run()
+        finally:
+            bot.recipient_source.close()
+            bot.suggestion_cache.close()
+            bot.send_journal.close()
+        return
+    
+    if args.command == 'prewarm':
+        bot = EmailBot()
+        try:
+            bot.prewarm_suggestions(max_workers=args.workers, retries=args.retries)
+        finally:
+            bot.suggestion_cache.close()
+        return
+    
+    # Per-stage latency and API call metrics over HTTP and/or as a JSON file
+    exporter = MetricsExporter(port=getattr(args, 'metrics_port', None))
+    if exporter.enabled:
+        exporter.start()
+    try:
+        if args.command == 'run' and (args.use_async or len(args.sheet) > 1):
+            from async_runner import run_campaigns
+            bots = [EmailBot(sheet_id=sheet_id) for sheet_id in args.sheet] or [EmailBot()]
+            asyncio.run(run_campaigns(bots, health_port=args.health_port))
+        else:
+            # Create and run the email bot
+            bot = EmailBot(sheet_id=args.sheet[0] if getattr(args, 'sheet', None) else None)
+            bot.run()
+    finally:
+        if exporter.enabled:
+            exporter.stop()
 
 
 if __name__ == "__main__":
-    # Create and run the email bot
-    bot = EmailBot()
-    bot.run() 
\ No newline at end of file
+    main()
\ No newline at end of file
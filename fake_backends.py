@@ -0,0 +1,341 @@
+import re
+import json as json_module
+import time
+import random
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
+
+class FakeHttpError(Exception):
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        """Error shaped like googleapiclient's HttpError, so RetryPolicy classifies it the same way"""
+        super().__init__(f"Fake HTTP {status}")
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        # HttpError keeps an httplib2 response, a dict of headers with a .status attribute
+        self.resp = type('FakeHttpResponse', (dict,), {})(headers)
+        self.resp.status = status
+
+class FakeBackend:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0.05, seed=None):
+        """
+        Shared behaviour of the in-process fakes: latency, failures and call counts
+
+        Args:
+            latency: Seconds every call takes
+            jitter: Extra random seconds added on top of latency (uniform 0..jitter)
+            error_rate: Share of calls that fail with a transient server error
+            throttle_rate: Share of calls that are throttled (429 with Retry-After)
+            retry_after: Seconds asked for in the Retry-After header of throttled calls
+            seed: Seed for the random failures, for repeatable runs
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self, name: str) -> None:
+        """Count a call and wait for its latency"""
+        with self._lock:
+            self.calls[name] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _call(self, name: str) -> Optional[int]:
+        """
+        Count a call, wait for its latency and pick its outcome
+
+        Returns:
+            None for a successful call, otherwise the HTTP status it fails with
+        """
+        self._wait(name)
+        roll = self._roll()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+class _FakeRequest:
+    def __init__(self, backend: 'FakeSheetsService', name: str, action):
+        self.backend = backend
+        self.name = name
+        self.action = action
+
+    def execute(self):
+        status = self.backend._call(self.name)
+        if status is not None:
+            raise FakeHttpError(status, self.backend.retry_after if status == 429 else None)
+        return self.action()
+
+class FakeSheetsService(FakeBackend):
+    def __init__(self, grid: List[List[str]], **kwargs):
+        """
+        In-process stand-in for the googleapiclient Sheets service
+
+        Supports the spreadsheets().values() calls GoogleSheetsHandler makes
+        (get, batchGet, update, batchUpdate) against a list of rows in memory.
+
+        Args:
+            grid: Sheet contents, one list of cell values per row, header row first
+            **kwargs: Latency and failure settings, see FakeBackend
+        """
+        super().__init__(**kwargs)
+        self.grid = grid
+
+    def spreadsheets(self) -> 'FakeSheetsService':
+        return self
+
+    def values(self) -> 'FakeSheetsService':
+        return self
+
+    def _bounds(self, a1_range: str):
+        cells = a1_range.rpartition('!')[2]
+        start, _, end = cells.partition(':')
+        start_col, start_row = re.match(r'([A-Z]*)(\d*)', start).groups()
+        if not end:
+            end_col, end_row = start_col, start_row
+        else:
+            end_col, end_row = re.match(r'([A-Z]*)(\d*)', end).groups()
+        return (
+            _column_index(start_col) if start_col else 0,
+            int(start_row) - 1 if start_row else 0,
+            _column_index(end_col) + 1 if end_col else None,
+            int(end_row) if end_row else None,
+        )
+
+    def _read(self, a1_range: str) -> Dict[str, Any]:
+        first_col, first_row, end_col, end_row = self._bounds(a1_range)
+        rows = []
+        for row in self.grid[first_row:end_row]:
+            cells = row[first_col:end_col]
+            # Like the real API, trailing empty cells and rows are not returned
+            while cells and cells[-1] == '':
+                cells = cells[:-1]
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+        return {'range': a1_range, 'values': rows} if rows else {'range': a1_range}
+
+    def _write(self, a1_range: str, values: List[List[Any]]) -> None:
+        first_col, first_row, _, _ = self._bounds(a1_range)
+        for offset, row_values in enumerate(values):
+            while len(self.grid) <= first_row + offset:
+                self.grid.append([])
+            row = self.grid[first_row + offset]
+            if len(row) < first_col + len(row_values):
+                row.extend([''] * (first_col + len(row_values) - len(row)))
+            row[first_col:first_col + len(row_values)] = row_values
+
+    def get(self, spreadsheetId, range, **kwargs) -> _FakeRequest:
+        return _FakeRequest(self, 'values.get', lambda: self._read(range))
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs) -> _FakeRequest:
+        return _FakeRequest(self, 'values.batchGet',
+                            lambda: {'valueRanges': [self._read(a1_range) for a1_range in ranges]})
+
+    def update(self, spreadsheetId, range, valueInputOption, body) -> _FakeRequest:
+        return _FakeRequest(self, 'values.update', lambda: self._write(range, body['values']))
+
+    def batchUpdate(self, spreadsheetId, body) -> _FakeRequest:
+        def action():
+            for update in body['data']:
+                self._write(update['range'], update['values'])
+            return {'totalUpdatedCells': sum(len(update['values']) for update in body['data'])}
+        return _FakeRequest(self, 'values.batchUpdate', action)
+
+
+class FakeGraphResponse:
+    def __init__(self, status_code: int, payload: Optional[Dict[str, Any]] = None, headers=None):
+        """Minimal requests.Response with the attributes OutlookSender reads"""
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = payload
+        self.text = '' if payload is None else str(payload)
+
+    def json(self) -> Dict[str, Any]:
+        return self._payload or {}
+
+class FakeGraphSession(FakeBackend):
+    def __init__(self, permanent_error_rate=0.0, **kwargs):
+        """
+        In-process stand-in for the requests.Session OutlookSender posts to Graph with
+
+        sendMail answers 202; $batch answers 200 with a result per request. Every
+        email (alone or inside a batch) independently gets the configured latency
+        and failure odds, so a batch takes as long as one call but can partly fail.
+        Emails with large attachments go through a draft, an upload session (or
+        a request per attachment) and a send call; only the send call can fail.
+
+        Args:
+            permanent_error_rate: Share of emails rejected with 400 (not retried)
+            **kwargs: Latency and failure settings, see FakeBackend
+        """
+        super().__init__(**kwargs)
+        self.permanent_error_rate = permanent_error_rate
+        self.emails = Counter()
+        # Bytes uploaded to each upload session
+        self.uploads = Counter()
+        self._drafts = 0
+
+    def _outcome(self) -> FakeGraphResponse:
+        roll = self._roll()
+        if roll < self.throttle_rate:
+            return FakeGraphResponse(429, {'error': {'code': 'TooManyRequests'}},
+                                     {'Retry-After': str(self.retry_after)})
+        if roll < self.throttle_rate + self.error_rate:
+            return FakeGraphResponse(503, {'error': {'code': 'ServiceUnavailable'}})
+        if roll < self.throttle_rate + self.error_rate + self.permanent_error_rate:
+            return FakeGraphResponse(400, {'error': {'code': 'ErrorInvalidRecipients'}})
+        return FakeGraphResponse(202)
+
+    def post(self, url, headers=None, json=None, data=None, **kwargs) -> FakeGraphResponse:
+        if json is None and data is not None:
+            json = json_module.loads(data)
+        if url.endswith('/$batch'):
+            # The whole batch shares one round trip; failures are decided per email
+            self._wait('$batch')
+            responses = []
+            for request in json.get('requests', []):
+                outcome = self._outcome()
+                with self._lock:
+                    self.emails[outcome.status_code] += 1
+                responses.append({'id': request['id'], 'status': outcome.status_code,
+                                  'headers': outcome.headers, 'body': outcome._payload})
+            return FakeGraphResponse(200, {'responses': responses})
+
+        if url.endswith('/messages'):
+            self._wait('createDraft')
+            with self._lock:
+                self._drafts += 1
+                return FakeGraphResponse(201, {'id': f'draft-{self._drafts}'})
+        if url.endswith('/attachments'):
+            self._wait('addAttachment')
+            return FakeGraphResponse(201, {'id': json['name']})
+        if url.endswith('/createUploadSession'):
+            self._wait('createUploadSession')
+            return FakeGraphResponse(201, {'uploadUrl': f'https://upload.invalid/{url.split("/")[-3]}/'
+                                                        f'{json["AttachmentItem"]["name"]}'})
+
+        self._wait('sendMail')
+        outcome = self._outcome()
+        with self._lock:
+            self.emails[outcome.status_code] += 1
+        return outcome
+
+    def put(self, url, headers=None, data=b'', **kwargs) -> FakeGraphResponse:
+        self._wait('uploadChunk')
+        with self._lock:
+            self.uploads[url] += len(data)
+        return FakeGraphResponse(200, {'nextExpectedRanges': []})
+
+    def delete(self, url, headers=None, **kwargs) -> FakeGraphResponse:
+        return FakeGraphResponse(204)
+
+class FakeMsalApp:
+    def __init__(self, *args, **kwargs):
+        """
+        Stand-in for msal.ConfidentialClientApplication
+
+        Like MSAL, it keeps handing out the cached token until the cache is
+        cleared; each new token gets a new number.
+        """
+        self.token_requests = 0
+        self.tokens_issued = 0
+        self._token = None
+
+    def acquire_token_for_client(self, scopes, **kwargs) -> Dict[str, Any]:
+        self.token_requests += 1
+        if self._token is None:
+            self.tokens_issued += 1
+            self._token = f'fake-token-{self.tokens_issued}'
+        return {'access_token': self._token, 'expires_in': 3600}
+
+    def remove_tokens_for_client(self) -> None:
+        self._token = None
+
+
+class FakeOpenAI(FakeBackend):
+    def __init__(self, **kwargs):
+        """
+        Stand-in for the openai module's chat.completions.create
+
+        Install it with mock.patch.object(openai, 'chat', fake.chat).
+
+        Args:
+            **kwargs: Latency and failure settings, see FakeBackend
+        """
+        super().__init__(**kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        # Suggestions handed out per sector, so each sector gets its own run of distinct answers
+        self.sector_calls = Counter()
+
+    def create(self, model, messages, **kwargs):
+        status = self._call('chat.completions')
+        if status is not None:
+            error = Exception(f"Fake OpenAI error {status}")
+            error.status_code = status
+            error.response = FakeGraphResponse(status, headers={'Retry-After': str(self.retry_after)}
+                                               if status == 429 else {})
+            raise error
+        match = re.search(r'specific to the (.+?) field', messages[-1]['content'])
+        sector = match.group(1) if match else 'your'
+        # Vary the answer per sector like the real model does, so the suggestion cache can fill its pool
+        with self._lock:
+            variant = self.sector_calls[sector]
+            self.sector_calls[sector] += 1
+        ideas = [
+            f"AI could probably take care of routine paperwork in {sector} offices.",
+            f"A small AI tool might sort and answer the usual {sector} inbox questions.",
+            f"AI could draft the weekly status updates most {sector} teams write by hand.",
+            f"An AI helper might keep {sector} appointment reminders and follow-ups on track.",
+        ]
+        idea = ideas[variant % len(ideas)]
+        if variant >= len(ideas):
+            # Pools larger than the list of ideas still get distinct texts
+            idea = f"{idea[:-1]} (take {variant // len(ideas) + 1})."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=idea))])
+
+
+class NoJitter:
+    """Replaces the random module in email_bot so the 1-30 second send jitter is skipped"""
+    @staticmethod
+    def randint(a, b):
+        return 0
+
+def build_grid(recipients: int, sectors: int = 0, status: str = 'Not Sent') -> List[List[str]]:
+    """
+    Build sheet contents with one recipient per row (row 2 is the first recipient)
+
+    Args:
+        recipients: Number of recipient rows
+        sectors: Number of distinct sectors the recipients are spread over
+            (0 leaves the Sector column empty)
+        status: Status every row starts with
+    """
+    grid = [['name', 'email', 'company_name', 'Sector', 'Status', 'Date']]
+    sector_names = [f'Sector {i}' for i in range(sectors)] or ['']
+    for i in range(recipients):
+        grid.append([f'Contact {i}', f'contact{i}@example.com', f'Company {i}',
+                     sector_names[i % len(sector_names)], status, ''])
+    return grid
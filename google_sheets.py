@@ -1,29 +1,60 @@
 import os
+import re
 import json
-import datetime
-from typing import List, Dict, Any
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from dotenv import load_dotenv
 
+from metrics import metrics
+from recipient_source import RecipientRecord, RecipientSource, column_letter, status_date
+from retry_policy import RetryPolicy
+
 # Load environment variables from .env.local
 load_dotenv('.env.local')
 
 # Define the scopes
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
-class GoogleSheetsHandler:
-    def __init__(self):
-        self.sheet_id = os.environ.get('GOOGLE_SHEET_ID')
-        self.sheet_range = os.environ.get('GOOGLE_SHEET_RANGE', 'Sheet1!A1:Z1000')
+class GoogleSheetsHandler(RecipientSource):
+    def __init__(self, sheet_id=None, sheet_range=None):
+        """
+        Args:
+            sheet_id: Google Sheet ID (defaults to GOOGLE_SHEET_ID)
+            sheet_range: A1 range holding the recipients (defaults to GOOGLE_SHEET_RANGE)
+        """
+        self.sheet_id = sheet_id or os.environ.get('GOOGLE_SHEET_ID')
+        self.sheet_range = sheet_range or os.environ.get('GOOGLE_SHEET_RANGE', 'Sheet1!A1:Z1000')
         self.creds = None
-        self.service = None
-        self._authenticate()
+        self._local = threading.local()
+        self._shared_service = None
+        
+        # Retries throttled (429) and transient (5xx, network) API errors
+        self.retry_policy = RetryPolicy(name='sheets')
+        
+        # Cached header row and header -> column index map
+        self._headers = None
+        self._header_index = {}
+        
+        # Rows fetched per request when reading recipients
+        self.read_chunk_rows = int(os.environ.get('SHEETS_READ_CHUNK_ROWS', 5000))
+        # Pending rows fetched per batchGet after a status column scan
+        self.fetch_batch_rows = int(os.environ.get('SHEETS_FETCH_BATCH_ROWS', 100))
+        # Status cells read per request when scanning for pending rows
+        self.scan_chunk_rows = int(os.environ.get('SHEETS_SCAN_CHUNK_ROWS', 20000))
+        self._auth_lock = threading.Lock()
 
     def _authenticate(self):
-        """Authenticate with Google Sheets API"""
+        """
+        Authenticate with Google Sheets API
+
+        Called on the first API request rather than at startup, so a run with
+        nothing to send (or one using a stand-in client) never loads the Google
+        auth libraries or opens the token file.
+        """
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
         creds = None
         token_file = os.environ.get('GOOGLE_SHEETS_TOKEN_FILE', 'token.json')
         credentials_file = os.environ.get('GOOGLE_SHEETS_CREDENTIALS_FILE', 'credentials.json')
@@ -47,131 +78,357 @@ class GoogleSheetsHandler:
                 token.write(creds.to_json())
 
         self.creds = creds
-        self.service = build('sheets', 'v4', credentials=creds)
 
-    def get_recipients(self, status_column_index=None, status_filter="Not Sent") -> List[Dict[str, str]]:
+    @property
+    def service(self):
         """
-        Get recipients from Google Sheets
+        Sheets API client for the calling thread
+
+        The client's httplib2 connection can't be shared between threads, and the
+        status writer and template watcher call the API from their own threads,
+        so each thread builds its own client from the shared credentials.
+        """
+        if self._shared_service is not None:
+            return self._shared_service
         
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            from googleapiclient.discovery import build
+            with self._auth_lock:
+                if self.creds is None:
+                    self._authenticate()
+            # The Sheets discovery document bundled with googleapiclient is used
+            # instead of fetching it over the network for every client
+            service = build('sheets', 'v4', credentials=self.creds,
+                            static_discovery=True, cache_discovery=False)
+            self._local.service = service
+        return service
+
+    @service.setter
+    def service(self, service):
+        """Use one client for every thread (e.g. a stand-in client)"""
+        self._shared_service = service
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.sheet_id
+
+    def _sheet_name(self) -> str:
+        """Name of the sheet (tab) part of the configured range"""
+        return self.sheet_range.split('!')[0]
+
+    def _parse_range(self) -> Tuple[str, str, int, str, Optional[int]]:
+        """
+        Split the configured A1 range into its parts
+
+        Returns:
+            Tuple of (sheet name, first column, first row, last column, last row).
+            The last row is None for open-ended ranges such as 'Sheet1!A:Z'.
+        """
+        sheet_name, _, cells = self.sheet_range.rpartition('!')
+        match = re.match(r'^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$', cells.upper())
+        if not match:
+            raise ValueError(f"Unsupported GOOGLE_SHEET_RANGE: {self.sheet_range}")
+
+        start_col, start_row, end_col, end_row = match.groups()
+        return (
+            sheet_name,
+            start_col or 'A',
+            int(start_row) if start_row else 1,
+            end_col or start_col or 'Z',
+            int(end_row) if end_row else None,
+        )
+
+    def _execute(self, request, description: str = 'Sheets request'):
+        """Execute a Sheets API request under the retry policy"""
+        def attempt():
+            metrics.inc('email_bot_api_calls_total', api='sheets', operation=description)
+            return request.execute()
+        return self.retry_policy.call(attempt, description=description)
+
+    def get_headers(self, refresh: bool = False) -> List[str]:
+        """
+        Get the header row, fetching it only when it is not cached yet
+
+        Args:
+            refresh: Re-read the header row even if it is cached
+
+        Returns:
+            List of header names
+        """
+        if self._headers is None or refresh:
+            sheet = self.service.spreadsheets()
+            result = self._execute(sheet.values().get(spreadsheetId=self.sheet_id, 
+                                                      range=f"{self._sheet_name()}!1:1"), 'Sheets header read')
+            self._set_headers(result.get('values', [[]])[0])
+        return self._headers
+
+    def _set_headers(self, headers: List[str]) -> None:
+        self._headers = list(headers)
+        self._header_index = {}
+        for index, header in enumerate(self._headers):
+            # Keep the first column when a header name is repeated, like list.index
+            self._header_index.setdefault(header, index)
+
+    def invalidate_headers(self) -> None:
+        """Drop the cached header row, e.g. after columns were added or moved in the sheet"""
+        self._headers = None
+        self._header_index = {}
+
+    def get_column_index(self, column: str) -> Optional[int]:
+        """
+        Get the 0-based index of a column by header name
+
+        A miss re-reads the header row once, so columns added to the sheet
+        while the bot is running are picked up.
+
+        Returns:
+            Column index, or None if the sheet has no such header
+        """
+        self.get_headers()
+        if column not in self._header_index:
+            self.get_headers(refresh=True)
+        return self._header_index.get(column)
+
+    def iter_recipient_chunks(self, start_row=None, headers=None, status_column_index=None,
+                              status_filter="Not Sent",
+                              chunk_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        """
+        Read the range page by page, filtering on the status column before building records
+
+        Reading stops at the end of the range, or at the first page that comes back
+        empty.
+
         Args:
+            start_row: First sheet row (1-based) to read. When None the range is read
+                from its first row, which holds the headers.
+            headers: Header row from a previous full read, required with start_row
             status_column_index: Index of the column that contains the email status
             status_filter: Filter to apply to the status column (e.g., "Not Sent")
-            
-        Returns:
-            List of dictionaries with recipient data
+            chunk_size: Rows fetched per request (defaults to SHEETS_READ_CHUNK_ROWS)
+
+        Yields:
+            Tuple of (headers, matching records in the page, index of the last
+            non-empty row read so far)
         """
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.sheet_id, range=self.sheet_range).execute()
-        values = result.get('values', [])
+        sheet_name, start_col, first_row, end_col, end_row = self._parse_range()
+        chunk_size = chunk_size or self.read_chunk_rows
 
-        if not values:
-            print('No data found in the sheet.')
-            return []
+        columns = None
+        filter_index = None
+        if headers is not None:
+            # Duplicate headers map to their last column, like building a dict from the row did
+            columns = {header: index for index, header in enumerate(headers)}
+            if status_column_index is not None and status_column_index < len(headers):
+                filter_index = status_column_index
 
-        headers = values[0]  # First row contains headers
-        recipients = []
+        row = first_row if start_row is None else start_row
+        last_row = row - 1
+        while end_row is None or row <= end_row:
+            page_end = row + chunk_size - 1
+            if end_row is not None:
+                page_end = min(page_end, end_row)
 
-        for i, row in enumerate(values[1:], 1):  # Skip header row
-            # Pad row with empty strings if it's shorter than headers
-            padded_row = row + [''] * (len(headers) - len(row))
-            
-            # Create dictionary with header as key and cell value as value
-            recipient = {headers[j]: padded_row[j] for j in range(len(headers))}
-            
-            # Add row index for later updates
-            recipient['_row_index'] = i + 1  # +1 because we're skipping header
-            
-            # If a status column is specified, filter by it
-            if status_column_index is not None:
-                try:
-                    status = padded_row[status_column_index]
+            # Pages may be read from different threads, so get the calling thread's client each time
+            sheet = self.service.spreadsheets()
+            with metrics.time_stage('sheet_read'):
+                result = self._execute(sheet.values().get(spreadsheetId=self.sheet_id,
+                                                          range=f"{sheet_name}!{start_col}{row}:{end_col}{page_end}"),
+                                       'Sheets read')
+            rows = result.get('values', [])
+            if not rows:
+                if columns is None:
+                    print('No data found in the sheet.')
+                return
+
+            row_offset = row
+            if columns is None:
+                headers = rows[0]  # First row contains headers
+                columns = {header: index for index, header in enumerate(headers)}
+                if first_row == 1 and start_col == 'A':
+                    self._set_headers(headers)
+                # A status column beyond the headers can't be filtered on, so every row is included
+                if status_column_index is not None and status_column_index < len(headers):
+                    filter_index = status_column_index
+                rows = rows[1:]
+                row_offset += 1
+
+            records = []
+            for i, values in enumerate(rows):
+                if filter_index is not None:
+                    status = values[filter_index] if filter_index < len(values) else ''
                     if status != status_filter:
                         continue
-                except IndexError:
-                    pass  # If status column doesn't exist, include all recipients
-            
-            recipients.append(recipient)
+                records.append(RecipientRecord(columns, values, row_offset + i))
 
-        return recipients
+            last_row = row_offset + len(rows) - 1
+            yield headers, records, last_row
+            row = page_end + 1
 
-    def update_status(self, row_index: int, status_column: str, status: str) -> None:
+    def iter_pending_chunks(self, start_row=None, headers=None, status_column_index=None,
+                            status_filter="Not Sent",
+                            batch_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
         """
-        Update the status of an email in the sheet and add today's date
-        
+        Find pending rows from the status column alone, then fetch only those rows
+
+        The status column is read first, SHEETS_SCAN_CHUNK_ROWS cells at a time,
+        which is a small fraction of a wide sheet. The full rows of the pending
+        recipients in each scanned page are then fetched batch_size rows at a
+        time, with consecutive rows merged into one range and all ranges of a
+        batch fetched in a single values.batchGet call.
+
+        Falls back to iter_recipient_chunks when the range doesn't start at A1 or
+        there is no status column to filter on.
+
+        Args:
+            start_row: First sheet row (1-based) to scan. When None the scan starts
+                below the header row.
+            headers: Header row from a previous read (defaults to the cached headers)
+            status_column_index: Index of the column that contains the email status
+            status_filter: Status value a row must have (e.g., "Not Sent")
+            batch_size: Pending rows fetched per batchGet (defaults to SHEETS_FETCH_BATCH_ROWS)
+
+        Yields:
+            Tuple of (headers, matching records in the batch, index of the last
+            row seen by the status scan)
+        """
+        sheet_name, start_col, first_row, end_col, end_row = self._parse_range()
+        if headers is None and first_row == 1 and start_col == 'A':
+            headers = self.get_headers()
+        if (first_row != 1 or start_col != 'A' or not headers or status_column_index is None
+                or status_column_index >= len(headers)):
+            yield from self.iter_recipient_chunks(start_row=start_row, headers=headers,
+                                                  status_column_index=status_column_index,
+                                                  status_filter=status_filter)
+            return
+
+        batch_size = batch_size or self.fetch_batch_rows
+        columns = {header: index for index, header in enumerate(headers)}
+        row = start_row if start_row is not None else first_row + 1
+        while end_row is None or row <= end_row:
+            page_end = row + self.scan_chunk_rows - 1
+            if end_row is not None:
+                page_end = min(page_end, end_row)
+
+            # Phase 1: the status column only
+            status_letter = column_letter(status_column_index)
+            with metrics.time_stage('sheet_read'):
+                result = self._execute(self.service.spreadsheets().values().get(
+                    spreadsheetId=self.sheet_id,
+                    range=f"{sheet_name}!{status_letter}{row}:{status_letter}{page_end}"
+                ), 'Sheets status scan')
+            statuses = result.get('values', [])
+            if not statuses:
+                if start_row is None and row == first_row + 1:
+                    # Headers but no recipients yet; report the header row as seen
+                    yield headers, [], first_row
+                return
+
+            last_row = row + len(statuses) - 1
+            pending = [row + i for i, cell in enumerate(statuses) if cell and cell[0] == status_filter]
+            del statuses
+            if not pending:
+                yield headers, [], last_row
+
+            # Phase 2: full rows for the pending recipients, a batch at a time
+            for batch_start in range(0, len(pending), batch_size):
+                runs = []
+                for row_index in pending[batch_start:batch_start + batch_size]:
+                    if runs and runs[-1][1] == row_index - 1:
+                        runs[-1][1] = row_index
+                    else:
+                        runs.append([row_index, row_index])
+
+                with metrics.time_stage('sheet_read'):
+                    result = self._execute(self.service.spreadsheets().values().batchGet(
+                        spreadsheetId=self.sheet_id,
+                        ranges=[f"{sheet_name}!{start_col}{first}:{end_col}{last}" for first, last in runs]
+                    ), 'Sheets row fetch')
+
+                records = []
+                for (first, last), value_range in zip(runs, result.get('valueRanges', [])):
+                    rows = value_range.get('values', [])
+                    for offset in range(last - first + 1):
+                        values = rows[offset] if offset < len(rows) else []
+                        # The row may have been edited since the scan
+                        status = values[status_column_index] if status_column_index < len(values) else ''
+                        if status != status_filter:
+                            continue
+                        records.append(RecipientRecord(columns, values, first + offset))
+                yield headers, records, last_row
+
+            row = page_end + 1
+
+    def build_status_updates(self, row_index: int, status_column: str, status: str) -> List[Dict[str, Any]]:
+        """
+        Build the cell updates for a status change without sending them
+
         Args:
             row_index: Index of the row to update (1-based)
             status_column: Name of the status column
             status: New status value
+
+        Returns:
+            List of value ranges ({'range': ..., 'values': ...}) for a batchUpdate
         """
-        # First get the headers to find the status column index
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.sheet_id, 
-                                    range=f"{self.sheet_range.split('!')[0]}!1:1").execute()
-        headers = result.get('values', [[]])[0]
+        # Find the status column index from the cached header row
+        status_column_index = self.get_column_index(status_column)
         
-        if status_column not in headers:
+        if status_column_index is None:
             raise ValueError(f"Status column '{status_column}' not found in sheet headers.")
         
-        # Find the status column index
-        status_column_index = headers.index(status_column)
-        status_column_letter = chr(ord('A') + status_column_index)
-        
-        # Find the Date column index if it exists
-        date_column_index = None
-        date_column_letter = None
-        
-        if 'Date' in headers:
-            date_column_index = headers.index('Date')
-            date_column_letter = chr(ord('A') + date_column_index)
-        
-        # Update the status cell
-        range_to_update = f"{self.sheet_range.split('!')[0]}!{status_column_letter}{row_index}"
-        body = {
+        updates = [{
+            'range': f"{self._sheet_name()}!{column_letter(status_column_index)}{row_index}",
             'values': [[status]]
-        }
+        }]
         
-        sheet.values().update(
-            spreadsheetId=self.sheet_id,
-            range=range_to_update,
-            valueInputOption='RAW',
-            body=body
-        ).execute()
+        # If there is a Date column and the status is "Sent", update the date too
+        date_column_index = self._header_index.get('Date')
+        if date_column_index is not None and status == "Sent":
+            updates.append({
+                'range': f"{self._sheet_name()}!{column_letter(date_column_index)}{row_index}",
+                'values': [[status_date()]]
+            })
         
-        print(f"Updated row {row_index}, column {status_column} to '{status}'")
+        return updates
+
+    @metrics.timed('status_write')
+    def batch_update(self, updates: List[Dict[str, Any]]) -> None:
+        """
+        Write several cell ranges in a single spreadsheets.values.batchUpdate call
+
+        Args:
+            updates: List of value ranges ({'range': ..., 'values': ...})
+        """
+        if not updates:
+            return
         
-        # If we found a Date column and the status is "Sent", update the date too
-        if date_column_letter and status == "Sent":
-            today = datetime.datetime.now().strftime("%-m/%-d")  # Format as M/D
-            date_range = f"{self.sheet_range.split('!')[0]}!{date_column_letter}{row_index}"
-            date_body = {
-                'values': [[today]]
+        self._execute(self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.sheet_id,
+            body={
+                'valueInputOption': 'RAW',
+                'data': updates
             }
-            
-            sheet.values().update(
-                spreadsheetId=self.sheet_id,
-                range=date_range,
-                valueInputOption='RAW',
-                body=date_body
-            ).execute()
-            
-            print(f"Updated row {row_index}, column Date to '{today}'")
+        ), 'Sheets batch update')
+        
+        for update in updates:
+            print(f"Updated {update['range']} to '{update['values'][0][0]}'")
         
     def find_status_column_index(self, status_column: str = "Status") -> int:
         """Find the index of the status column in the sheet"""
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.sheet_id, 
-                                    range=f"{self.sheet_range.split('!')[0]}!1:1").execute()
-        headers = result.get('values', [[]])[0]
+        headers = list(self.get_headers(refresh=True))
         
         if status_column not in headers:
             # If status column doesn't exist, create it
             headers.append(status_column)
-            sheet.values().update(
+            sheet = self.service.spreadsheets()
+            self._execute(sheet.values().update(
                 spreadsheetId=self.sheet_id,
-                range=f"{self.sheet_range.split('!')[0]}!1:1",
+                range=f"{self._sheet_name()}!1:1",
                 valueInputOption='RAW',
                 body={'values': [headers]}
-            ).execute()
+            ), 'Sheets header update')
+            self._set_headers(headers)
             return len(headers) - 1
         
-        return headers.index(status_column) 
\ No newline at end of file
+        return headers.index(status_column)
\ No newline at end of file
@@ -0,0 +1,221 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+class LeaseStore:
+    def __init__(self, path=None, campaign=None, worker_id=None, lease_seconds=None):
+        """
+        Time-limited claims on recipient rows, shared by every worker of a campaign
+
+        Lets several bot processes (on one host, or on several hosts sharing the
+        file) work through one recipient list without emailing a row twice. A
+        worker only queues the rows it managed to lease; the lease is renewed in
+        the background while the worker runs and given up when it stops, and the
+        leases of a worker that crashed expire after lease_seconds so the other
+        workers can take its rows.
+
+        A row moves from 'leased' to 'sending' right before its email is handed
+        to Graph, and to 'done' once its status is recorded. A 'sending' row
+        whose lease expired belonged to a worker that stopped mid-send, so it is
+        never handed out again: like an interrupted send in the send journal, it
+        is reported as in doubt instead.
+
+        Args:
+            path: SQLite file shared by the workers
+            campaign: Name that separates campaigns sharing one file (e.g. the sheet ID)
+            worker_id: Name of this worker (defaults to WORKER_ID). It must stay the
+                same across restarts, since the worker's send journal is kept under it
+            lease_seconds: How long a lease lasts without being renewed
+        """
+        self.path = path or os.environ.get('WORKER_LEASE_FILE', '.worker_leases.sqlite3')
+        self.campaign = campaign or ''
+        self.worker_id = worker_id or os.environ.get('WORKER_ID')
+        if not self.worker_id:
+            # A name that changed on every restart (e.g. host-pid) would hide the previous
+            # run's journal: today's count, in-doubt rows and unwritten statuses would be lost
+            raise ValueError("WORKER_ID must be set to a name that stays the same across restarts "
+                             "when WORKER_LEASE_FILE is set")
+        self.lease_seconds = lease_seconds or float(os.environ.get('WORKER_LEASE_SECONDS', 300))
+
+        self._lock = threading.Lock()
+        # Several processes write the file; wait for their transactions instead of failing
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS row_leases ('
+            ' campaign TEXT NOT NULL,'
+            ' row_index INTEGER NOT NULL,'
+            ' owner TEXT NOT NULL,'
+            ' state TEXT NOT NULL,'
+            ' status TEXT,'
+            ' expires_at REAL NOT NULL,'
+            ' PRIMARY KEY (campaign, row_index))'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS row_leases_expiry ON row_leases (campaign, state, expires_at)'
+        )
+
+        self._last_rescan = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _write(self, sql: str, params: List[tuple]) -> None:
+        """Run one statement for every parameter tuple in a single write transaction"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(sql, params)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def claim(self, recipients: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Lease as many of these recipients as are free
+
+        A row is free if no worker holds it, or if its 'leased' lease expired.
+
+        Returns:
+            Tuple of (recipients now leased by this worker, recipients whose send
+            was interrupted on another worker, which are now marked done)
+        """
+        if not recipients:
+            return [], []
+        now = time.time()
+        row_indexes = [recipient['_row_index'] for recipient in recipients]
+        placeholders = ','.join('?' * len(row_indexes))
+        with self._lock:
+            # Claiming and reading back happen in one transaction, so two workers never both win a row
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO row_leases (campaign, row_index, owner, state, expires_at)'
+                    ' VALUES (?, ?, ?, ?, ?)'
+                    ' ON CONFLICT (campaign, row_index) DO UPDATE'
+                    ' SET owner = excluded.owner, expires_at = excluded.expires_at'
+                    ' WHERE state = ? AND (expires_at < ? OR owner = excluded.owner)',
+                    [(self.campaign, row_index, self.worker_id, 'leased', now + self.lease_seconds, 'leased', now)
+                     for row_index in row_indexes]
+                )
+                rows = self._conn.execute(
+                    f'SELECT row_index, owner, state FROM row_leases'
+                    f' WHERE campaign = ? AND row_index IN ({placeholders})'
+                    f' AND (owner = ? OR (state = ? AND expires_at < ?))',
+                    [self.campaign] + row_indexes + [self.worker_id, 'sending', now]
+                ).fetchall()
+                leased = {row_index for row_index, owner, state in rows
+                          if owner == self.worker_id and state == 'leased'}
+                interrupted = {row_index for row_index, owner, state in rows
+                               if owner != self.worker_id and state == 'sending'}
+                self._conn.executemany(
+                    'UPDATE row_leases SET state = ?, owner = ? WHERE campaign = ? AND row_index = ?',
+                    [('done', self.worker_id, self.campaign, row_index) for row_index in interrupted]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        return ([recipient for recipient in recipients if recipient['_row_index'] in leased],
+                [recipient for recipient in recipients if recipient['_row_index'] in interrupted])
+
+    def begin_sending(self, recipients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Move leased rows to 'sending' right before their emails go out
+
+        Returns:
+            The recipients this worker still holds; the others' leases expired and
+            were taken by another worker, so they must not be emailed here
+        """
+        if not recipients:
+            return []
+        now = time.time()
+        held = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for recipient in recipients:
+                    cursor = self._conn.execute(
+                        'UPDATE row_leases SET state = ?, expires_at = ?'
+                        ' WHERE campaign = ? AND row_index = ? AND owner = ? AND state = ?',
+                        ('sending', now + self.lease_seconds, self.campaign, recipient['_row_index'],
+                         self.worker_id, 'leased')
+                    )
+                    if cursor.rowcount:
+                        held.append(recipient)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return held
+
+    def complete(self, statuses: Dict[int, str]) -> None:
+        """Mark rows as done with their final status, so no worker takes them again"""
+        if statuses:
+            self._write(
+                'UPDATE row_leases SET state = ?, status = ? WHERE campaign = ? AND row_index = ? AND owner = ?',
+                [('done', status, self.campaign, row_index, self.worker_id) for row_index, status in statuses.items()]
+            )
+
+    def renew(self) -> None:
+        """Extend every lease this worker holds"""
+        self._write(
+            'UPDATE row_leases SET expires_at = ? WHERE campaign = ? AND owner = ? AND state != ?',
+            [(time.time() + self.lease_seconds, self.campaign, self.worker_id, 'done')]
+        )
+
+    def release(self) -> None:
+        """Give up the leased rows this worker hasn't started sending, so others can take them now"""
+        self._write(
+            'UPDATE row_leases SET expires_at = 0 WHERE campaign = ? AND owner = ? AND state = ?',
+            [(self.campaign, self.worker_id, 'leased')]
+        )
+
+    def should_rescan(self) -> bool:
+        """
+        Whether the recipients should be read again from the top
+
+        True when another worker's leases have expired (it crashed or stopped
+        early) since rows it held are free again, at most once per lease period.
+        """
+        now = time.time()
+        if now - self._last_rescan < self.lease_seconds:
+            return False
+        self._last_rescan = now
+        with self._lock:
+            expired = self._conn.execute(
+                'SELECT 1 FROM row_leases WHERE campaign = ? AND state = ? AND expires_at < ? AND owner != ? LIMIT 1',
+                (self.campaign, 'leased', now, self.worker_id)
+            ).fetchone()
+        return expired is not None
+
+    def start(self) -> None:
+        """Renew this worker's leases in a background thread, three times per lease period"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._renew_loop, name='lease-renewer', daemon=True)
+        self._thread.start()
+        print(f"Worker {self.worker_id} leasing rows for {self.lease_seconds:g} seconds at a time.")
+
+    def _renew_loop(self) -> None:
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"Error renewing row leases: {str(e)}")
+
+    def close(self) -> None:
+        """Stop renewing, release the rows not being sent and close the SQLite connection"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.lease_seconds / 3)
+        try:
+            self.release()
+        finally:
+            with self._lock:
+                self._conn.close()
@@ -0,0 +1,594 @@
+import os
+import re
+import csv
+import json
+import mmap
+import sqlite3
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from recipient_source import RecipientRecord, RecipientSource, column_index, column_letter, status_date
+
+def _cell_text(value: Any) -> str:
+    """Cell value as the text Sheets would return for it"""
+    return '' if value is None else str(value)
+
+# Bytes of a CSV file split into lines at once
+_CSV_BLOCK_BYTES = 1 << 20
+
+def _quote(name: str) -> str:
+    """Quote an SQLite identifier such as a table or header name"""
+    return '"' + name.replace('"', '""') + '"'
+
+class LocalRecipientSource(RecipientSource):
+    def __init__(self, path: str, chunk_rows=None):
+        """
+        Shared parts of the recipient sources backed by a local file
+
+        Cell updates use A1 cell names without a sheet name (e.g. 'C12'), so the
+        status writer can buffer and spool them exactly like sheet updates.
+
+        Args:
+            path: File that holds the recipients
+            chunk_rows: Rows read per page (defaults to LOCAL_SOURCE_CHUNK_ROWS)
+        """
+        self.path = path
+        self.read_chunk_rows = chunk_rows or int(os.environ.get('LOCAL_SOURCE_CHUNK_ROWS', 5000))
+        self._headers = None
+        self._header_index = {}
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.path
+
+    def _read_headers(self) -> List[str]:
+        raise NotImplementedError
+
+    def _add_column(self, header: str) -> None:
+        raise NotImplementedError
+
+    def get_headers(self, refresh: bool = False) -> List[str]:
+        if self._headers is None or refresh:
+            self._headers = self._read_headers()
+            self._header_index = {}
+            for index, header in enumerate(self._headers):
+                # Keep the first column when a header name is repeated, like list.index
+                self._header_index.setdefault(header, index)
+        return self._headers
+
+    def find_status_column_index(self, status_column: str = "Status") -> int:
+        if status_column not in self.get_headers(refresh=True):
+            self._add_column(status_column)
+            self.get_headers(refresh=True)
+        return self._header_index[status_column]
+
+    def build_status_updates(self, row_index: int, status_column: str, status: str) -> List[Dict[str, Any]]:
+        status_column_index = self._header_index.get(status_column)
+        if status_column_index is None:
+            status_column_index = self.find_status_column_index(status_column)
+
+        updates = [{'range': f"{column_letter(status_column_index)}{row_index}", 'values': [[status]]}]
+
+        # If there is a Date column and the status is "Sent", update the date too
+        date_column_index = self._header_index.get('Date')
+        if date_column_index is not None and status == "Sent":
+            updates.append({'range': f"{column_letter(date_column_index)}{row_index}", 'values': [[status_date()]]})
+        return updates
+
+    @staticmethod
+    def _parse_updates(updates: List[Dict[str, Any]]) -> Dict[int, Dict[int, str]]:
+        """Group cell updates by row index, then column index"""
+        cells = {}
+        for update in updates:
+            match = re.match(r'^([A-Z]+)(\d+)$', update['range'].rpartition('!')[2])
+            if not match:
+                raise ValueError(f"Unsupported cell in update: {update['range']}")
+            letters, row_index = match.groups()
+            cells.setdefault(int(row_index), {})[column_index(letters)] = update['values'][0][0]
+        return cells
+
+
+class _OverlayFileSource(LocalRecipientSource):
+    def __init__(self, path: str, chunk_rows=None, compact_on_close=None):
+        """
+        Local file that is read in place, with status changes kept in a side log
+
+        Rewriting a large file for every status change would cost far more than
+        the send itself, so changes are appended to <path>.updates.jsonl (fsynced)
+        and laid over the rows as they are read. compact() writes them into the
+        file itself, by default when the source is closed.
+
+        Args:
+            path: File that holds the recipients
+            chunk_rows: Rows read per page (defaults to LOCAL_SOURCE_CHUNK_ROWS)
+            compact_on_close: Write the changes into the file on close (defaults
+                to LOCAL_SOURCE_COMPACT_ON_CLOSE, on)
+        """
+        super().__init__(path, chunk_rows)
+        if compact_on_close is None:
+            compact_on_close = os.environ.get('LOCAL_SOURCE_COMPACT_ON_CLOSE', 'true').lower() in ('1', 'true', 'yes')
+        self.compact_on_close = compact_on_close
+        self.updates_file = f"{path}.updates.jsonl"
+
+        # Changed cells by row index, then column index
+        self._overlay: Dict[int, Dict[int, str]] = {}
+        # Headers added by the bot (e.g. a missing Status column) that the file doesn't have yet
+        self._added_columns: List[str] = []
+        self._lock = threading.RLock()
+        self._load_updates()
+
+    def _load_updates(self) -> None:
+        """Load the changes logged by previous runs that were not compacted yet"""
+        if not os.path.exists(self.updates_file):
+            return
+
+        updates = []
+        with open(self.updates_file, 'r', encoding='utf-8') as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partially written last line means the process died mid-append
+                    continue
+                if 'header' in entry:
+                    self._added_columns.append(entry['header'])
+                else:
+                    updates.append(entry)
+
+        for row_index, cells in self._parse_updates(updates).items():
+            self._overlay.setdefault(row_index, {}).update(cells)
+        if updates:
+            print(f"Loaded {len(updates)} uncompacted status changes from {self.updates_file}")
+
+    def _log(self, entries: List[Dict[str, Any]]) -> None:
+        with open(self.updates_file, 'a', encoding='utf-8') as log:
+            for entry in entries:
+                log.write(json.dumps(entry) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+
+    def _add_column(self, header: str) -> None:
+        with self._lock:
+            self._log([{'header': header}])
+            self._added_columns.append(header)
+
+    def _apply(self, row_index: int, values: List[str]) -> List[str]:
+        """Row values with the logged changes laid over them"""
+        cells = self._overlay.get(row_index)
+        if not cells:
+            return values
+        values = list(values)
+        for index, value in cells.items():
+            if index >= len(values):
+                values.extend([''] * (index + 1 - len(values)))
+            values[index] = value
+        return values
+
+    def batch_update(self, updates: List[Dict[str, Any]]) -> None:
+        if not updates:
+            return
+        cells = self._parse_updates(updates)
+        with self._lock:
+            self._log(updates)
+            for row_index, row_cells in cells.items():
+                self._overlay.setdefault(row_index, {}).update(row_cells)
+        print(f"Updated {len(updates)} cells in {self.path}")
+
+    def _write_compacted(self, temp_file: str) -> None:
+        raise NotImplementedError
+
+    def compact(self) -> int:
+        """
+        Write the logged changes into the file and start a new log
+
+        The file is rewritten to a temporary file that then replaces it, so a
+        crash leaves either the old file plus the log or the new file.
+
+        Returns:
+            Number of rows that were changed
+        """
+        with self._lock:
+            changed = len(self._overlay)
+            if changed or self._added_columns:
+                temp_file = f"{self.path}.tmp"
+                self._write_compacted(temp_file)
+                os.replace(temp_file, self.path)
+                self._overlay = {}
+                self._added_columns = []
+                self._headers = None
+            if os.path.exists(self.updates_file):
+                os.remove(self.updates_file)
+        if changed:
+            print(f"Wrote {changed} changed rows into {self.path}")
+        return changed
+
+    def close(self) -> None:
+        if not self.compact_on_close:
+            return
+        try:
+            self.compact()
+        except Exception as e:
+            # The log is kept, so the changes are applied again on the next start
+            print(f"Error writing status changes into {self.path}, they stay in {self.updates_file}: {str(e)}")
+
+
+class CsvRecipientSource(_OverlayFileSource):
+    def __init__(self, path: str, chunk_rows=None, compact_on_close=None, encoding='utf-8'):
+        """
+        Recipients in a CSV file with a header row, read through a memory map
+
+        Rows are split on the raw bytes of the mapped file, and a row is only
+        parsed by the csv module when its bytes contain the wanted status, so
+        rows that were already handled cost a substring search. The byte offset
+        where the last read stopped is remembered, so refreshes only look at the
+        rows appended since.
+
+        Args:
+            path: CSV file (comma separated, double-quote quoting)
+            chunk_rows: Rows read per page (defaults to LOCAL_SOURCE_CHUNK_ROWS)
+            compact_on_close: Write status changes into the file on close
+            encoding: Text encoding of the file (must be ASCII compatible)
+        """
+        self.encoding = encoding
+        # (row index, byte offset, file size, inode) where the last read stopped
+        self._resume = None
+        super().__init__(path, chunk_rows, compact_on_close)
+
+    def _read_headers(self) -> List[str]:
+        # Spreadsheet programs often start UTF-8 exports with a byte order mark
+        encoding = 'utf-8-sig' if self.encoding.lower() in ('utf-8', 'utf8') else self.encoding
+        with open(self.path, 'r', newline='', encoding=encoding) as source:
+            headers = next(csv.reader(source), [])
+        return headers + self._added_columns if headers else []
+
+    @staticmethod
+    def _records(mapped: mmap.mmap, offset: int) -> Iterator[Tuple[bytes, int]]:
+        """
+        Split the mapped file into CSV records starting at a byte offset
+
+        The file is split into lines a block at a time with bytes.split, and a
+        record ends at the first line end after an even number of double quotes,
+        so quoted fields that span lines stay in one record.
+
+        Yields:
+            Tuple of (raw record bytes without the final line end, byte offset
+            where the next record starts)
+        """
+        size = len(mapped)
+        parts = []
+        quotes = 0
+        while offset < size:
+            block = mapped[offset:offset + _CSV_BLOCK_BYTES]
+            if offset + len(block) < size:
+                cut = block.rfind(b'\n')
+                if cut == -1:
+                    # A line longer than a block
+                    cut = mapped.find(b'\n', offset + len(block))
+                    block = mapped[offset:cut + 1 if cut != -1 else size]
+                else:
+                    block = block[:cut + 1]
+
+            lines = block.split(b'\n')
+            if block.endswith(b'\n'):
+                lines.pop()
+            end = offset
+            for line in lines:
+                end += len(line) + 1
+                if b'"' in line:
+                    quotes += line.count(b'"')
+                if quotes % 2:
+                    parts.append(line)
+                    continue
+                if parts:
+                    parts.append(line)
+                    line = b'\n'.join(parts)
+                    parts = []
+                quotes = 0
+                # The last line of a file may have no line end
+                yield line, end if end <= size else size
+            offset += len(block)
+
+        if parts:
+            # Unbalanced quote at the end of the file
+            yield b'\n'.join(parts), size
+
+    def _parse(self, record: bytes) -> List[str]:
+        text = record.decode(self.encoding).rstrip('\r\n')
+        return next(csv.reader([text]), [])
+
+    def _seek(self, mapped: mmap.mmap, start_row: int) -> Tuple[int, int]:
+        """Row index and byte offset to start reading from for start_row"""
+        if self._resume is not None:
+            row_index, offset, size, inode = self._resume
+            stat = os.stat(self.path)
+            # Appending keeps the earlier offsets valid; a rewrite (new inode) or truncation doesn't
+            if stat.st_ino == inode and stat.st_size >= size and row_index <= start_row:
+                return row_index, offset
+        for _, header_end in self._records(mapped, 0):
+            return 2, header_end
+        return 2, 0
+
+    def iter_recipient_chunks(self, start_row=None, headers=None, status_column_index=None,
+                              status_filter="Not Sent",
+                              chunk_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        headers = headers or self.get_headers()
+        if not headers or os.path.getsize(self.path) == 0:
+            return
+
+        columns = {header: index for index, header in enumerate(headers)}
+        filter_index = None
+        needle = None
+        if status_column_index is not None and status_column_index < len(headers):
+            filter_index = status_column_index
+            # An empty status can't be spotted in the raw bytes
+            needle = status_filter.encode(self.encoding) if status_filter else None
+        chunk_size = chunk_size or self.read_chunk_rows
+        start_row = start_row or 2
+
+        with open(self.path, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            inode = os.fstat(source.fileno()).st_ino
+            row_index, offset = self._seek(mapped, start_row)
+            last_row = row_index - 1
+            records = []
+            page_rows = 0
+            yielded = False
+            for record, end in self._records(mapped, offset):
+                if row_index >= start_row:
+                    if needle is None or needle in record or row_index in self._overlay:
+                        values = self._apply(row_index, self._parse(record))
+                        if filter_index is None or (
+                                values[filter_index] if filter_index < len(values) else '') == status_filter:
+                            records.append(RecipientRecord(columns, values, row_index))
+                    page_rows += 1
+                last_row = row_index
+                row_index += 1
+                offset = end
+                if page_rows >= chunk_size:
+                    self._resume = (row_index, offset, len(mapped), inode)
+                    yield headers, records, last_row
+                    yielded = True
+                    records = []
+                    page_rows = 0
+
+            self._resume = (row_index, offset, len(mapped), inode)
+            if page_rows or (not yielded and start_row == 2):
+                yield headers, records, max(last_row, 1)
+
+    def _write_compacted(self, temp_file: str) -> None:
+        with open(self.path, 'r', newline='', encoding=self.encoding) as source, \
+                open(temp_file, 'w', newline='', encoding=self.encoding) as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target, lineterminator='\n')
+            writer.writerow(next(reader, []) + self._added_columns)
+            for row_index, values in enumerate(reader, start=2):
+                writer.writerow(self._apply(row_index, values))
+        self._resume = None
+
+
+class ParquetRecipientSource(_OverlayFileSource):
+    def __init__(self, path: str, chunk_rows=None, compact_on_close=None):
+        """
+        Recipients in a Parquet file, read one row group at a time
+
+        With a status filter only the status column of each row group is read
+        first; the other columns are read for the matching rows alone. Pages are
+        row groups, so write the file with row groups of a few thousand rows.
+        Needs pyarrow (pip install -r requirements-parquet.txt).
+
+        Args:
+            path: Parquet file, one column per header
+            chunk_rows: Unused, pages follow the file's row groups
+            compact_on_close: Write status changes into the file on close
+        """
+        # Fail at startup rather than on the first read
+        self._pyarrow()
+        super().__init__(path, chunk_rows, compact_on_close)
+
+    @staticmethod
+    def _pyarrow():
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Reading recipients from Parquet needs pyarrow, which isn't installed: "
+                              "pip install -r requirements-parquet.txt") from None
+        return pyarrow, pyarrow.parquet
+
+    def _read_headers(self) -> List[str]:
+        _, parquet = self._pyarrow()
+        headers = list(parquet.ParquetFile(self.path).schema_arrow.names)
+        return headers + self._added_columns if headers else []
+
+    def iter_recipient_chunks(self, start_row=None, headers=None, status_column_index=None,
+                              status_filter="Not Sent",
+                              chunk_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        _, parquet = self._pyarrow()
+        headers = headers or self.get_headers()
+        if not headers:
+            return
+
+        parquet_file = parquet.ParquetFile(self.path)
+        file_columns = parquet_file.metadata.num_columns
+        columns = {header: index for index, header in enumerate(headers)}
+        filter_index = None
+        if status_column_index is not None and status_column_index < len(headers):
+            filter_index = status_column_index
+        start_row = start_row or 2
+
+        yielded = False
+        group_first_row = 2
+        for group in range(parquet_file.num_row_groups):
+            group_rows = parquet_file.metadata.row_group(group).num_rows
+            first_row, group_first_row = group_first_row, group_first_row + group_rows
+            if group_first_row <= start_row:
+                continue
+
+            positions = range(max(start_row - first_row, 0), group_rows)
+            if filter_index is not None:
+                if filter_index < file_columns:
+                    statuses = parquet_file.read_row_group(group, columns=[headers[filter_index]]).column(0).to_pylist()
+                else:
+                    statuses = None
+                positions = [
+                    position for position in positions
+                    if self._overlay.get(first_row + position, {}).get(
+                        filter_index, _cell_text(statuses[position]) if statuses else '') == status_filter
+                ]
+
+            records = []
+            if positions:
+                table = parquet_file.read_row_group(group).take(list(positions))
+                values_by_column = [column.to_pylist() for column in table.columns]
+                for n, position in enumerate(positions):
+                    values = [_cell_text(column[n]) for column in values_by_column]
+                    records.append(RecipientRecord(columns, self._apply(first_row + position, values),
+                                                   first_row + position))
+            yield headers, records, group_first_row - 1
+            yielded = True
+
+        if not yielded and start_row == 2:
+            yield headers, [], group_first_row - 1
+
+    def _write_compacted(self, temp_file: str) -> None:
+        pyarrow, parquet = self._pyarrow()
+        table = parquet.read_table(self.path)
+        headers = table.column_names + self._added_columns
+        changed_columns = {index for cells in self._overlay.values() for index in cells}
+        for index, header in enumerate(headers):
+            if index < table.num_columns and index not in changed_columns:
+                continue
+            if index < table.num_columns:
+                values = [_cell_text(value) for value in table.column(index).to_pylist()]
+            else:
+                values = [''] * table.num_rows
+            for row_index, cells in self._overlay.items():
+                if index in cells and 2 <= row_index < table.num_rows + 2:
+                    values[row_index - 2] = cells[index]
+            array = pyarrow.array(values, pyarrow.string())
+            if index < table.num_columns:
+                table = table.set_column(index, pyarrow.field(header, pyarrow.string()), array)
+            else:
+                table = table.append_column(header, array)
+        parquet.write_table(table, temp_file, row_group_size=self.read_chunk_rows)
+
+
+class SqliteRecipientSource(LocalRecipientSource):
+    def __init__(self, path: str, table=None, chunk_rows=None):
+        """
+        Recipients in a table of a SQLite database, one column per header
+
+        The status column is indexed, so finding pending rows reads only those
+        rows, and status changes are plain UPDATEs. Row indexes are the table's
+        rowid plus one, which matches the sheet rows when the table was filled
+        in sheet order (see import_rows).
+
+        Args:
+            path: SQLite database file
+            table: Table that holds the recipients (defaults to RECIPIENT_SQLITE_TABLE)
+            chunk_rows: Rows read per page (defaults to LOCAL_SOURCE_CHUNK_ROWS)
+        """
+        super().__init__(path, chunk_rows)
+        self.table = table or os.environ.get('RECIPIENT_SQLITE_TABLE', 'recipients')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+    def _read_headers(self) -> List[str]:
+        with self._lock:
+            return [row[1] for row in self._conn.execute(f'PRAGMA table_info({_quote(self.table)})')]
+
+    def _add_column(self, header: str) -> None:
+        with self._lock:
+            self._conn.execute(f'ALTER TABLE {_quote(self.table)} ADD COLUMN {_quote(header)} TEXT')
+            self._conn.commit()
+
+    def find_status_column_index(self, status_column: str = "Status") -> int:
+        index = super().find_status_column_index(status_column)
+        with self._lock:
+            self._conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {_quote(f"{self.table}_{status_column}")}'
+                f' ON {_quote(self.table)} ({_quote(status_column)})'
+            )
+            self._conn.commit()
+        return index
+
+    def import_rows(self, headers: List[str], rows: List[List[Any]]) -> int:
+        """
+        Create the table if needed and append rows to it, in order
+
+        Args:
+            headers: Column names
+            rows: Row values; short rows are padded with ''
+
+        Returns:
+            Number of rows added
+        """
+        placeholders = ', '.join('?' * len(headers))
+        with self._lock:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {_quote(self.table)} '
+                f'({", ".join(f"{_quote(header)} TEXT" for header in headers)})'
+            )
+            cursor = self._conn.executemany(
+                f'INSERT INTO {_quote(self.table)} VALUES ({placeholders})',
+                ([_cell_text(value) for value in row] + [''] * (len(headers) - len(row)) for row in rows)
+            )
+            self._conn.commit()
+        self._headers = None
+        return cursor.rowcount
+
+    def iter_recipient_chunks(self, start_row=None, headers=None, status_column_index=None,
+                              status_filter="Not Sent",
+                              chunk_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        headers = headers or self.get_headers()
+        if not headers:
+            return
+
+        columns = {header: index for index, header in enumerate(headers)}
+        chunk_size = chunk_size or self.read_chunk_rows
+        with self._lock:
+            last_rowid = self._conn.execute(f'SELECT MAX(rowid) FROM {_quote(self.table)}').fetchone()[0] or 0
+
+        query = f'SELECT rowid, * FROM {_quote(self.table)} WHERE rowid > ? AND rowid <= ?'
+        params = []
+        if status_column_index is not None and status_column_index < len(headers):
+            query += f' AND {_quote(headers[status_column_index])} = ?'
+            params.append(status_filter)
+        query += ' ORDER BY rowid LIMIT ?'
+
+        after = (start_row or 2) - 2
+        yielded = False
+        while after < last_rowid:
+            with self._lock:
+                rows = self._conn.execute(query, [after, last_rowid] + params + [chunk_size]).fetchall()
+            if not rows:
+                break
+            after = rows[-1][0]
+            records = [RecipientRecord(columns, [_cell_text(value) for value in row[1:]], row[0] + 1)
+                       for row in rows]
+            yield headers, records, (after if len(rows) == chunk_size else last_rowid) + 1
+            yielded = True
+
+        if not yielded and (start_row is None or last_rowid >= start_row - 1):
+            yield headers, [], last_rowid + 1
+
+    def batch_update(self, updates: List[Dict[str, Any]]) -> None:
+        if not updates:
+            return
+        headers = self.get_headers()
+        by_column: Dict[int, List[Tuple[str, int]]] = {}
+        for row_index, cells in self._parse_updates(updates).items():
+            for index, value in cells.items():
+                by_column.setdefault(index, []).append((value, row_index - 1))
+
+        with self._lock:
+            for index, values in by_column.items():
+                self._conn.executemany(
+                    f'UPDATE {_quote(self.table)} SET {_quote(headers[index])} = ? WHERE rowid = ?', values
+                )
+            self._conn.commit()
+        print(f"Updated {len(updates)} cells in {self.path}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
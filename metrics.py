@@ -0,0 +1,266 @@
+import os
+import json
+import logging
+import time
+import bisect
+import threading
+import contextlib
+import functools
+from typing import Dict, Any, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds, from a fast render to a throttled API call
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Help text for the Prometheus output
+METRIC_HELP = {
+    'email_bot_stage_seconds': 'Time spent in each stage of sending an email.',
+    'email_bot_api_calls_total': 'Requests made to Google Sheets, Microsoft Graph and OpenAI, including retries.',
+    'email_bot_retries_total': 'Requests repeated after a retryable error.',
+    'email_bot_throttles_total': 'Responses that asked the bot to slow down (HTTP 429/503).',
+    'email_bot_suggestion_cache_total': 'ChatGPT suggestion cache lookups by result.',
+    'email_bot_emails_total': 'Emails processed by final status.',
+}
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket that holds the q-quantile (None above the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+class Metrics:
+    def __init__(self):
+        """
+        Thread-safe registry of counters and latency histograms
+
+        Metrics are identified by name plus keyword labels, e.g.
+        metrics.inc('email_bot_api_calls_total', api='graph', operation='sendMail').
+        The registry can be rendered in the Prometheus text format or as JSON.
+        """
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Add to a counter"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """Record a duration in a histogram"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time_stage(self, stage: str):
+        """Time the block as one run of a stage (email_bot_stage_seconds)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('email_bot_stage_seconds', time.perf_counter() - started, stage=stage)
+
+    def timed(self, stage: str):
+        """Decorator that times every call of a function as one run of a stage"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time_stage(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self) -> None:
+        """Drop every recorded value"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Current values as plain data, for the JSON endpoint and dump
+
+        Returns:
+            Dictionary with 'counters' and 'histograms', each a list of series with
+            their labels. Histograms include count, sum, mean and bucket-based
+            p50/p90/p99 estimates in seconds.
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': value}
+                for name, series in sorted(self._counters.items())
+                for key, value in sorted(series.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(key),
+                    'count': histogram.count,
+                    'sum': histogram.total,
+                    'mean': histogram.total / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p90': histogram.quantile(0.9),
+                    'p99': histogram.quantile(0.99),
+                }
+                for name, series in sorted(self._histograms.items())
+                for key, histogram in sorted(series.items())
+            ]
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': time.time() - self.started_at,
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def render_prometheus(self) -> str:
+        """Current values in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in METRIC_HELP:
+                    lines.append(f'# HELP {name} {METRIC_HELP[name]}')
+                lines.append(f'# TYPE {name} counter')
+                for key, value in sorted(series.items()):
+                    lines.append(f'{name}{_format_labels(key)} {value:g}')
+
+            for name, series in sorted(self._histograms.items()):
+                if name in METRIC_HELP:
+                    lines.append(f'# HELP {name} {METRIC_HELP[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, ("le", f"{bound:g}"))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, ("le", "+Inf"))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+# Registry shared by every module of the bot
+metrics = Metrics()
+
+
+class MetricsExporter:
+    def __init__(self, registry: Metrics = None, port=None, json_file=None, dump_interval=None):
+        """
+        Serve the metrics over HTTP and/or dump them to a JSON file periodically
+
+        The HTTP endpoint is a small Flask app on 127.0.0.1 with /metrics in the
+        Prometheus text format and /metrics.json with the same data as JSON.
+
+        Args:
+            registry: Metrics to export (the shared registry by default)
+            port: Port for the HTTP endpoint (defaults to METRICS_PORT, off if unset)
+            json_file: File the JSON snapshot is written to (defaults to METRICS_JSON_FILE, off if unset)
+            dump_interval: Seconds between JSON dumps (defaults to METRICS_DUMP_SECONDS)
+        """
+        self.registry = registry or metrics
+        port = port or os.environ.get('METRICS_PORT')
+        self.port = int(port) if port else None
+        self.json_file = json_file or os.environ.get('METRICS_JSON_FILE') or None
+        self.dump_interval = dump_interval or float(os.environ.get('METRICS_DUMP_SECONDS', 60))
+
+        self._server = None
+        self._threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.port or self.json_file)
+
+    def start(self) -> 'MetricsExporter':
+        """Start the endpoint and the dump thread, whichever are configured"""
+        if self.port:
+            self._start_server()
+        if self.json_file:
+            thread = threading.Thread(target=self._dump_loop, name='metrics-dump', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _start_server(self) -> None:
+        # Only needed when the endpoint is switched on
+        from flask import Flask, Response, jsonify
+        from werkzeug.serving import make_server
+
+        app = Flask('email_bot_metrics')
+        # Scrapes every few seconds would otherwise drown out the bot's own output
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        @app.route('/metrics')
+        def prometheus():
+            return Response(self.registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+        @app.route('/metrics.json')
+        def metrics_json():
+            return jsonify(self.registry.snapshot())
+
+        self._server = make_server('127.0.0.1', self.port, app, threaded=True)
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"Metrics available at http://127.0.0.1:{self.port}/metrics")
+
+    def _dump_loop(self) -> None:
+        while not self._stop_event.wait(self.dump_interval):
+            self.dump()
+
+    def dump(self) -> None:
+        """Write the current snapshot to json_file, replacing the previous one atomically"""
+        temp_file = f'{self.json_file}.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as output:
+                json.dump(self.registry.snapshot(), output, indent=2)
+            os.replace(temp_file, self.json_file)
+        except OSError as e:
+            print(f"Error writing metrics to {self.json_file}: {str(e)}")
+
+    def stop(self) -> None:
+        """Stop the endpoint and write a final JSON dump"""
+        self._stop_event.set()
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+        if self.json_file:
+            self.dump()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
@@ -1,14 +1,28 @@
 import os
 import json
-import base64
-import msal
 import requests
 import time
+import copy
+import threading
+from typing import Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from metrics import metrics
+from attachment_cache import Attachment, AttachmentCache
+from retry_policy import (RetryPolicy, RetryableError, PermanentError, is_retryable_status, is_throttle_status,
+                          parse_retry_after)
+
 # Load environment variables from .env.local
 load_dotenv('.env.local')
 
+# Microsoft Graph accepts at most 20 requests in one JSON $batch call
+GRAPH_BATCH_LIMIT = 20
+# and at most 4 MB in one request
+GRAPH_REQUEST_MAX_BYTES = 4 * 1024 * 1024
+# Upload session chunks must be a multiple of 320 KiB
+GRAPH_UPLOAD_CHUNK_UNIT = 320 * 1024
+
 class OutlookSender:
     def __init__(self):
         # Get credentials from environment variables
@@ -19,51 +33,119 @@ class OutlookSender:
         
         # Microsoft Graph API endpoints
         self.authority = f'https://login.microsoftonline.com/{self.tenant_id}'
-        self.graph_endpoint = 'https://graph.microsoft.com/v1.0'
+        self.graph_endpoint = os.environ.get('MS_GRAPH_ENDPOINT', 'https://graph.microsoft.com/v1.0').rstrip('/')
+        self.batch_endpoint = f'{self.graph_endpoint}/$batch'
         self.send_mail_endpoint = f'{self.graph_endpoint}/users/{self.user_email}/sendMail'
         
-        # Get access token
-        self.access_token = None
-        self._get_access_token()
-    
-    def _get_access_token(self):
-        """Get access token for Microsoft Graph API"""
-        app = msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            client_credential=self.client_secret,
-            authority=self.authority
-        )
+        # One HTTP session for every send, so connections (and their TLS
+        # handshakes) are kept alive and reused
+        pool_size = int(os.environ.get('GRAPH_POOL_SIZE', 10))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
         
-        # The scope is what permissions we're requesting
-        scopes = ['https://graph.microsoft.com/.default']
+        # One MSAL app for the lifetime of the sender, built on first use since that
+        # looks up the tenant over the network; its in-memory token cache is reused on
+        # every refresh. The holder is shared with the for_mailbox copies.
+        self._msal = {}
         
-        # Get token using client credentials flow
-        result = app.acquire_token_for_client(scopes=scopes)
+        # Refresh the token this many seconds before it expires
+        self.token_refresh_margin = int(os.environ.get('GRAPH_TOKEN_REFRESH_MARGIN', 300))
+        self.token_expires_at = 0
+        self._token_lock = threading.RLock()
+        
+        # Classifies send errors and decides how long to back off
+        self.retry_policy = RetryPolicy(name='graph')
+        # Number of throttling responses (429/503) seen, used by the sender pool
+        self.throttle_count = 0
+        
+        # Access token, requested before the first send
+        self.access_token = None
         
-        if 'access_token' in result:
-            self.access_token = result['access_token']
-        else:
-            error_description = result.get('error_description', 'No error description provided')
-            raise Exception(f"Could not get access token: {error_description}")
+        # Files attached to every email (comma-separated paths). They are hashed and
+        # encoded on the first send; the cache is shared with the for_mailbox copies.
+        self.attachments = [path.strip() for path in os.environ.get('EMAIL_ATTACHMENTS', '').split(',')
+                            if path.strip()]
+        for path in self.attachments:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Attachment file not found: {path}")
+        self.attachment_cache = AttachmentCache()
+        chunk_bytes = int(os.environ.get('GRAPH_UPLOAD_CHUNK_BYTES', 10 * GRAPH_UPLOAD_CHUNK_UNIT))
+        self.upload_chunk_bytes = max(1, chunk_bytes // GRAPH_UPLOAD_CHUNK_UNIT) * GRAPH_UPLOAD_CHUNK_UNIT
     
-    def send_email(self, to_email, subject, content_html, retries=3):
+    @property
+    def msal_app(self):
+        """MSAL client application, created on first use"""
+        app = self._msal.get('app')
+        if app is None:
+            with self._token_lock:
+                app = self._msal.get('app')
+                if app is None:
+                    import msal
+                    app = self._msal['app'] = msal.ConfidentialClientApplication(
+                        client_id=self.client_id,
+                        client_credential=self.client_secret,
+                        authority=self.authority
+                    )
+        return app
+    
+    def _get_access_token(self, force_refresh=False):
         """
-        Send an email using Microsoft Graph API
+        Get access token for Microsoft Graph API
         
         Args:
-            to_email: Recipient's email address
-            subject: Email subject
-            content_html: HTML content of the email
-            retries: Number of retries if sending fails
-        
-        Returns:
-            bool: True if email was sent successfully, False otherwise
+            force_refresh: Drop the cached token and request a new one, e.g. after a 401
+        """
+        with self._token_lock:
+            if force_refresh:
+                self.msal_app.remove_tokens_for_client()
+            
+            # The scope is what permissions we're requesting
+            scopes = ['https://graph.microsoft.com/.default']
+            
+            # Get token using client credentials flow (served from MSAL's cache while it's valid)
+            result = self.msal_app.acquire_token_for_client(scopes=scopes)
+            
+            if 'access_token' in result:
+                self.access_token = result['access_token']
+                self.token_expires_at = time.time() + int(result.get('expires_in', 3600))
+            else:
+                error_description = result.get('error_description', 'No error description provided')
+                raise Exception(f"Could not get access token: {error_description}")
+    
+    def _token_is_fresh(self):
+        return bool(self.access_token) and time.time() < self.token_expires_at - self.token_refresh_margin
+    
+    def _ensure_access_token(self):
+        """Refresh the access token if it's missing or about to expire"""
+        if not self._token_is_fresh():
+            with self._token_lock:
+                # Another thread may have refreshed it while we waited for the lock
+                if not self._token_is_fresh():
+                    self._get_access_token(force_refresh=bool(self.access_token))
+        return self.access_token
+    
+    def for_mailbox(self, user_email: str) -> 'OutlookSender':
         """
-        if not self.access_token:
-            self._get_access_token()
+        Get a sender for another mailbox in the same tenant
         
-        # Create email message
-        email_msg = {
+        The copy shares this sender's HTTP session, MSAL app and token cache,
+        since the application token is valid for every mailbox it may send from.
+        """
+        sender = copy.copy(self)
+        sender.user_email = user_email
+        sender.send_mail_endpoint = f'{self.graph_endpoint}/users/{user_email}/sendMail'
+        sender.throttle_count = 0
+        return sender
+    
+    def _record_throttle(self) -> None:
+        """Count a throttling response (429/503) from Graph"""
+        self.throttle_count += 1
+        metrics.inc('email_bot_throttles_total', api='graph')
+    
+    def _build_message(self, to_email, subject, content_html) -> Dict:
+        """Build the sendMail request body for one email"""
+        return {
             'message': {
                 'subject': subject,
                 'body': {
@@ -80,6 +162,57 @@ class OutlookSender:
             },
             'saveToSentItems': 'true'
         }
+    
+    def _message_json(self, to_email, subject, content_html, attachments: List[Attachment]) -> bytes:
+        """
+        JSON of one message with its inline attachments
+        
+        The attachment list is spliced in from the attachment cache as already
+        encoded JSON, so it isn't base64- or JSON-encoded again for every recipient.
+        """
+        message = json.dumps(self._build_message(to_email, subject, content_html)['message']).encode('utf-8')
+        fragment = self.attachment_cache.json_fragment(attachments)
+        if fragment is None:
+            return message
+        return message[:-1] + b', "attachments": ' + fragment + b'}'
+    
+    def _send_mail_json(self, to_email, subject, content_html, attachments: List[Attachment]) -> bytes:
+        """sendMail request body for one email, as JSON"""
+        return (b'{"message": ' + self._message_json(to_email, subject, content_html, attachments) +
+                b', "saveToSentItems": "true"}')
+    
+    @metrics.timed('graph_send')
+    def send_email(self, to_email, subject, content_html, retries=None, attachments=None):
+        """
+        Send an email using Microsoft Graph API
+        
+        Throttling (429/503), timeouts and server errors are retried with the
+        wait from the Retry-After header or exponential backoff. Permanent errors
+        such as 400 for a bad address fail right away.
+        
+        Args:
+            to_email: Recipient's email address
+            subject: Email subject
+            content_html: HTML content of the email
+            retries: Number of attempts (defaults to RETRY_MAX_ATTEMPTS)
+            attachments: Paths of files to attach (defaults to EMAIL_ATTACHMENTS)
+        
+        Returns:
+            bool: True if email was sent successfully, False otherwise
+        """
+        retries = retries or self.retry_policy.max_attempts
+        attachments = self.attachment_cache.resolve(self.attachments if attachments is None else attachments)
+        if any(not attachment.inline for attachment in attachments):
+            # Too large for one sendMail request
+            return self._send_with_upload_session(to_email, subject, content_html, attachments, retries)
+        
+        # Create email message
+        body = self._send_mail_json(to_email, subject, content_html, attachments)
+        if len(body) > GRAPH_REQUEST_MAX_BYTES:
+            # Each inline file fits, but together with the body they are over the request limit
+            return self._send_with_upload_session(to_email, subject, content_html, attachments, retries)
+        
+        self._ensure_access_token()
         
         headers = {
             'Authorization': f'Bearer {self.access_token}',
@@ -88,35 +221,339 @@ class OutlookSender:
         
         attempt = 0
         while attempt < retries:
+            retry_after = None
             try:
-                response = requests.post(
+                metrics.inc('email_bot_api_calls_total', api='graph', operation='sendMail')
+                response = self.session.post(
                     self.send_mail_endpoint,
                     headers=headers,
-                    json=email_msg
+                    data=body
                 )
                 
                 # Check if successful (202 Accepted or 204 No Content is a success response)
                 if response.status_code == 202 or response.status_code == 204:
                     print(f"Email send request accepted for {to_email} (Status: {response.status_code})")
                     return True
+                
+                print(f"Failed to send email: {response.status_code} - {response.text}")
+                
+                # If token expired, get a new one and retry straight away
+                if response.status_code == 401:
+                    print("Access token expired, refreshing...")
+                    self._get_access_token(force_refresh=True)
+                    headers['Authorization'] = f'Bearer {self.access_token}'
+                    retry_after = 0
+                elif not is_retryable_status(response.status_code):
+                    print(f"Not retrying email to {to_email}: the error is permanent.")
+                    return False
                 else:
-                    print(f"Failed to send email: {response.status_code} - {response.text}")
-                    
-                    # If token expired, get a new one
-                    if response.status_code == 401:
-                        print("Access token expired, refreshing...")
-                        self._get_access_token()
-                        headers['Authorization'] = f'Bearer {self.access_token}'
-                    
-                    attempt += 1
-                    if attempt < retries:
-                        print(f"Retrying in 5 seconds... (Attempt {attempt+1}/{retries})")
-                        time.sleep(5)
+                    if is_throttle_status(response.status_code):
+                        self._record_throttle()
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
             except Exception as e:
                 print(f"Exception while sending email: {str(e)}")
-                attempt += 1
-                if attempt < retries:
-                    print(f"Retrying in 5 seconds... (Attempt {attempt+1}/{retries})")
-                    time.sleep(5)
+                retryable, _ = self.retry_policy.classify(e)
+                if not retryable:
+                    return False
+            
+            attempt += 1
+            if attempt < retries:
+                metrics.inc('email_bot_retries_total', api='graph')
+                delay = self.retry_policy.backoff(attempt, retry_after)
+                print(f"Retrying in {delay:.1f} seconds... (Attempt {attempt+1}/{retries})")
+                self.retry_policy.sleep(delay)
+        
+        return False
+    
+    def _graph_request(self, method: str, url: str, operation: str, expected_statuses: Tuple[int, ...],
+                       authorize: bool = True, **kwargs):
+        """
+        Make one Graph request, raising RetryableError or PermanentError on failure
+        
+        Meant to be run through the retry policy. After a 401 the token is
+        refreshed and the request is retried straight away.
+        
+        Args:
+            method: 'post', 'put' or 'delete'
+            url: Request URL
+            operation: Name used in metrics and errors
+            expected_statuses: Status codes that mean success
+            authorize: Send the access token (upload URLs are pre-authenticated and must not get it)
+            **kwargs: Passed on to the session, e.g. data or json
+        
+        Returns:
+            The response
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        if authorize:
+            headers['Authorization'] = f'Bearer {self._ensure_access_token()}'
+        
+        metrics.inc('email_bot_api_calls_total', api='graph', operation=operation)
+        response = getattr(self.session, method)(url, headers=headers, **kwargs)
+        if response.status_code in expected_statuses:
+            return response
+        
+        message = f"{operation} failed: {response.status_code} - {response.text}"
+        if response.status_code == 401 and authorize:
+            self._get_access_token(force_refresh=True)
+            raise RetryableError(message, status_code=401, retry_after=0)
+        if not is_retryable_status(response.status_code):
+            raise PermanentError(message, status_code=response.status_code)
+        if is_throttle_status(response.status_code):
+            # The retry policy counts the throttle metric
+            self.throttle_count += 1
+        raise RetryableError(message, status_code=response.status_code,
+                             retry_after=parse_retry_after(response.headers.get('Retry-After')))
+    
+    def _upload_attachment(self, message_url: str, attachment: Attachment, retries: int) -> None:
+        """Attach a large file to a draft through an upload session, one chunk at a time"""
+        upload_session = self.retry_policy.call(
+            self._graph_request, 'post', f'{message_url}/attachments/createUploadSession', 'createUploadSession',
+            (200, 201),
+            json={
+                'AttachmentItem': {
+                    'attachmentType': 'file',
+                    'name': attachment.name,
+                    'size': attachment.size,
+                    'contentType': attachment.content_type
+                }
+            },
+            description=f"upload session for {attachment.name}",
+            max_attempts=retries
+        )
+        upload_url = upload_session.json()['uploadUrl']
+        
+        for offset, chunk in attachment.iter_chunks(self.upload_chunk_bytes):
+            self.retry_policy.call(
+                self._graph_request, 'put', upload_url, 'uploadChunk', (200, 201), authorize=False,
+                headers={
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{attachment.size}'
+                },
+                data=chunk,
+                description=f"upload of {attachment.name}",
+                max_attempts=retries
+            )
+    
+    def _add_attachment(self, message_url: str, attachment: Attachment, retries: int) -> None:
+        """Attach an inline-sized file to a draft with a request of its own"""
+        # The cached attachment list of just this file, without its brackets
+        fragment = self.attachment_cache.json_fragment([attachment])[1:-1]
+        self.retry_policy.call(
+            self._graph_request, 'post', f'{message_url}/attachments', 'addAttachment', (201,),
+            headers={'Content-Type': 'application/json'},
+            data=fragment,
+            description=f"attachment {attachment.name}",
+            max_attempts=retries
+        )
+    
+    def _send_with_upload_session(self, to_email, subject, content_html, attachments: List[Attachment],
+                                  retries: int) -> bool:
+        """
+        Send an email whose attachments are too large to send inline
+        
+        The message is created as a draft with its small attachments, each
+        large file is uploaded to it in chunks, and the draft is then sent. If
+        the small attachments alone would put the draft over the 4 MB request
+        limit, they are added to the draft one at a time instead. If any step
+        fails for good the draft is deleted.
+        
+        Args:
+            retries: Number of attempts for each request
+        
+        Returns:
+            bool: True if email was sent successfully, False otherwise
+        """
+        messages_url = f'{self.graph_endpoint}/users/{self.user_email}/messages'
+        draft_body = self._message_json(to_email, subject, content_html, attachments)
+        separate = [attachment for attachment in attachments if not attachment.inline]
+        if len(draft_body) > GRAPH_REQUEST_MAX_BYTES:
+            draft_body = self._message_json(to_email, subject, content_html, [])
+            separate = attachments
+        try:
+            draft = self.retry_policy.call(
+                self._graph_request, 'post', messages_url, 'createDraft', (201,),
+                headers={'Content-Type': 'application/json'},
+                data=draft_body,
+                description=f"draft for {to_email}",
+                max_attempts=retries
+            )
+            message_url = f"{messages_url}/{draft.json()['id']}"
+        except Exception as e:
+            print(f"Failed to create draft for {to_email}: {str(e)}")
+            return False
+        
+        try:
+            for attachment in separate:
+                if attachment.inline:
+                    self._add_attachment(message_url, attachment, retries)
+                else:
+                    self._upload_attachment(message_url, attachment, retries)
+            self.retry_policy.call(self._graph_request, 'post', f'{message_url}/send', 'send', (202,),
+                                   description=f"email to {to_email}", max_attempts=retries)
+        except Exception as e:
+            print(f"Failed to send email with attachments to {to_email}: {str(e)}")
+            try:
+                self._graph_request('delete', message_url, 'deleteDraft', (204,))
+            except Exception as delete_error:
+                print(f"Could not delete the draft for {to_email}: {str(delete_error)}")
+            return False
+        
+        print(f"Email send request accepted for {to_email} (Status: 202)")
+        return True
+    
+    @metrics.timed('graph_send_batch')
+    def send_batch(self, emails: List[Dict[str, str]], retries=None) -> List[bool]:
+        """
+        Send several emails with Microsoft Graph JSON batching
+        
+        Emails are grouped into $batch calls of up to 20 sendMail requests. The
+        result of every request in a batch is checked separately, and only the
+        emails that failed with a retryable error are sent again. Inline
+        attachments go inside every request of the batch, with fewer emails per
+        call so it stays under 4 MB; with attachments that need an upload
+        session the emails are sent one at a time instead.
+        
+        Args:
+            emails: List of dictionaries with 'to_email', 'subject' and 'content_html'
+            retries: Number of attempts for each email (defaults to RETRY_MAX_ATTEMPTS)
+        
+        Returns:
+            List of booleans, True for each email that was sent successfully
+        """
+        attachments = self.attachment_cache.resolve(self.attachments)
+        fragment = self.attachment_cache.json_fragment(attachments) or b''
+        if any(not attachment.inline for attachment in attachments) or len(fragment) > GRAPH_REQUEST_MAX_BYTES // 2:
+            # Each email needs its own upload session, or only one would fit in a $batch call;
+            # send_email also handles emails that are over the request limit with their body
+            return [self.send_email(email['to_email'], email['subject'], email['content_html'], retries)
+                    for email in emails]
+        
+        retries = retries or self.retry_policy.max_attempts
+        results = [False] * len(emails)
+        pending = list(range(len(emails)))
+        
+        attempt = 0
+        while pending and attempt < retries:
+            self._ensure_access_token()
+            headers = {
+                'Authorization': f'Bearer {self.access_token}',
+                'Content-Type': 'application/json'
+            }
+            
+            retry = []
+            retry_after = None
+            for chunk in self._batch_chunks(emails, pending, len(fragment)):
+                chunk_retry, chunk_retry_after = self._send_batch_chunk(emails, chunk, headers, results,
+                                                                        attachments)
+                retry.extend(chunk_retry)
+                if chunk_retry_after is not None:
+                    retry_after = max(retry_after or 0, chunk_retry_after)
+            
+            pending = retry
+            attempt += 1
+            if pending and attempt < retries:
+                metrics.inc('email_bot_retries_total', len(pending), api='graph')
+                delay = self.retry_policy.backoff(attempt, retry_after)
+                print(f"Retrying {len(pending)} emails in {delay:.1f} seconds... (Attempt {attempt+1}/{retries})")
+                self.retry_policy.sleep(delay)
+        
+        return results
+    
+    @staticmethod
+    def _batch_chunks(emails: List[Dict[str, str]], indexes: List[int], attachment_bytes: int) -> List[List[int]]:
+        """Split emails into $batch calls of at most 20 requests and about 4 MB"""
+        chunks = [[]]
+        size = 0
+        for index in indexes:
+            # Rough JSON size of the request; the attachments dominate when there are any
+            email = emails[index]
+            email_size = attachment_bytes + 2 * (len(email['content_html']) + len(email['subject'])) + 1024
+            if chunks[-1] and (len(chunks[-1]) >= GRAPH_BATCH_LIMIT or size + email_size > GRAPH_REQUEST_MAX_BYTES):
+                chunks.append([])
+                size = 0
+            chunks[-1].append(index)
+            size += email_size
+        return [chunk for chunk in chunks if chunk]
+    
+    def _send_batch_chunk(self, emails: List[Dict[str, str]], indexes: List[int], headers: Dict[str, str],
+                          results: List[bool], attachments: List[Attachment]) -> Tuple[List[int], Optional[float]]:
+        """
+        Send one $batch call and record the per-email results
+        
+        Returns:
+            Tuple of (indexes of the emails that should be retried,
+            longest Retry-After requested for them or None)
+        """
+        # Assembled as bytes so the cached attachment JSON is spliced in rather than encoded again
+        requests_json = []
+        for index in indexes:
+            request = json.dumps({
+                'id': str(index),
+                'method': 'POST',
+                'url': f'/users/{self.user_email}/sendMail',
+                'headers': {'Content-Type': 'application/json'}
+            }).encode('utf-8')
+            body = self._send_mail_json(emails[index]['to_email'], emails[index]['subject'],
+                                        emails[index]['content_html'], attachments)
+            requests_json.append(request[:-1] + b', "body": ' + body + b'}')
+        batch = b'{"requests": [' + b', '.join(requests_json) + b']}'
+        
+        try:
+            metrics.inc('email_bot_api_calls_total', api='graph', operation='$batch')
+            response = self.session.post(self.batch_endpoint, headers=headers, data=batch)
+        except Exception as e:
+            print(f"Exception while sending email batch: {str(e)}")
+            retryable, _ = self.retry_policy.classify(e)
+            return (list(indexes) if retryable else []), None
+        
+        if response.status_code != 200:
+            print(f"Failed to send email batch: {response.status_code} - {response.text}")
+            if response.status_code == 401:
+                print("Access token expired, refreshing...")
+                self._get_access_token(force_refresh=True)
+                return list(indexes), 0
+            if not is_retryable_status(response.status_code):
+                return [], None
+            if is_throttle_status(response.status_code):
+                self._record_throttle()
+            return list(indexes), parse_retry_after(response.headers.get('Retry-After'))
+        
+        retry = set(indexes)
+        retry_after = None
+        token_rejected = False
+        for item in response.json().get('responses', []):
+            index = int(item['id'])
+            status = item.get('status')
+            to_email = emails[index]['to_email']
+            if status == 202 or status == 204:
+                print(f"Email send request accepted for {to_email} (Status: {status})")
+                results[index] = True
+                retry.discard(index)
+                continue
+            
+            error = (item.get('body') or {}).get('error', {})
+            print(f"Failed to send email to {to_email}: {status} - {error.get('message', error)}")
+            if status == 401:
+                token_rejected = True
+                continue
+            if not is_retryable_status(status):
+                # Permanent, e.g. a bad address; another attempt would fail the same way
+                retry.discard(index)
+                continue
+            
+            if is_throttle_status(status):
+                self._record_throttle()
+            item_retry_after = parse_retry_after((item.get('headers') or {}).get('Retry-After'))
+            if item_retry_after is not None:
+                retry_after = max(retry_after or 0, item_retry_after)
+        
+        if token_rejected:
+            # The cached token still looks fresh, so the retry would send it again without this
+            print("Access token expired, refreshing...")
+            self._get_access_token(force_refresh=True)
+            headers['Authorization'] = f'Bearer {self.access_token}'
+            retry_after = retry_after or 0
         
-        return False 
\ No newline at end of file
+        # Requests missing from the response are retried as well
+        return sorted(retry), retry_after
@@ -0,0 +1,139 @@
+import time
+import threading
+from typing import Optional
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int = 1, total_limit: Optional[int] = None):
+        """
+        Thread-safe token bucket rate limiter
+
+        Args:
+            rate_per_second: Tokens added to the bucket per second
+            capacity: Maximum number of tokens the bucket holds (the allowed burst)
+            total_limit: Maximum number of tokens handed out until reset_total() is
+                called, e.g. the daily email limit. None means unlimited.
+        """
+        self.rate_per_second = rate_per_second
+        self.capacity = max(1, capacity)
+        self.total_limit = total_limit
+
+        self._tokens = float(self.capacity)
+        self._granted = 0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_interval(cls, interval_minutes: float, burst: int = 1, daily_limit: Optional[int] = None) -> 'TokenBucket':
+        """Create a bucket that allows one token per interval_minutes"""
+        rate = 1.0 / (interval_minutes * 60) if interval_minutes > 0 else float('inf')
+        return cls(rate_per_second=rate, capacity=burst, total_limit=daily_limit)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate_per_second == float('inf'):
+            self._tokens = float(self.capacity)
+        else:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+        self._updated_at = now
+
+    @property
+    def remaining_total(self) -> Optional[int]:
+        """Tokens left before total_limit is reached (None if unlimited)"""
+        if self.total_limit is None:
+            return None
+        return max(0, self.total_limit - self._granted)
+
+    @property
+    def exhausted(self) -> bool:
+        """True once total_limit tokens have been handed out"""
+        return self.total_limit is not None and self._granted >= self.total_limit
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """Take tokens if they are all available right now"""
+        with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                return False
+            if self.total_limit is not None and self._granted + tokens > self.total_limit:
+                return False
+            self._tokens -= tokens
+            self._granted += tokens
+            return True
+
+    def try_acquire_up_to(self, max_tokens: int) -> int:
+        """
+        Take as many whole tokens as are available right now, up to max_tokens
+
+        Returns:
+            Number of tokens taken (0 if none are available)
+        """
+        with self._lock:
+            self._refill()
+            available = int(self._tokens)
+            if self.total_limit is not None:
+                available = min(available, self.total_limit - self._granted)
+            taken = max(0, min(max_tokens, available))
+            self._tokens -= taken
+            self._granted += taken
+            return taken
+
+    def time_until_available(self, tokens: int = 1) -> float:
+        """Seconds until the requested number of tokens will be available"""
+        with self._lock:
+            self._refill()
+            missing = tokens - self._tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate_per_second
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None,
+                stop_event: Optional[threading.Event] = None) -> bool:
+        """
+        Block until tokens are available
+
+        Args:
+            tokens: Number of tokens to take
+            timeout: Maximum number of seconds to wait (None waits indefinitely)
+            stop_event: Event that aborts the wait when it is set
+
+        Returns:
+            True if the tokens were taken, False on timeout, stop or when the
+            total limit has been reached
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.exhausted:
+                return False
+            if self.try_acquire(tokens):
+                return True
+
+            wait = self.time_until_available(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            # Wake up at least once a second so a stop request is noticed quickly
+            wait = min(max(wait, 0.01), 1.0)
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def refund_total(self, tokens: int = 1) -> None:
+        """Give back total-limit allowance, e.g. for a send that failed"""
+        with self._lock:
+            self._granted = max(0, self._granted - tokens)
+
+    def charge_total(self, tokens: int = 1) -> None:
+        """Count tokens against total_limit without waiting, e.g. sends restored from a journal"""
+        with self._lock:
+            self._granted += tokens
+
+    def reset_total(self) -> None:
+        """Start counting towards total_limit from zero again"""
+        with self._lock:
+            self._granted = 0
@@ -0,0 +1,143 @@
+import os
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional
+
+from recipient_source import RecipientSource
+
+class RecipientQueue:
+    def __init__(self, sheets_handler: RecipientSource, status_column_index=None, status_filter="Not Sent",
+                 status_scan=None, screen: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None,
+                 rescan: Optional[Callable[[], bool]] = None):
+        """
+        Queue of recipients waiting to be emailed, streamed from the sheet
+
+        The sheet is read page by page as recipients are taken, so only one page
+        of pending rows is held in memory at a time. With status_scan, only the
+        status column is read up front and full rows are fetched for the pending
+        recipients alone. Once the end of the range is reached, only the rows
+        below the last row seen are fetched, and status changes made by the bot
+        are tracked locally instead of being re-read from the sheet.
+
+        Args:
+            sheets_handler: Recipient source (Google Sheets or a local file) to read rows from
+            status_column_index: Index of the column that contains the email status
+            status_filter: Status value a row must have to be queued (e.g., "Not Sent")
+            status_scan: Scan the status column first (defaults to SHEETS_STATUS_SCAN, on)
+            screen: Called with every page of new recipients; returns the ones to
+                queue (e.g. without suppressed or duplicate addresses)
+            rescan: Called once no pending recipients are left; when it returns
+                True the sheet is read again from the top (e.g. because rows
+                leased by another worker were freed)
+        """
+        self.sheets_handler = sheets_handler
+        self.status_column_index = status_column_index
+        self.status_filter = status_filter
+        self.screen = screen
+        self.rescan = rescan
+        if status_scan is None:
+            status_scan = os.environ.get('SHEETS_STATUS_SCAN', 'true').lower() in ('1', 'true', 'yes')
+        self._read_pages = sheets_handler.iter_pending_chunks if status_scan else sheets_handler.iter_recipient_chunks
+
+        self.headers = []
+        self.last_row = None
+        self._pending = deque()
+        # Statuses set by the bot (or restored from the send journal), by row index
+        self._statuses = {}
+        # Pages still to be read from the sheet, or None once the range is exhausted
+        self._pages = None
+
+    def load(self) -> int:
+        """Start reading the sheet from the top and queue the first page of matching recipients"""
+        self._pending.clear()
+        self.last_row = None
+        self._pages = self._read_pages(
+            status_column_index=self.status_column_index,
+            status_filter=self.status_filter
+        )
+        self._read_page()
+        print(f"Loaded {len(self._pending)} pending recipients from the first page (sheet rows up to {self.last_row}).")
+        return len(self._pending)
+
+    def refresh(self) -> int:
+        """
+        Fetch only the rows added below the last row seen
+
+        Returns:
+            Number of newly queued recipients
+        """
+        if self.last_row is None or not self.headers:
+            # Not read yet, or the sheet was empty on the first read so there is no header row yet
+            return self.load()
+
+        self._pages = self._read_pages(
+            start_row=self.last_row + 1,
+            headers=self.headers,
+            status_column_index=self.status_column_index,
+            status_filter=self.status_filter
+        )
+        added = self._read_page()
+        if added:
+            print(f"Queued {added} new recipients (sheet rows up to {self.last_row}).")
+        return added
+
+    def _read_page(self) -> int:
+        """Queue the matching recipients of the next page, skipping pages without any"""
+        while self._pages is not None:
+            try:
+                headers, recipients, last_row = next(self._pages)
+            except StopIteration:
+                self._pages = None
+                break
+
+            self.headers = headers
+            self.last_row = last_row if self.last_row is None else max(self.last_row, last_row)
+            # Rows the bot already handled are left out before screening, so they don't count as duplicates
+            recipients = [recipient for recipient in recipients if recipient['_row_index'] not in self._statuses]
+            if recipients and self.screen:
+                recipients = self.screen(recipients)
+            if recipients:
+                self._pending.extend(recipients)
+                return len(recipients)
+
+        if self.last_row is None:
+            # Empty sheet; refresh() reads it from the top again since there are no headers yet
+            self.last_row = 0
+        return 0
+
+    def next(self) -> Optional[Dict[str, Any]]:
+        """
+        Get the next recipient to email
+
+        Returns:
+            Recipient record, or None when no pending recipients are left
+        """
+        if self.last_row is None:
+            self.load()
+
+        while True:
+            if not self._pending:
+                if self._pages is not None:
+                    self._read_page()
+                else:
+                    self.refresh()
+                    if not self._pending and self.rescan is not None and self.rescan():
+                        self.load()
+                if not self._pending:
+                    return None
+
+            recipient = self._pending.popleft()
+            # Rows the bot already handled keep the status it gave them
+            if recipient['_row_index'] not in self._statuses:
+                return recipient
+
+    def mark(self, row_index: int, status: str) -> None:
+        """Record a status change made by the bot for a row"""
+        self._statuses[row_index] = status
+
+    def status_of(self, row_index: int) -> Optional[str]:
+        """Last status set locally for a row (None if the bot hasn't changed it)"""
+        return self._statuses.get(row_index)
+
+    def __len__(self) -> int:
+        """Number of recipients read from the sheet and waiting (at most about one page)"""
+        return len(self._pending)
@@ -0,0 +1,291 @@
+import os
+import datetime
+from collections.abc import MutableMapping
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+def _index_to_column_letter(index: int) -> str:
+    """Convert a 0-based column index to A1 column letters (0 -> A, 25 -> Z, 26 -> AA)"""
+    letters = ''
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+# Precomputed A1 column letters for A..ZZ, which covers any realistic sheet width
+_COLUMN_LETTERS = [_index_to_column_letter(i) for i in range(26 + 26 * 26)]
+
+def column_letter(index: int) -> str:
+    """Get the A1 column letters for a 0-based column index"""
+    if index < len(_COLUMN_LETTERS):
+        return _COLUMN_LETTERS[index]
+    return _index_to_column_letter(index)
+
+def column_index(letters: str) -> int:
+    """Get the 0-based column index for A1 column letters (A -> 0, AA -> 26)"""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def status_date() -> str:
+    """Today's date as written to the Date column next to a "Sent" status (M/D)"""
+    return datetime.datetime.now().strftime("%-m/%-d")
+
+class RecipientRecord(MutableMapping):
+    """
+    One recipient row, read like a dict of header -> cell value
+
+    The record keeps the row's cell list as returned by the API plus a header ->
+    column map shared by every row of the sheet, instead of a dict per row.
+    Values added later (e.g. the sector and ChatGPT suggestion) go into a small
+    per-record dict that is only created when needed.
+    """
+    __slots__ = ('_columns', '_values', '_row_index', '_extra')
+
+    def __init__(self, columns: Dict[str, int], values: List[str], row_index: int):
+        self._columns = columns
+        self._values = values
+        self._row_index = row_index
+        self._extra = None
+
+    def __getitem__(self, key: str) -> Any:
+        if key == '_row_index':
+            return self._row_index
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        index = self._columns[key]
+        # The API leaves out trailing empty cells, so short rows read as ''
+        return self._values[index] if index < len(self._values) else ''
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == '_row_index':
+            self._row_index = value
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key == '_row_index' or key in self._columns or (self._extra is not None and key in self._extra)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._columns
+        yield '_row_index'
+        if self._extra is not None:
+            yield from (key for key in self._extra if key not in self._columns)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"RecipientRecord({dict(self)!r})"
+
+
+class RecipientSource:
+    """
+    Where recipients are read from and their statuses written back to
+
+    The bot, the recipient queue and the status writer only use this interface,
+    so recipients can come from Google Sheets or from a local file or database.
+    Backends implement get_headers, find_status_column_index,
+    iter_recipient_chunks, build_status_updates and batch_update; the rest is
+    built on those.
+
+    Rows are numbered like sheet rows: the header row is row 1 and the first
+    recipient is row 2. A local copy of a sheet therefore uses the same row
+    indexes, and its statuses can be mirrored back to the sheet.
+    """
+
+    @property
+    def name(self) -> Optional[str]:
+        """Identifies the campaign, e.g. in the send journal and health output"""
+        return None
+
+    def get_headers(self, refresh: bool = False) -> List[str]:
+        """
+        Get the header row
+
+        Args:
+            refresh: Re-read the header row even if it is cached
+
+        Returns:
+            List of header names
+        """
+        raise NotImplementedError
+
+    def find_status_column_index(self, status_column: str = "Status") -> int:
+        """Find the index of the status column, adding the column if it doesn't exist"""
+        raise NotImplementedError
+
+    def iter_recipient_chunks(self, start_row=None, headers=None, status_column_index=None,
+                              status_filter="Not Sent",
+                              chunk_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        """
+        Read the recipients page by page, keeping only rows with the wanted status
+
+        Args:
+            start_row: First row (1-based) to read. When None reading starts at the
+                first recipient.
+            headers: Header row from a previous read
+            status_column_index: Index of the column that contains the email status
+            status_filter: Filter to apply to the status column (e.g., "Not Sent")
+            chunk_size: Rows read per page
+
+        Yields:
+            Tuple of (headers, matching records in the page, index of the last row read)
+        """
+        raise NotImplementedError
+
+    def build_status_updates(self, row_index: int, status_column: str, status: str) -> List[Dict[str, Any]]:
+        """
+        Build the cell updates for a status change without writing them
+
+        Args:
+            row_index: Index of the row to update (1-based)
+            status_column: Name of the status column
+            status: New status value
+
+        Returns:
+            List of cell updates ({'range': ..., 'values': ...}), keyed by cell
+        """
+        raise NotImplementedError
+
+    def batch_update(self, updates: List[Dict[str, Any]]) -> None:
+        """
+        Write several cell updates at once
+
+        Args:
+            updates: Cell updates from build_status_updates
+        """
+        raise NotImplementedError
+
+    def iter_pending_chunks(self, start_row=None, headers=None, status_column_index=None,
+                            status_filter="Not Sent",
+                            batch_size=None) -> Iterator[Tuple[List[str], List[RecipientRecord], int]]:
+        """
+        Read only the rows with the wanted status, for sources that can find them cheaply
+
+        Sources without a cheaper way read page by page like iter_recipient_chunks.
+        """
+        return self.iter_recipient_chunks(start_row=start_row, headers=headers,
+                                          status_column_index=status_column_index,
+                                          status_filter=status_filter)
+
+    def get_recipients(self, status_column_index=None, status_filter="Not Sent") -> List[Dict[str, str]]:
+        """
+        Get recipients
+
+        Args:
+            status_column_index: Index of the column that contains the email status
+            status_filter: Filter to apply to the status column (e.g., "Not Sent")
+
+        Returns:
+            List of dictionaries with recipient data
+        """
+        _, recipients, _ = self.get_recipient_rows(
+            status_column_index=status_column_index,
+            status_filter=status_filter
+        )
+        return recipients
+
+    def get_recipient_rows(self, start_row=None, headers=None, status_column_index=None,
+                           status_filter="Not Sent") -> Tuple[List[str], List[RecipientRecord], int]:
+        """
+        Get recipients from all rows, or only from the rows below a given row
+
+        Args:
+            start_row: First row (1-based) to read. When None every row is read.
+            headers: Header row from a previous full read
+            status_column_index: Index of the column that contains the email status
+            status_filter: Filter to apply to the status column (e.g., "Not Sent")
+
+        Returns:
+            Tuple of (headers, recipients, index of the last row read)
+        """
+        last_row = start_row - 1 if start_row is not None else 1
+        recipients = []
+        for headers, records, last_row in self.iter_recipient_chunks(
+            start_row=start_row,
+            headers=headers,
+            status_column_index=status_column_index,
+            status_filter=status_filter
+        ):
+            recipients.extend(records)
+        return headers or [], recipients, last_row
+
+    def iter_recipients(self, status_column_index=None, status_filter="Not Sent",
+                        chunk_size=None) -> Iterator[RecipientRecord]:
+        """
+        Stream matching recipients, one page of rows at a time
+
+        Only one page of rows is held in memory at a time, so sources of any size
+        can be read in bounded memory.
+
+        Args:
+            status_column_index: Index of the column that contains the email status
+            status_filter: Filter to apply to the status column (e.g., "Not Sent")
+            chunk_size: Rows read per page
+
+        Yields:
+            RecipientRecord for every row whose status matches
+        """
+        for _, records, _ in self.iter_recipient_chunks(status_column_index=status_column_index,
+                                                        status_filter=status_filter,
+                                                        chunk_size=chunk_size):
+            yield from records
+
+    def update_status(self, row_index: int, status_column: str, status: str) -> None:
+        """
+        Update the status of an email and add today's date
+
+        Args:
+            row_index: Index of the row to update (1-based)
+            status_column: Name of the status column
+            status: New status value
+        """
+        self.batch_update(self.build_status_updates(row_index, status_column, status))
+
+    def close(self) -> None:
+        """Release files or connections held by the source"""
+
+
+def open_recipient_source(spec: Optional[str] = None, sheet_id=None, sheet_range=None) -> RecipientSource:
+    """
+    Open the recipient source configured with RECIPIENT_SOURCE
+
+    The spec is 'sheets' (the default) for Google Sheets, or the path of a local
+    file. The kind of file is taken from its extension (.csv, .parquet,
+    .sqlite/.sqlite3/.db) or from a 'csv:', 'parquet:' or 'sqlite:' prefix.
+
+    Args:
+        spec: Source to open (defaults to RECIPIENT_SOURCE)
+        sheet_id: Google Sheet ID, for the Sheets source
+        sheet_range: A1 range holding the recipients, for the Sheets source
+
+    Returns:
+        The recipient source
+    """
+    spec = spec or os.environ.get('RECIPIENT_SOURCE', 'sheets')
+    if spec.lower() in ('sheets', 'google_sheets'):
+        from google_sheets import GoogleSheetsHandler
+        return GoogleSheetsHandler(sheet_id=sheet_id, sheet_range=sheet_range)
+
+    kind, separator, path = spec.partition(':')
+    if not separator or kind.lower() not in ('csv', 'parquet', 'sqlite'):
+        path = spec
+        extension = os.path.splitext(spec)[1].lower()
+        kind = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet',
+                '.sqlite': 'sqlite', '.sqlite3': 'sqlite', '.db': 'sqlite'}.get(extension)
+        if kind is None:
+            raise ValueError(f"Unsupported RECIPIENT_SOURCE: {spec}")
+
+    from local_sources import CsvRecipientSource, ParquetRecipientSource, SqliteRecipientSource
+    source_class = {'csv': CsvRecipientSource, 'parquet': ParquetRecipientSource,
+                    'sqlite': SqliteRecipientSource}[kind.lower()]
+    return source_class(path)
@@ -0,0 +1,184 @@
+import os
+import time
+import random
+import email.utils
+from typing import Any, Callable, Optional, Tuple
+
+from metrics import metrics
+
+# Status codes worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Exception class names (from requests, httplib2 and openai) that mean a transient network problem
+_TRANSIENT_ERROR_NAMES = ('Timeout', 'Connection', 'ChunkedEncoding', 'ServerNotFound')
+
+class RetryableError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        """An error that may succeed if the call is repeated (e.g. throttling)"""
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class PermanentError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        """An error that will fail the same way on every attempt (e.g. a bad address)"""
+        super().__init__(message)
+        self.status_code = status_code
+
+def is_retryable_status(status_code: Optional[int]) -> bool:
+    """True for HTTP status codes that are worth retrying"""
+    return status_code in RETRYABLE_STATUS_CODES
+
+def is_throttle_status(status_code: Optional[int]) -> bool:
+    """True for HTTP status codes that mean the service is throttling us"""
+    return status_code in (429, 503)
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    """
+    Parse a Retry-After header value
+
+    Args:
+        value: Number of seconds, or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the value is missing or can't be parsed
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status code carried by an exception from googleapiclient, requests, openai or this module"""
+    # googleapiclient.errors.HttpError keeps the response in .resp
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    # openai.APIStatusError, requests.HTTPError and RetryableError carry the status
+    status = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return int(status) if status is not None else None
+
+def _header(headers: Any, name: str) -> Optional[str]:
+    if not headers:
+        return None
+    try:
+        value = headers.get(name)
+        if value is None:
+            value = headers.get(name.lower())
+        return value
+    except AttributeError:
+        return None
+
+class RetryPolicy:
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, sleep: Callable[[float], None] = None,
+                 name: str = 'other'):
+        """
+        Retry policy shared by the Graph, Sheets and OpenAI calls
+
+        Errors are classified as retryable (throttling, timeouts, 5xx, network
+        errors) or permanent (other 4xx). Retryable errors wait for the
+        Retry-After the service asked for, or for exponential backoff with full
+        jitter.
+
+        Args:
+            max_attempts: Total number of attempts, including the first one
+            base_delay: Backoff before the first retry, doubled on every attempt (seconds)
+            max_delay: Upper bound for any single wait (seconds)
+            sleep: Function used to wait (time.sleep by default)
+            name: API the policy is used for, as the label of its retry and throttle metrics
+        """
+        self.max_attempts = max_attempts or int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+        self.base_delay = base_delay if base_delay is not None else float(os.environ.get('RETRY_BASE_DELAY', 1))
+        self.max_delay = max_delay if max_delay is not None else float(os.environ.get('RETRY_MAX_DELAY', 60))
+        self.sleep = sleep or time.sleep
+        self.name = name
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before the next attempt
+
+        Args:
+            attempt: Number of attempts made so far (1 after the first failure)
+            retry_after: Wait requested by the service, which takes precedence
+        """
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def classify(self, error: BaseException) -> Tuple[bool, Optional[float]]:
+        """
+        Decide whether an exception is worth retrying
+
+        Understands this module's errors, requests exceptions, googleapiclient
+        HttpError and the OpenAI client's errors without importing them.
+
+        Returns:
+            Tuple of (retryable, seconds requested by a Retry-After header or None)
+        """
+        if isinstance(error, RetryableError):
+            return True, error.retry_after
+        if isinstance(error, PermanentError):
+            return False, None
+
+        status = error_status(error)
+        if status is not None:
+            resp = getattr(error, 'resp', None)
+            if resp is not None and getattr(resp, 'status', None) is not None:
+                retry_after = _header(resp, 'retry-after')
+            else:
+                retry_after = _header(getattr(getattr(error, 'response', None), 'headers', None), 'Retry-After')
+            return is_retryable_status(status), parse_retry_after(retry_after)
+
+        # Network problems: socket errors, requests' ConnectionError/Timeout,
+        # openai's APIConnectionError/APITimeoutError
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return True, None
+        name = type(error).__name__
+        if any(part in name for part in _TRANSIENT_ERROR_NAMES):
+            return True, None
+
+        return False, None
+
+    def call(self, func: Callable[..., Any], *args, description: str = 'request', max_attempts: Optional[int] = None,
+             **kwargs) -> Any:
+        """
+        Call func, retrying retryable errors
+
+        Args:
+            func: Function to call
+            description: Text used in log messages
+            max_attempts: Number of attempts (defaults to the policy's max_attempts)
+            *args, **kwargs: Arguments for func
+
+        Returns:
+            What func returns. The last error is raised if every attempt fails,
+            and permanent errors are raised right away.
+        """
+        max_attempts = max_attempts or self.max_attempts
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                retryable, retry_after = self.classify(e)
+                if is_throttle_status(error_status(e)):
+                    metrics.inc('email_bot_throttles_total', api=self.name)
+                if not retryable or attempt >= max_attempts:
+                    raise
+                metrics.inc('email_bot_retries_total', api=self.name)
+                delay = self.backoff(attempt, retry_after)
+                print(f"Error during {description}, retrying in {delay:.1f} seconds "
+                      f"(Attempt {attempt+1}/{max_attempts}): {str(e)}")
+                self.sleep(delay)
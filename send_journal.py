@@ -0,0 +1,197 @@
+import os
+import time
+import datetime
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+class SendJournal:
+    def __init__(self, path=None, campaign=None, retention_days=None):
+        """
+        Append-only local journal of every send, kept in a SQLite file in WAL mode
+
+        Each recipient row goes through three events: 'intent' right before the
+        email is handed to Graph, 'result' once the send succeeded or failed (with
+        the mailbox it went out from when there are several), and
+        'written' once its status was handed to the sheet writer. Every event is
+        committed before the bot moves on, so after a crash replay() tells which
+        rows were already emailed (and must not be emailed again), which statuses
+        still have to be written to the sheet, and how many emails went out today.
+
+        Rows are identified by their sheet row index, so the journal assumes rows
+        are not reordered while a campaign runs.
+
+        Args:
+            path: SQLite file that holds the journal
+            campaign: Name that separates campaigns sharing one file (e.g. the sheet ID)
+            retention_days: Days finished rows are kept before they are pruned
+        """
+        self.path = path or os.environ.get('SEND_JOURNAL_FILE', '.send_journal.sqlite3')
+        self.campaign = campaign or ''
+        self.retention_days = retention_days or float(os.environ.get('SEND_JOURNAL_RETENTION_DAYS', 30))
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # fsync on every commit: an 'intent' must be on disk before the email goes out
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS send_journal ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' campaign TEXT NOT NULL,'
+            ' row_index INTEGER NOT NULL,'
+            ' email TEXT,'
+            ' event TEXT NOT NULL,'
+            ' status TEXT,'
+            ' day TEXT NOT NULL,'
+            ' at REAL NOT NULL,'
+            ' mailbox TEXT)'
+        )
+        if 'mailbox' not in {column[1] for column in self._conn.execute('PRAGMA table_info(send_journal)')}:
+            # Journals written before sends were attributed to a mailbox
+            self._conn.execute('ALTER TABLE send_journal ADD COLUMN mailbox TEXT')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS send_journal_row ON send_journal (campaign, row_index, id)'
+        )
+        self._conn.commit()
+        self._prune()
+
+    def _prune(self) -> None:
+        """Drop rows whose status was written longer than retention_days ago"""
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM send_journal WHERE campaign = ? AND row_index IN ('
+                ' SELECT row_index FROM send_journal'
+                ' WHERE campaign = ? AND event = ? GROUP BY row_index HAVING MAX(at) < ?)',
+                (self.campaign, self.campaign, 'written', cutoff)
+            )
+            self._conn.commit()
+
+    def _append(self, entries: List[tuple]) -> None:
+        now = time.time()
+        today = datetime.date.today().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT INTO send_journal (campaign, row_index, email, event, status, day, at, mailbox)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(self.campaign, row_index, email, event, status, today, now, mailbox)
+                 for row_index, email, event, status, mailbox in entries]
+            )
+            self._conn.commit()
+
+    def record_intents(self, recipients: List[Dict[str, Any]]) -> None:
+        """Record that emails to these recipients are about to be sent (one commit)"""
+        self._append([(r['_row_index'], r.get('email'), 'intent', None, None) for r in recipients])
+
+    def record_intent(self, recipient: Dict[str, Any]) -> None:
+        """Record that an email to the recipient is about to be sent"""
+        self.record_intents([recipient])
+
+    def record_results(self, results: List[Tuple[Dict[str, Any], str]]) -> None:
+        """Record the statuses of several rows, e.g. skipped recipients (one commit)"""
+        self._append([(recipient['_row_index'], recipient.get('email'), 'result', status, None)
+                      for recipient, status in results])
+
+    def record_result(self, recipient: Dict[str, Any], status: str, mailbox: Optional[str] = None) -> None:
+        """
+        Record the outcome of a send as the status that goes into the sheet
+
+        Args:
+            recipient: Recipient record
+            status: Status written to the sheet
+            mailbox: Mailbox the email was sent from, so its daily count can be restored
+        """
+        self._append([(recipient['_row_index'], recipient.get('email'), 'result', status, mailbox)])
+
+    def record_written_rows(self, statuses: Dict[int, str]) -> None:
+        """Record that several rows' statuses were handed to the sheet writer (one commit)"""
+        self._append([(row_index, None, 'written', status, None) for row_index, status in statuses.items()])
+
+    def record_written(self, row_index: int, status: str) -> None:
+        """Record that a row's status was handed to the sheet writer"""
+        self.record_written_rows({row_index: status})
+
+    def emailed_addresses(self, sent_statuses=('Sent',)) -> List[str]:
+        """
+        Addresses this campaign has already emailed, or may have
+
+        Args:
+            sent_statuses: Results that mean the email (may have) gone out, e.g.
+                'Sent' and the status of interrupted sends
+
+        Returns:
+            Addresses whose latest send ended with one of sent_statuses, or has
+            no result yet (the process stopped mid-send). Addresses whose send
+            failed are left out, so they are tried again.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT row_index, email, event, status FROM send_journal'
+                ' WHERE campaign = ? AND event IN (?, ?) ORDER BY id',
+                (self.campaign, 'intent', 'result')
+            ).fetchall()
+
+        # row_index -> [address, result of its latest send attempt]
+        attempts = {}
+        for row_index, email, event, status in rows:
+            if event == 'intent':
+                attempts[row_index] = [email, None]
+            elif row_index in attempts:
+                attempts[row_index][1] = status
+        return sorted({email for email, status in attempts.values()
+                       if email and (status is None or status in sent_statuses)})
+
+    def replay(self) -> Dict[str, Any]:
+        """
+        Rebuild the send state of this campaign from the journal
+
+        Returns:
+            Dictionary with:
+                statuses: {row_index: status} for every row the journal knows about;
+                    None for rows with an 'intent' but no result (the process
+                    stopped mid-send, so it is unknown whether the email went out)
+                unwritten: {row_index: status} for results not yet handed to the writer
+                sent_today: Number of successful sends today
+                sent_today_by_mailbox: {mailbox: successful sends today} for the
+                    sends recorded with their mailbox
+                last_sent_time: datetime of the last successful send, or None
+        """
+        today = datetime.date.today().isoformat()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT row_index, event, status FROM send_journal WHERE id IN ('
+                ' SELECT MAX(id) FROM send_journal WHERE campaign = ? GROUP BY row_index)',
+                (self.campaign,)
+            ).fetchall()
+            sent_today, last_sent_at = self._conn.execute(
+                'SELECT COUNT(*), MAX(at) FROM send_journal'
+                ' WHERE campaign = ? AND event = ? AND status = ? AND day = ?',
+                (self.campaign, 'result', 'Sent', today)
+            ).fetchone()
+            by_mailbox = self._conn.execute(
+                'SELECT mailbox, COUNT(*) FROM send_journal'
+                ' WHERE campaign = ? AND event = ? AND status = ? AND day = ? AND mailbox IS NOT NULL'
+                ' GROUP BY mailbox',
+                (self.campaign, 'result', 'Sent', today)
+            ).fetchall()
+
+        statuses = {}
+        unwritten = {}
+        for row_index, event, status in rows:
+            statuses[row_index] = status
+            if event == 'result':
+                unwritten[row_index] = status
+
+        return {
+            'statuses': statuses,
+            'unwritten': unwritten,
+            'sent_today': sent_today,
+            'sent_today_by_mailbox': dict(by_mailbox),
+            'last_sent_time': datetime.datetime.fromtimestamp(last_sent_at) if last_sent_at else None
+        }
+
+    def close(self) -> None:
+        """Close the SQLite connection"""
+        with self._lock:
+            self._conn.close()
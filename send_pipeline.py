@@ -0,0 +1,275 @@
+import os
+import queue
+import threading
+from typing import Dict, Any, Callable, List, Optional
+
+from outlook_sender import GRAPH_BATCH_LIMIT
+from rate_limiter import TokenBucket
+
+# Marks the end of a stage's input
+_DONE = object()
+
+class SendPipeline:
+    def __init__(self, bot, rate_limiter: TokenBucket, send_workers=None, ai_workers=None, queue_size=None):
+        """
+        Pipelined send loop for EmailBot
+
+        Loading, AI enrichment, rendering, sending and status write-back run as
+        separate stages connected by bounded queues, so a slow stage (usually
+        the OpenAI call) does not hold up the others. Sending is done by a pool
+        of workers that share one token-bucket rate limiter.
+
+        Args:
+            bot: EmailBot whose recipient queue, template, sender and status writer are used
+            rate_limiter: Limiter shared by all send workers (interval and daily limit)
+            send_workers: Number of send worker threads
+            ai_workers: Number of AI enrichment worker threads
+            queue_size: Maximum number of jobs waiting between two stages
+        """
+        self.bot = bot
+        self.rate_limiter = rate_limiter
+        self.send_workers = send_workers or int(os.environ.get('SEND_WORKERS', 4))
+        self.ai_workers = ai_workers or int(os.environ.get('AI_WORKERS', 4))
+        self.queue_size = queue_size or int(os.environ.get('PIPELINE_QUEUE_SIZE', 20))
+        # Send several emails in one Graph $batch call when the rate limiter allows it
+        self.batch_send = os.environ.get('GRAPH_BATCH_SEND', 'false').lower() in ('1', 'true', 'yes')
+
+        self.stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {'loaded': 0, 'sent': 0, 'failed': 0, 'skipped': 0}
+
+    def _count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def run(self) -> Dict[str, int]:
+        """
+        Run every stage until the recipients or the daily allowance run out
+
+        Returns:
+            Counts of loaded, sent, failed and skipped recipients
+        """
+        enrich_queue = queue.Queue(maxsize=self.queue_size)
+        render_queue = queue.Queue(maxsize=self.queue_size)
+        send_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        loader = threading.Thread(target=self._load, args=(enrich_queue,), name='pipeline-load', daemon=True)
+        stages = [
+            (self._start_workers('enrich', self._enrich, enrich_queue, render_queue, self.ai_workers), enrich_queue),
+            (self._start_workers('render', self._render, render_queue, send_queue, 1), render_queue),
+            (self._start_workers('send', self._send, send_queue, write_queue, self.send_workers,
+                                 target=self._batch_send_work if self.batch_send else None), send_queue),
+            (self._start_workers('write', self._write_back, write_queue, None, 1), write_queue),
+        ]
+        loader.start()
+
+        print(f"Pipeline started: {self.ai_workers} AI workers, {self.send_workers} send workers.")
+        try:
+            loader.join()
+            # Shut the stages down in order so every job already loaded is finished
+            for workers, input_queue in stages:
+                for _ in workers:
+                    input_queue.put(_DONE)
+                for worker in workers:
+                    worker.join()
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            raise
+
+        print(f"Pipeline finished: {self.stats}")
+        return dict(self.stats)
+
+    def _start_workers(self, name: str, handler: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+                       input_queue: queue.Queue, output_queue: Optional[queue.Queue], count: int,
+                       target=None) -> List[threading.Thread]:
+        workers = []
+        for i in range(count):
+            worker = threading.Thread(
+                target=target or self._work,
+                args=(handler, input_queue, output_queue),
+                name=f'pipeline-{name}-{i}',
+                daemon=True
+            )
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def _work(self, handler, input_queue: queue.Queue, output_queue: Optional[queue.Queue]) -> None:
+        while True:
+            job = input_queue.get()
+            if job is _DONE:
+                return
+            try:
+                job = handler(job)
+            except Exception as e:
+                recipient = job['recipient']
+                print(f"Error processing {recipient.get('email', 'unknown')}: {str(e)}")
+                job['error'] = str(e)
+            if output_queue is not None and job is not None:
+                output_queue.put(job)
+
+    def _load(self, output_queue: queue.Queue) -> None:
+        """Stage 1: pull pending recipients from the recipient queue"""
+        while not self.stop_event.is_set():
+            recipient = self.bot._next_recipient(stop_event=self.stop_event)
+            if not recipient:
+                print("No more recipients to email.")
+                return
+            self._count('loaded')
+            output_queue.put({'recipient': recipient})
+
+    def _enrich(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Stage 2: add the sector and the ChatGPT suggestion"""
+        if self.stop_event.is_set():
+            return job
+        recipient = job['recipient']
+        if 'email' not in recipient or not recipient['email']:
+            print(f"No email address for recipient in row {recipient['_row_index']}")
+            job['error'] = 'missing email'
+            return job
+        self.bot._enrich_recipient(recipient)
+        return job
+
+    def _render(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Stage 3: fill the template"""
+        if 'error' not in job and not self.stop_event.is_set():
+            job['subject'], job['body'] = self.bot._render_email(job['recipient'])
+        return job
+
+    def _send(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Stage 4: send through Outlook once the rate limiter allows it"""
+        if 'error' in job:
+            job['success'] = False
+            return job
+
+        if self.stop_event.is_set() or not self.rate_limiter.acquire(stop_event=self.stop_event):
+            # Daily allowance used up or shutting down; leave the row as it is
+            self.stop_event.set()
+            job['skipped'] = True
+            return job
+
+        return self._deliver(job)
+
+    def _deliver(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Send one rendered job whose rate-limiter token has already been taken"""
+        recipient = job['recipient']
+        if not self.bot._begin_sends([recipient]):
+            # Another worker took over the row; it gets its status from there
+            self.rate_limiter.refund_total()
+            job['skipped'] = True
+            return job
+        job['success'] = self.bot.mail_sender.send_email(
+            to_email=recipient['email'],
+            subject=job['subject'],
+            content_html=job['body']
+        )
+        if not job['success']:
+            # Failed sends don't count towards the daily limit
+            self.rate_limiter.refund_total()
+        return job
+
+    def _batch_send_work(self, handler, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        """
+        Send worker that groups the jobs already waiting into Graph $batch calls
+
+        Each round takes one job (waiting if needed) plus whatever else is queued,
+        up to the batch limit. It waits for one token, then sends as many of the
+        jobs together as the rate limiter has tokens for.
+        """
+        while True:
+            job = input_queue.get()
+            if job is _DONE:
+                return
+
+            jobs = [job]
+            done = False
+            while len(jobs) < GRAPH_BATCH_LIMIT:
+                try:
+                    job = input_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _DONE:
+                    done = True
+                    break
+                jobs.append(job)
+
+            for job in self._send_jobs(jobs):
+                output_queue.put(job)
+            if done:
+                return
+
+    def _send_jobs(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send a group of jobs, batching as many as the rate limiter allows at a time"""
+        finished = []
+        waiting = []
+        for job in jobs:
+            if 'error' in job:
+                job['success'] = False
+                finished.append(job)
+            else:
+                waiting.append(job)
+
+        while waiting:
+            if self.stop_event.is_set() or not self.rate_limiter.acquire(stop_event=self.stop_event):
+                # Daily allowance used up or shutting down; leave these rows as they are
+                self.stop_event.set()
+                for job in waiting:
+                    job['skipped'] = True
+                finished.extend(waiting)
+                break
+
+            granted = 1 + self.rate_limiter.try_acquire_up_to(len(waiting) - 1)
+            group, waiting = waiting[:granted], waiting[granted:]
+            try:
+                if len(group) == 1:
+                    finished.append(self._deliver(group[0]))
+                    continue
+
+                held = self.bot._begin_sends([job['recipient'] for job in group])
+                if len(held) < len(group):
+                    # Rows another worker took over are left to it
+                    held_rows = {recipient['_row_index'] for recipient in held}
+                    for job in group:
+                        if job['recipient']['_row_index'] not in held_rows:
+                            job['skipped'] = True
+                            self.rate_limiter.refund_total()
+                    finished.extend(job for job in group if job.get('skipped'))
+                    group = [job for job in group if not job.get('skipped')]
+                    if not group:
+                        continue
+                results = self.bot.mail_sender.send_batch([
+                    {
+                        'to_email': job['recipient']['email'],
+                        'subject': job['subject'],
+                        'content_html': job['body']
+                    }
+                    for job in group
+                ])
+            except Exception as e:
+                print(f"Error sending email batch: {str(e)}")
+                results = [False] * len(group)
+
+            for job, success in zip(group, results):
+                job['success'] = success
+                if not success:
+                    # Failed sends don't count towards the daily limit
+                    self.rate_limiter.refund_total()
+            finished.extend(group)
+
+        return finished
+
+    def _write_back(self, job: Dict[str, Any]) -> None:
+        """Stage 5: record the result locally and in the sheet"""
+        recipient = job['recipient']
+        if job.get('skipped'):
+            self._count('skipped')
+            return None
+
+        if job.get('success'):
+            self._count('sent')
+        else:
+            self._count('failed')
+
+        self.bot._record_result(recipient, bool(job.get('success')))
+        return None
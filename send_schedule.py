@@ -0,0 +1,342 @@
+import os
+import time
+import heapq
+import random
+import datetime
+import threading
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def parse_windows(spec: str) -> List[Tuple[int, int]]:
+    """
+    Parse send windows such as '09:00-12:00,13:30-17:00'
+
+    Returns:
+        Sorted list of (start, end) in minutes after midnight; '24:00' ends a window at midnight
+    """
+    windows = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        minutes = []
+        for clock in (start, end):
+            hours, _, mins = clock.strip().partition(':')
+            minutes.append(int(hours) * 60 + int(mins or 0))
+        if not 0 <= minutes[0] < minutes[1] <= 24 * 60:
+            raise ValueError(f"Invalid send window: {part}")
+        windows.append((minutes[0], minutes[1]))
+    return sorted(windows)
+
+def parse_days(spec: str) -> set:
+    """
+    Parse send days such as 'mon-fri' or 'mon,wed,sat'
+
+    Returns:
+        Set of weekday numbers (Monday is 0)
+    """
+    days = set()
+    for part in spec.lower().split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        day = DAY_NAMES.index(first.strip()[:3])
+        end = DAY_NAMES.index(last.strip()[:3]) if last else day
+        # Ranges may wrap around the week, e.g. 'sat-mon'
+        days.add(day)
+        while day != end:
+            day = (day + 1) % 7
+            days.add(day)
+    return days
+
+def _zone(name: Optional[str]):
+    """tzinfo for an IANA zone name; None (local time) if name is empty"""
+    if not name:
+        return None
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(name)
+
+
+class SendSchedule:
+    def __init__(self, windows: List[Tuple[int, int]], days=None, timezone=None, daily_limit=None,
+                 min_interval_seconds: float = 0, jitter_seconds: float = 0, timezone_column=None,
+                 max_deferred=None):
+        """
+        Send slots precomputed over the day's business-hours windows
+
+        Replaces sleep-and-poll pacing: when the first slot is needed, the
+        remaining daily allowance is spread evenly over what is left of the
+        day's windows, and the slot times go into a min-heap. acquire() sleeps
+        until the earliest slot is due and takes it, so the process idles
+        between sends instead of waking up to check the clock. Only today's
+        windows are planned; once they are over acquire() returns False.
+
+        The schedule has the TokenBucket interface (acquire, try_acquire_up_to,
+        refund_total, ...), so the send pipeline uses it unchanged.
+
+        With timezone_column, a recipient is only emailed while the local time
+        in the zone named in that column (e.g. 'America/New_York') is inside a
+        window too; recipients outside their window wait in a second heap until
+        it opens. At most max_deferred recipients are held at a time, so the
+        recipient queue isn't drained into memory when most recipients are
+        outside their window.
+
+        Args:
+            windows: (start, end) minutes after midnight, from parse_windows
+            days: Weekday numbers on which emails are sent (defaults to every day)
+            timezone: IANA zone the windows are in (defaults to local time)
+            daily_limit: Slots per day
+            min_interval_seconds: Minimum spacing between slots (fewer slots are planned
+                if the windows are too short to send the whole allowance)
+            jitter_seconds: Each slot moves by up to this many seconds either way
+            timezone_column: Recipient column with the recipient's time zone
+            max_deferred: Most recipients held for their window at once (defaults to
+                SEND_MAX_DEFERRED, 1000)
+        """
+        self.windows = windows
+        self.days = set(range(7)) if days is None else set(days)
+        self.timezone = _zone(timezone)
+        self.total_limit = daily_limit
+        self.min_interval_seconds = min_interval_seconds
+        self.jitter_seconds = jitter_seconds
+        self.timezone_column = timezone_column
+        self.max_deferred = max_deferred or int(os.environ.get('SEND_MAX_DEFERRED', 1000))
+
+        self._slots = []
+        self._planned_day = None
+        self._granted = 0
+        self._lock = threading.Lock()
+
+        # Recipients waiting for their local window: (due timestamp, sequence, recipient)
+        self._deferred = []
+        self._sequence = itertools.count()
+        self._zones = {}
+
+    @classmethod
+    def from_env(cls, daily_limit: Optional[int] = None, interval_minutes: float = 0) -> Optional['SendSchedule']:
+        """Create the schedule configured with SEND_WINDOWS, or None when it isn't set"""
+        windows = os.environ.get('SEND_WINDOWS')
+        if not windows:
+            return None
+        return cls(
+            parse_windows(windows),
+            days=parse_days(os.environ.get('SEND_DAYS', 'mon-fri')),
+            timezone=os.environ.get('SEND_TIMEZONE') or None,
+            daily_limit=daily_limit,
+            min_interval_seconds=interval_minutes * 60,
+            jitter_seconds=float(os.environ.get('SEND_SLOT_JITTER_SECONDS', 30)),
+            timezone_column=os.environ.get('SEND_TIMEZONE_COLUMN') or None
+        )
+
+    def _intervals(self, day: datetime.date, tz) -> List[Tuple[float, float]]:
+        """The day's windows as (start, end) timestamps in a time zone (none on days off)"""
+        if day.weekday() not in self.days:
+            return []
+        midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=tz)
+        # Wall-clock offsets, so a window keeps its hours on daylight saving days
+        return [((midnight + datetime.timedelta(minutes=start)).timestamp(),
+                 (midnight + datetime.timedelta(minutes=end)).timestamp())
+                for start, end in self.windows]
+
+    def _today(self, now: float, tz=None) -> datetime.date:
+        return datetime.datetime.fromtimestamp(now, tz or self.timezone).date()
+
+    def _plan(self, now: float) -> None:
+        """Spread the remaining allowance over what is left of today's windows (lock held)"""
+        self._slots = []
+        self._planned_day = self._today(now)
+        count = self.total_limit - self._granted if self.total_limit is not None else 0
+        intervals = [(max(start, now), end) for start, end in self._intervals(self._planned_day, self.timezone)
+                     if end > now]
+        span = sum(end - start for start, end in intervals)
+        if count <= 0 or span <= 0:
+            return
+        if self.min_interval_seconds > 0:
+            count = max(1, min(count, int(span // self.min_interval_seconds)))
+
+        step = span / count
+        interval = 0
+        passed = 0.0
+        for i in range(count):
+            # Centre each slot in its share of the window time, then add jitter within the window
+            offset = (i + 0.5) * step
+            while offset - passed > intervals[interval][1] - intervals[interval][0]:
+                passed += intervals[interval][1] - intervals[interval][0]
+                interval += 1
+            start, end = intervals[interval]
+            due = start + (offset - passed)
+            if self.jitter_seconds:
+                due = min(max(due + random.uniform(-self.jitter_seconds, self.jitter_seconds), start), end)
+            heapq.heappush(self._slots, due)
+
+        first = datetime.datetime.fromtimestamp(self._slots[0], self.timezone)
+        print(f"Planned {count} send slots for {self._planned_day}, about {step / 60:.1f} minutes apart, "
+              f"starting {first:%H:%M:%S}.")
+
+    def _next_slot(self, now: float) -> Optional[float]:
+        """Earliest slot, planning the day first if needed (lock held)"""
+        if self.exhausted:
+            return None
+        if not self._slots and (self._planned_day != self._today(now) or self.remaining_total):
+            self._plan(now)
+        return self._slots[0] if self._slots else None
+
+    @property
+    def remaining_total(self) -> Optional[int]:
+        """Slots left before the daily limit is reached (None if unlimited)"""
+        if self.total_limit is None:
+            return None
+        return max(0, self.total_limit - self._granted)
+
+    @property
+    def exhausted(self) -> bool:
+        """True once the daily limit has been reached"""
+        return self.total_limit is not None and self._granted >= self.total_limit
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """Take a slot if one is due now"""
+        return self.try_acquire_up_to(tokens) == tokens
+
+    def try_acquire_up_to(self, max_tokens: int) -> int:
+        """
+        Take the slots that are already due, up to max_tokens
+
+        Returns:
+            Number of slots taken
+        """
+        now = time.time()
+        taken = 0
+        with self._lock:
+            while taken < max_tokens:
+                due = self._next_slot(now)
+                if due is None or due > now:
+                    break
+                heapq.heappop(self._slots)
+                self._granted += 1
+                taken += 1
+        return taken
+
+    def time_until_available(self, tokens: int = 1) -> float:
+        """Seconds until the next slot (infinite once today's windows are over)"""
+        now = time.time()
+        with self._lock:
+            due = self._next_slot(now)
+        return float('inf') if due is None else max(0.0, due - now)
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None,
+                stop_event: Optional[threading.Event] = None) -> bool:
+        """
+        Sleep until the next slot is due and take it
+
+        Args:
+            tokens: Number of slots to take (one at a time)
+            timeout: Maximum number of seconds to wait (None waits indefinitely)
+            stop_event: Event that aborts the wait when it is set
+
+        Returns:
+            True if the slots were taken, False on timeout, stop, once the daily
+            limit is reached or once today's windows are over
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        taken = 0
+        while taken < tokens:
+            if self.try_acquire():
+                taken += 1
+                continue
+
+            wait = self.time_until_available()
+            if wait == float('inf'):
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            # Bounded so a midnight reset that moves the slots is picked up
+            wait = min(wait, 60.0)
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+        return True
+
+    def refund_total(self, tokens: int = 1) -> None:
+        """Give back daily allowance, e.g. for a send that failed; it is planned again when the slots run out"""
+        with self._lock:
+            self._granted = max(0, self._granted - tokens)
+
+    def charge_total(self, tokens: int = 1) -> None:
+        """Count sends against the daily limit without a slot, e.g. sends restored from a journal"""
+        with self._lock:
+            self._granted += tokens
+            # Re-plan with the smaller allowance
+            self._slots = []
+            self._planned_day = None
+
+    def reset_total(self) -> None:
+        """Start a new day: the full allowance is planned over the new day's windows"""
+        with self._lock:
+            self._granted = 0
+            self._slots = []
+            self._planned_day = None
+
+    def closes_at(self) -> Optional[float]:
+        """Timestamp at which today's last window ends (None on a day off)"""
+        intervals = self._intervals(self._today(time.time()), self.timezone)
+        return intervals[-1][1] if intervals else None
+
+    def recipient_wait(self, recipient: Dict[str, Any]) -> float:
+        """
+        Seconds until the recipient's own time zone is inside a send window
+
+        Recipients without a zone, or with one that isn't a valid IANA name, are
+        sent in the schedule's windows only.
+        """
+        name = (recipient.get(self.timezone_column) or '').strip() if self.timezone_column else ''
+        if not name:
+            return 0.0
+        if name not in self._zones:
+            try:
+                self._zones[name] = _zone(name)
+            except Exception:
+                print(f"Unknown time zone '{name}' in column {self.timezone_column}; using the schedule's windows.")
+                self._zones[name] = None
+        tz = self._zones[name]
+        if tz is None:
+            return 0.0
+
+        now = time.time()
+        today = self._today(now, tz)
+        for days_ahead in range(8):
+            for start, end in self._intervals(today + datetime.timedelta(days=days_ahead), tz):
+                if end > now:
+                    return max(0.0, start - now)
+        return float('inf')
+
+    def defer(self, recipient: Dict[str, Any], due: float) -> None:
+        """Hold a recipient until its local send window opens"""
+        with self._lock:
+            heapq.heappush(self._deferred, (due, next(self._sequence), recipient))
+
+    @property
+    def deferred_full(self) -> bool:
+        """True once max_deferred recipients are held, so no more should be taken from the queue"""
+        with self._lock:
+            return len(self._deferred) >= self.max_deferred
+
+    def pop_due_deferred(self) -> Optional[Dict[str, Any]]:
+        """Take the held recipient whose window opened first, if any has"""
+        with self._lock:
+            if self._deferred and self._deferred[0][0] <= time.time():
+                return heapq.heappop(self._deferred)[2]
+        return None
+
+    def next_deferred_time(self) -> Optional[float]:
+        """When the next held recipient's window opens (None if none is held)"""
+        with self._lock:
+            return self._deferred[0][0] if self._deferred else None
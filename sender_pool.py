@@ -0,0 +1,279 @@
+import os
+import time
+import threading
+from typing import Dict, Any, List, Optional
+
+from outlook_sender import OutlookSender, GRAPH_BATCH_LIMIT
+from rate_limiter import TokenBucket
+
+class Mailbox:
+    def __init__(self, sender: OutlookSender, daily_limit: int, interval_minutes: float, burst: int = 1):
+        """
+        One sending mailbox with its own quota and health
+
+        Args:
+            sender: OutlookSender bound to this mailbox
+            daily_limit: Maximum number of emails this mailbox sends per day
+            interval_minutes: Minimum time between two emails from this mailbox
+            burst: Number of emails that may go out back to back
+        """
+        self.sender = sender
+        self.user_email = sender.user_email
+        self.daily_limit = daily_limit
+        self.interval_minutes = interval_minutes
+        self.rate_limiter = TokenBucket.from_interval(interval_minutes, burst=burst, daily_limit=daily_limit)
+
+        self.sent_today = 0
+        self.failed_today = 0
+        self.consecutive_throttles = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def load(self) -> float:
+        """Share of today's limit already used"""
+        return self.sent_today / self.daily_limit if self.daily_limit else 1.0
+
+    def status(self) -> Dict[str, Any]:
+        """Current quota and health of the mailbox"""
+        return {
+            'user_email': self.user_email,
+            'sent_today': self.sent_today,
+            'failed_today': self.failed_today,
+            'daily_limit': self.daily_limit,
+            'consecutive_throttles': self.consecutive_throttles,
+            'cooling_down': self.cooldown_until > time.time()
+        }
+
+
+class SenderPool:
+    def __init__(self, mailboxes: List[Mailbox], strategy=None, throttle_threshold=None, cooldown_seconds=None):
+        """
+        Spread sends across several mailboxes
+
+        Each mailbox has its own daily limit and interval. A send goes to the
+        least-loaded mailbox that is allowed to send now (or the next one in
+        turn with the 'round_robin' strategy). A mailbox that gets throttled
+        throttle_threshold times in a row is left out for cooldown_seconds.
+
+        Send methods have the same signatures as OutlookSender's, so the pool can
+        be used wherever a sender is expected.
+
+        Args:
+            mailboxes: Mailboxes to send from
+            strategy: 'least_loaded' or 'round_robin'
+            throttle_threshold: Consecutive throttled sends before a mailbox is rested
+            cooldown_seconds: How long a throttled mailbox is left out of rotation
+        """
+        if not mailboxes:
+            raise ValueError("SenderPool needs at least one mailbox.")
+        self.mailboxes = mailboxes
+        self.strategy = (strategy or os.environ.get('SENDER_POOL_STRATEGY', 'least_loaded')).lower()
+        self.throttle_threshold = throttle_threshold or int(os.environ.get('SENDER_THROTTLE_THRESHOLD', 3))
+        self.cooldown_seconds = cooldown_seconds or float(os.environ.get('SENDER_COOLDOWN_SECONDS', 300))
+
+        # Set to abort waits for a free mailbox, e.g. on shutdown
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._next_index = 0
+        # Address -> mailbox of the emails sent but not yet recorded in the send journal
+        self._sent_from = {}
+
+    @classmethod
+    def from_env(cls, sender: OutlookSender) -> Optional['SenderPool']:
+        """
+        Build a pool from MS_SENDER_MAILBOXES
+
+        The variable is a comma-separated list of 'email[:daily_limit[:interval_minutes]]'
+        entries, e.g. 'a@example.com:100:2,b@example.com:50'. Missing values fall back
+        to DAILY_EMAIL_LIMIT and EMAIL_INTERVAL_MINUTES.
+
+        Args:
+            sender: Sender whose session and token are shared with every mailbox
+
+        Returns:
+            SenderPool, or None if MS_SENDER_MAILBOXES isn't set
+        """
+        spec = os.environ.get('MS_SENDER_MAILBOXES', '').strip()
+        if not spec:
+            return None
+
+        default_limit = int(os.environ.get('DAILY_EMAIL_LIMIT', 10))
+        default_interval = float(os.environ.get('EMAIL_INTERVAL_MINUTES', 2))
+        burst = int(os.environ.get('SEND_BURST', 1))
+
+        mailboxes = []
+        for entry in spec.split(','):
+            parts = [part.strip() for part in entry.split(':')]
+            if not parts[0]:
+                continue
+            daily_limit = int(parts[1]) if len(parts) > 1 and parts[1] else default_limit
+            interval = float(parts[2]) if len(parts) > 2 and parts[2] else default_interval
+            mailboxes.append(Mailbox(sender.for_mailbox(parts[0]), daily_limit, interval, burst=burst))
+
+        pool = cls(mailboxes)
+        print(f"Sender pool with {len(mailboxes)} mailboxes: {', '.join(m.user_email for m in mailboxes)}")
+        return pool
+
+    @property
+    def daily_limit(self) -> int:
+        """Combined daily limit of every mailbox"""
+        return sum(mailbox.daily_limit for mailbox in self.mailboxes)
+
+    def _ordered(self, mailboxes: List[Mailbox]) -> List[Mailbox]:
+        if self.strategy == 'round_robin':
+            start = self._next_index % len(self.mailboxes)
+            rotation = self.mailboxes[start:] + self.mailboxes[:start]
+            return [mailbox for mailbox in rotation if mailbox in mailboxes]
+        return sorted(mailboxes, key=lambda mailbox: mailbox.load)
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[Mailbox]:
+        """
+        Wait for a mailbox that may send now and take one send from its quota
+
+        Args:
+            timeout: Maximum number of seconds to wait (None waits indefinitely)
+
+        Returns:
+            The mailbox, or None if every mailbox has used its daily limit, the
+            timeout passed or stop_event was set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stop_event.is_set():
+            with self._lock:
+                now = time.time()
+                candidates = [m for m in self.mailboxes if not m.rate_limiter.exhausted]
+                if not candidates:
+                    return None
+
+                healthy = [m for m in candidates if m.cooldown_until <= now]
+                for mailbox in self._ordered(healthy):
+                    if mailbox.rate_limiter.try_acquire():
+                        self._next_index = self.mailboxes.index(mailbox) + 1
+                        return mailbox
+
+                waits = [m.rate_limiter.time_until_available() for m in healthy]
+                waits += [m.cooldown_until - now for m in candidates if m.cooldown_until > now]
+
+            wait = min(waits) if waits else 1.0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                wait = min(wait, remaining)
+            # Wake up at least once a second so a stop request is noticed quickly
+            self.stop_event.wait(min(max(wait, 0.01), 1.0))
+        return None
+
+    def report(self, mailbox: Mailbox, success: bool, throttled: bool) -> None:
+        """Record the result of a send from a mailbox and update its health"""
+        self.report_batch(mailbox, [success], throttled)
+
+    def report_batch(self, mailbox: Mailbox, successes: List[bool], throttled: bool) -> None:
+        """
+        Record the results of one call to Graph from a mailbox and update its health
+
+        A throttled $batch call counts as one throttle, however many of its
+        emails were throttled.
+
+        Args:
+            mailbox: Mailbox the emails were sent from
+            successes: Result of each email in the call
+            throttled: Whether Graph throttled the call or any email in it
+        """
+        sent = sum(1 for success in successes if success)
+        failed = len(successes) - sent
+        with self._lock:
+            mailbox.sent_today += sent
+            mailbox.failed_today += failed
+            if failed:
+                # Failed sends don't count towards the mailbox's daily limit
+                mailbox.rate_limiter.refund_total(failed)
+
+            if throttled:
+                mailbox.consecutive_throttles += 1
+                if mailbox.consecutive_throttles >= self.throttle_threshold:
+                    mailbox.cooldown_until = time.time() + self.cooldown_seconds
+                    mailbox.consecutive_throttles = 0
+                    print(f"Mailbox {mailbox.user_email} keeps getting throttled; "
+                          f"taking it out of rotation for {self.cooldown_seconds:g} seconds.")
+            elif sent:
+                mailbox.consecutive_throttles = 0
+
+    def send_email(self, to_email, subject, content_html, retries=None, attachments=None) -> bool:
+        """Send one email from the next available mailbox"""
+        mailbox = self.acquire()
+        if mailbox is None:
+            print(f"No mailbox available to send to {to_email}.")
+            return False
+
+        throttles_before = mailbox.sender.throttle_count
+        success = mailbox.sender.send_email(to_email, subject, content_html, retries=retries, attachments=attachments)
+        self.report(mailbox, success, mailbox.sender.throttle_count > throttles_before)
+        if success:
+            self._sent_from[to_email] = mailbox.user_email
+        return success
+
+    def send_batch(self, emails: List[Dict[str, str]], retries=None) -> List[bool]:
+        """
+        Send several emails, batching the ones that can go from the same mailbox now
+
+        Returns:
+            List of booleans, True for each email that was sent successfully
+        """
+        results = [False] * len(emails)
+        position = 0
+        while position < len(emails):
+            mailbox = self.acquire()
+            if mailbox is None:
+                print(f"No mailbox available for the remaining {len(emails) - position} emails.")
+                break
+
+            wanted = min(GRAPH_BATCH_LIMIT, len(emails) - position)
+            count = 1 + mailbox.rate_limiter.try_acquire_up_to(wanted - 1)
+            group = emails[position:position + count]
+
+            throttles_before = mailbox.sender.throttle_count
+            if count == 1:
+                group_results = [mailbox.sender.send_email(retries=retries, **group[0])]
+            else:
+                group_results = mailbox.sender.send_batch(group, retries=retries)
+            throttled = mailbox.sender.throttle_count > throttles_before
+
+            self.report_batch(mailbox, group_results, throttled)
+            for offset, success in enumerate(group_results):
+                results[position + offset] = success
+                if success:
+                    self._sent_from[group[offset]['to_email']] = mailbox.user_email
+            position += count
+
+        return results
+
+    def pop_sent_from(self, to_email: str) -> Optional[str]:
+        """Mailbox an email to this address was just sent from (once per send), for the send journal"""
+        return self._sent_from.pop(to_email, None)
+
+    def charge_sent(self, sent_today: Dict[str, int]) -> None:
+        """
+        Count sends made earlier today against each mailbox's daily limit, e.g. after a restart
+
+        Args:
+            sent_today: Number of emails sent today by mailbox address
+        """
+        with self._lock:
+            for mailbox in self.mailboxes:
+                count = sent_today.get(mailbox.user_email, 0)
+                if count:
+                    mailbox.sent_today += count
+                    mailbox.rate_limiter.charge_total(count)
+
+    def reset_daily(self) -> None:
+        """Start a new day for every mailbox"""
+        with self._lock:
+            for mailbox in self.mailboxes:
+                mailbox.sent_today = 0
+                mailbox.failed_today = 0
+                mailbox.rate_limiter.reset_total()
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Quota and health of every mailbox"""
+        return [mailbox.status() for mailbox in self.mailboxes]
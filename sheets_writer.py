@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import atexit
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional
+
+from recipient_source import RecipientSource
+
+def campaign_spool_file(spool_file: str, campaign: Optional[str]) -> str:
+    """
+    Spool file of one campaign, e.g. '.sheets_pending_writes.<campaign>.jsonl'
+
+    Campaigns run in one process (or workers sharing a directory) each get
+    their own spool, so one campaign's flush never truncates another's
+    unwritten updates and a crash never replays them into the wrong sheet.
+
+    Args:
+        spool_file: Configured spool file path
+        campaign: Campaign key, e.g. the sheet ID (the path is kept as is if empty)
+    """
+    if not campaign:
+        return spool_file
+    key = re.sub(r'[^A-Za-z0-9_-]+', '_', campaign).strip('_')
+    if len(key) > 64:
+        # Long keys (local file paths) are shortened but stay unique
+        key = f"{key[:48]}-{hashlib.sha1(campaign.encode('utf-8')).hexdigest()[:12]}"
+    root, extension = os.path.splitext(spool_file)
+    return f"{root}.{key}{extension}"
+
+class BufferedSheetsWriter:
+    def __init__(self, sheets_handler: RecipientSource, max_pending=None, flush_interval=None, spool_file=None,
+                 campaign=None):
+        """
+        Write-behind buffer for status and date updates
+
+        Updates are collected in memory and written with a single
+        spreadsheets.values.batchUpdate call once max_pending updates are waiting,
+        every flush_interval seconds, and on close. Every update is also appended
+        to a local spool file before it is acknowledged, so updates that were not
+        flushed because of a crash are written on the next start.
+
+        Args:
+            sheets_handler: Recipient source used to build and write the cell updates
+            max_pending: Number of buffered cell updates that triggers a flush
+            flush_interval: Seconds between background flushes
+            spool_file: Path of the local file that keeps unflushed updates
+            campaign: Campaign key the spool file name is made unique with
+        """
+        self.sheets_handler = sheets_handler
+        self.max_pending = max_pending or int(os.environ.get('SHEETS_WRITE_BATCH_SIZE', 50))
+        self.flush_interval = flush_interval or float(os.environ.get('SHEETS_WRITE_FLUSH_SECONDS', 30))
+        self.spool_file = campaign_spool_file(
+            spool_file or os.environ.get('SHEETS_WRITE_SPOOL_FILE', '.sheets_pending_writes.jsonl'), campaign
+        )
+
+        # Keyed by A1 range so a later update to the same cell replaces the earlier one
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Guards _pending and the spool file; never held during an API call, so add() doesn't wait on the network
+        self._lock = threading.RLock()
+        # One batchUpdate in flight at a time
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # Set to make the background thread flush now
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+        self._recover()
+        atexit.register(self.close)
+
+    def _recover(self) -> None:
+        """Load updates left in the spool file by a previous run and write them"""
+        if not os.path.exists(self.spool_file):
+            return
+
+        with open(self.spool_file, 'r', encoding='utf-8') as spool:
+            for line in spool:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    update = json.loads(line)
+                except ValueError:
+                    # A partially written last line means the process died mid-append
+                    continue
+                self._pending[update['range']] = update
+
+        if self._pending:
+            print(f"Recovered {len(self._pending)} unflushed sheet updates from {self.spool_file}")
+            self.flush()
+
+    def start(self) -> None:
+        """Start the background thread that flushes on the time threshold"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name='sheets-writer', daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                return  # close() writes what's left
+            self.flush()
+
+    def update_status(self, row_index: int, status_column: str, status: str) -> None:
+        """
+        Queue a status update (and the Date cell for "Sent") for a row
+
+        Args:
+            row_index: Index of the row to update (1-based)
+            status_column: Name of the status column
+            status: New status value
+        """
+        self.add(self.sheets_handler.build_status_updates(row_index, status_column, status))
+
+    def update_statuses(self, statuses: Dict[int, str], status_column: str) -> None:
+        """
+        Queue status updates for several rows with a single spool write
+
+        Args:
+            statuses: New status by row index (1-based)
+            status_column: Name of the status column
+        """
+        updates = []
+        for row_index, status in statuses.items():
+            updates.extend(self.sheets_handler.build_status_updates(row_index, status_column, status))
+        self.add(updates)
+
+    def add(self, updates: List[Dict[str, Any]]) -> None:
+        """Queue cell updates and flush if the size threshold is reached"""
+        if not updates:
+            return
+
+        with self._lock:
+            with open(self.spool_file, 'a', encoding='utf-8') as spool:
+                for update in updates:
+                    spool.write(json.dumps(update) + '\n')
+                spool.flush()
+                os.fsync(spool.fileno())
+
+            for update in updates:
+                self._pending[update['range']] = update
+            full = len(self._pending) >= self.max_pending
+
+        if full:
+            if self._thread and self._thread.is_alive():
+                # Written by the background thread, so the send path doesn't wait for the API
+                self._wake.set()
+            else:
+                self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all buffered updates in one batchUpdate call
+
+        Returns:
+            Number of cell updates written. On error the updates stay buffered
+            (and spooled) and are retried on the next flush.
+        """
+        with self._flush_lock:
+            # Take the buffered updates; updates added during the API call start a new buffer
+            with self._lock:
+                if not self._pending:
+                    return 0
+                taken = self._pending
+                self._pending = {}
+
+            updates = list(taken.values())
+            try:
+                self.sheets_handler.batch_update(updates)
+            except Exception as e:
+                print(f"Error flushing {len(updates)} sheet updates, will retry: {str(e)}")
+                with self._lock:
+                    # Updates made to the same cells in the meantime are newer and win
+                    taken.update(self._pending)
+                    self._pending = taken
+                return 0
+
+            with self._lock:
+                self._rewrite_spool()
+            return len(updates)
+
+    def _rewrite_spool(self) -> None:
+        """Replace the spool with the updates still buffered (lock held)"""
+        if not self._pending:
+            # Everything in the spool has been written, start it over
+            open(self.spool_file, 'w').close()
+            return
+
+        temporary_file = self.spool_file + '.tmp'
+        with open(temporary_file, 'w', encoding='utf-8') as spool:
+            for update in self._pending.values():
+                spool.write(json.dumps(update) + '\n')
+            spool.flush()
+            os.fsync(spool.fileno())
+        os.replace(temporary_file, self.spool_file)
+
+    def close(self) -> None:
+        """Stop the background thread and write whatever is still buffered"""
+        if self._closed:
+            return
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval)
+        self.flush()
+        with self._lock:
+            if not self._pending and os.path.exists(self.spool_file):
+                os.remove(self.spool_file)
+        self._closed = True
+
+    def __len__(self) -> int:
+        return len(self._pending)
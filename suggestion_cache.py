@@ -0,0 +1,177 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from metrics import metrics
+
+def normalize_sector(sector: str) -> str:
+    """Normalize a sector name so 'Law Firm', ' law  firm' and 'LAW FIRM' share a cache entry"""
+    return re.sub(r'\s+', ' ', sector or '').strip().lower()
+
+class SuggestionCache:
+    def __init__(self, path=None, variants=None, ttl_hours=None, max_sectors=None):
+        """
+        Sector-keyed cache of ChatGPT suggestions backed by a local SQLite file
+
+        Each sector keeps a pool of up to `variants` suggestions, so emails to the
+        same sector still differ. If ChatGPT repeats a suggestion the sector already
+        has, its pool is served as it is rather than asked again for every email.
+        Suggestions older than ttl_hours are dropped and the least recently used
+        sectors are evicted beyond max_sectors.
+
+        Args:
+            path: SQLite file that keeps the cache across restarts
+            variants: Number of different suggestions kept per sector
+            ttl_hours: Hours a suggestion stays valid
+            max_sectors: Maximum number of sectors kept in the cache
+        """
+        self.path = path or os.environ.get('AI_SUGGESTION_CACHE_FILE', '.suggestion_cache.sqlite3')
+        self.variants = variants or int(os.environ.get('AI_SUGGESTION_VARIANTS', 3))
+        self.ttl_seconds = (ttl_hours or float(os.environ.get('AI_SUGGESTION_TTL_HOURS', 168))) * 3600
+        self.max_sectors = max_sectors or int(os.environ.get('AI_SUGGESTION_CACHE_SIZE', 500))
+
+        # sector -> list of (suggestion, created_at), ordered from least to most recently used
+        self._pools: 'OrderedDict[str, List[Tuple[str, float]]]' = OrderedDict()
+        # Sectors whose pool got a repeated suggestion and is served without filling it
+        self._saturated: Set[str] = set()
+        # sector -> last use not yet written to disk; written with the next change instead of on every hit
+        self._used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS suggestions ('
+            ' sector TEXT NOT NULL,'
+            ' suggestion TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (sector, suggestion))'
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        """Load every unexpired suggestion from disk, least recently used sectors first"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('DELETE FROM suggestions WHERE created_at < ?', (now - self.ttl_seconds,))
+            self._conn.commit()
+            rows = self._conn.execute(
+                'SELECT sector, suggestion, created_at, MAX(last_used) OVER (PARTITION BY sector) AS sector_used'
+                ' FROM suggestions ORDER BY sector_used, created_at'
+            ).fetchall()
+            for sector, suggestion, created_at, _ in rows:
+                self._pools.setdefault(sector, []).append((suggestion, created_at))
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._pools) > self.max_sectors:
+            sector, _ = self._pools.popitem(last=False)
+            self._saturated.discard(sector)
+            self._used.pop(sector, None)
+            self._conn.execute('DELETE FROM suggestions WHERE sector = ?', (sector,))
+        self._write_used()
+        self._conn.commit()
+
+    def _write_used(self) -> None:
+        """Write the last use of the sectors served since the previous write (lock held, not committed)"""
+        if self._used:
+            self._conn.executemany('UPDATE suggestions SET last_used = ? WHERE sector = ?',
+                                   [(used, sector) for sector, used in self._used.items()])
+            self._used.clear()
+
+    def _fresh_pool(self, key: str, now: float) -> List[Tuple[str, float]]:
+        pool = self._pools.get(key, [])
+        fresh = [(text, created_at) for text, created_at in pool if now - created_at < self.ttl_seconds]
+        if len(fresh) != len(pool):
+            self._pools[key] = fresh
+            # Room for new suggestions again
+            self._saturated.discard(key)
+            self._conn.execute('DELETE FROM suggestions WHERE sector = ? AND created_at < ?',
+                               (key, now - self.ttl_seconds))
+            self._conn.commit()
+        return fresh
+
+    def get(self, sector: str) -> Optional[str]:
+        """
+        Get a cached suggestion for a sector
+
+        Returns:
+            A random suggestion from the sector's pool, or None while the pool
+            has fewer than `variants` suggestions and a new one should be generated
+        """
+        key = normalize_sector(sector)
+        now = time.time()
+        with self._lock:
+            pool = self._fresh_pool(key, now)
+            if not pool or (len(pool) < self.variants and key not in self._saturated):
+                self.misses += 1
+                metrics.inc('email_bot_suggestion_cache_total', result='miss')
+                return None
+
+            self.hits += 1
+            metrics.inc('email_bot_suggestion_cache_total', result='hit')
+            self._pools.move_to_end(key)
+            self._used[key] = now
+            return random.choice(pool)[0]
+
+    def peek(self, sector: str) -> Optional[str]:
+        """
+        Get any cached suggestion for a sector, without counting a hit or miss
+
+        Returns:
+            A random suggestion from the sector's pool (even if the pool isn't
+            full yet), or None if nothing is cached for the sector
+        """
+        key = normalize_sector(sector)
+        with self._lock:
+            pool = self._fresh_pool(key, time.time())
+        return random.choice(pool)[0] if pool else None
+
+    def missing_variants(self, sector: str) -> int:
+        """Number of suggestions still needed to fill a sector's pool"""
+        key = normalize_sector(sector)
+        with self._lock:
+            pool = self._fresh_pool(key, time.time())
+            if pool and key in self._saturated:
+                return 0
+            return max(0, self.variants - len(pool))
+
+    def add(self, sector: str, suggestion: str) -> None:
+        """Store a newly generated suggestion for a sector"""
+        if not suggestion:
+            return
+        key = normalize_sector(sector)
+        now = time.time()
+        with self._lock:
+            pool = self._fresh_pool(key, now)
+            if len(pool) >= self.variants:
+                return
+            if any(text == suggestion for text, _ in pool):
+                # ChatGPT is repeating itself; asking it again for every email wouldn't fill the pool
+                self._saturated.add(key)
+                return
+            self._pools[key] = pool + [(suggestion, now)]
+            self._pools.move_to_end(key)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO suggestions (sector, suggestion, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, suggestion, now, now)
+            )
+            self._evict()
+
+    def close(self) -> None:
+        """Write the last use of each sector and close the SQLite connection"""
+        with self._lock:
+            self._write_used()
+            self._conn.commit()
+            self._conn.close()
+
+    def __len__(self) -> int:
+        return len(self._pools)
@@ -0,0 +1,170 @@
+import os
+import math
+import hashlib
+import threading
+from typing import Iterable, Optional
+
+def normalize_address(address: str) -> str:
+    """
+    Normalize an email address for comparison
+
+    Drops surrounding spaces, a display name ("Jane <jane@example.com>") and a
+    mailto: prefix, and lower-cases the rest.
+    """
+    address = (address or '').strip()
+    if address.endswith('>') and '<' in address:
+        address = address[address.rindex('<') + 1:-1]
+    if address[:7].lower() == 'mailto:':
+        address = address[7:]
+    return address.strip().lower()
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Fixed-size set membership test with a bounded false positive rate
+
+        Uses about 1.8 bytes per item at a 0.1% error rate, where a Python set of
+        addresses takes around 100 bytes per item. Items are never reported
+        missing once added; an item that was never added is reported present
+        with probability error_rate.
+
+        Args:
+            capacity: Number of items the filter is sized for
+            error_rate: False positive rate at capacity
+        """
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * step) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class SuppressionIndex:
+    def __init__(self, paths=None, bloom_threshold=None, error_rate=None):
+        """
+        Addresses that must not be emailed, checked in O(1) per recipient
+
+        Holds the suppression list (bounced and unsubscribed contacts, from
+        SUPPRESSION_FILE) and every address already emailed, whether in an
+        earlier run (from the send journal) or earlier in this one (claimed as
+        recipients are taken), so duplicate rows only get one email.
+
+        Suppression files have one address per line; only the first
+        comma-separated field counts, blank lines, '#' comments and an 'email'
+        header are ignored, and entries starting with '@' suppress a whole
+        domain. Lists longer than bloom_threshold are kept in a Bloom filter
+        instead of a set, which can (rarely, at error_rate) suppress an address
+        that isn't on the list.
+
+        Args:
+            paths: Suppression files, as a list or comma-separated string
+                (defaults to SUPPRESSION_FILE, none if unset)
+            bloom_threshold: List size from which a Bloom filter is used
+                (defaults to SUPPRESSION_BLOOM_THRESHOLD)
+            error_rate: False positive rate of the Bloom filter
+                (defaults to SUPPRESSION_BLOOM_ERROR_RATE)
+        """
+        if paths is None:
+            paths = os.environ.get('SUPPRESSION_FILE', '')
+        if isinstance(paths, str):
+            paths = [path.strip() for path in paths.split(',') if path.strip()]
+        self.paths = paths
+        self.bloom_threshold = bloom_threshold or int(os.environ.get('SUPPRESSION_BLOOM_THRESHOLD', 1000000))
+        self.error_rate = error_rate or float(os.environ.get('SUPPRESSION_BLOOM_ERROR_RATE', 0.001))
+
+        self._suppressed = set()
+        self._domains = set()
+        # Addresses already emailed or claimed for a send
+        self._seen = set()
+        self._lock = threading.Lock()
+
+        if self.paths:
+            self.load(self.paths)
+
+    @staticmethod
+    def _read_entries(path: str) -> Iterable[str]:
+        with open(path, 'r', encoding='utf-8-sig') as entries:
+            for line in entries:
+                entry = normalize_address(line.split(',', 1)[0])
+                if entry and not entry.startswith('#') and entry != 'email':
+                    yield entry
+
+    def load(self, paths) -> int:
+        """
+        Load suppression files, replacing the current suppression list
+
+        Returns:
+            Number of entries loaded
+        """
+        count = sum(1 for path in paths for _ in self._read_entries(path))
+        suppressed = BloomFilter(count, self.error_rate) if count > self.bloom_threshold else set()
+        domains = set()
+        for path in paths:
+            for entry in self._read_entries(path):
+                if entry.startswith('@'):
+                    domains.add(entry[1:])
+                else:
+                    suppressed.add(entry)
+
+        with self._lock:
+            self._suppressed = suppressed
+            self._domains = domains
+        kind = 'Bloom filter' if isinstance(suppressed, BloomFilter) else 'set'
+        print(f"Loaded {count} suppressed addresses and domains from {', '.join(paths)} ({kind}).")
+        return count
+
+    def add_emailed(self, addresses: Iterable[str]) -> None:
+        """Add addresses that were already emailed, e.g. from the send journal"""
+        with self._lock:
+            self._seen.update(normalize_address(address) for address in addresses if address)
+
+    def check(self, address: str) -> Optional[str]:
+        """
+        Check an address without claiming it
+
+        Returns:
+            'suppressed' for an address on the suppression list, 'duplicate' for
+            one already emailed or claimed, otherwise None
+        """
+        address = normalize_address(address)
+        if not address:
+            return None
+        if address in self._suppressed or address.rpartition('@')[2] in self._domains:
+            return 'suppressed'
+        if address in self._seen:
+            return 'duplicate'
+        return None
+
+    def claim(self, address: str) -> Optional[str]:
+        """
+        Check an address and, if it may be emailed, record it so later duplicates are caught
+
+        Returns:
+            'suppressed' or 'duplicate' when the address must be skipped, otherwise None
+        """
+        with self._lock:
+            reason = self.check(address)
+            if reason is None and address:
+                self._seen.add(normalize_address(address))
+            return reason
+
+    def __len__(self) -> int:
+        return len(self._suppressed) + len(self._domains)
@@ -1,7 +1,77 @@
 import os
 import re
 from string import Formatter
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
+
+class CompiledTemplate:
+    """Template text split once into literal segments and placeholders"""
+    __slots__ = ('_literals', '_fields')
+
+    def __init__(self, text: str, placeholders: Set[str]):
+        """
+        Args:
+            text: Template text containing {placeholder} markers
+            placeholders: Placeholder names to substitute
+        """
+        literals = []
+        fields = []
+        if placeholders:
+            # Longest first so a placeholder that is a prefix of another can't shadow it
+            pattern = re.compile('|'.join(
+                re.escape('{' + name + '}') for name in sorted(placeholders, key=len, reverse=True)
+            ))
+            position = 0
+            for match in pattern.finditer(text):
+                literals.append(text[position:match.start()])
+                fields.append((match.group(0)[1:-1], match.group(0)))
+                position = match.end()
+            literals.append(text[position:])
+        else:
+            literals.append(text)
+
+        self._literals = tuple(literals)
+        self._fields = tuple(fields)
+
+    def render(self, data: Dict[str, str]) -> str:
+        """
+        Fill the placeholders with data in a single join
+
+        Placeholders without a value in data are left in place, e.g. '{name}'.
+        """
+        literals = self._literals
+        parts = [literals[0]]
+        for i, (name, marker) in enumerate(self._fields, 1):
+            parts.append(data[name] if name in data else marker)
+            parts.append(literals[i])
+        return ''.join(parts)
+
+
+class CompiledEmailTemplate:
+    """An email template parsed once: placeholders plus compiled full, subject and body parts"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.placeholders = self._extract_placeholders(content)
+        self.full = CompiledTemplate(content, self.placeholders)
+
+        # Pre-split the subject (<title>) and body (<body>) at load time
+        subject_match = re.search(r'<title>(.*?)</title>', content, re.IGNORECASE | re.DOTALL)
+        self.subject = CompiledTemplate(subject_match.group(1).strip(), self.placeholders) if subject_match else None
+
+        body_match = re.search(r'<body>(.*?)</body>', content, re.IGNORECASE | re.DOTALL)
+        self.body = CompiledTemplate(body_match.group(1).strip(), self.placeholders) if body_match else None
+
+    @staticmethod
+    def _extract_placeholders(content: str) -> Set[str]:
+        """Extract all placeholders ({placeholder}) from the template"""
+        # Use string.Formatter to extract all field names from the template
+        formatter = Formatter()
+        field_names = {
+            field_name for _, field_name, _, _ in formatter.parse(content)
+            if field_name is not None
+        }
+        return field_names
+
 
 class TemplateHandler:
     def __init__(self, template_path='email_template.html'):
@@ -12,8 +82,22 @@ class TemplateHandler:
             template_path: Path to the HTML template file
         """
         self.template_path = template_path
-        self.template_content = self._load_template()
-        self.placeholders = self._extract_placeholders()
+        self._compiled = CompiledEmailTemplate(self._load_template())
+    
+    @property
+    def template_content(self) -> str:
+        """Raw template text"""
+        return self._compiled.content
+    
+    @property
+    def placeholders(self) -> Set[str]:
+        """Placeholder names found in the template"""
+        return self._compiled.placeholders
+    
+    @property
+    def has_body(self) -> bool:
+        """True if the template has a <body> tag"""
+        return self._compiled.body is not None
     
     def _load_template(self) -> str:
         """Load the HTML template from file"""
@@ -23,16 +107,6 @@ class TemplateHandler:
         with open(self.template_path, 'r', encoding='utf-8') as file:
             return file.read()
     
-    def _extract_placeholders(self) -> Set[str]:
-        """Extract all placeholders ({placeholder}) from the template"""
-        # Use string.Formatter to extract all field names from the template
-        formatter = Formatter()
-        field_names = {
-            field_name for _, field_name, _, _ in formatter.parse(self.template_content)
-            if field_name is not None
-        }
-        return field_names
-    
     def fill_template(self, data: Dict[str, str]) -> str:
         """
         Fill the template with data
@@ -43,18 +117,24 @@ class TemplateHandler:
         Returns:
             Filled HTML template
         """
-        # Start with the template
-        filled_template = self.template_content
-        
-        # Replace each placeholder with its corresponding value
-        for placeholder in self.placeholders:
-            if placeholder in data:
-                filled_template = filled_template.replace(
-                    '{' + placeholder + '}', 
-                    data.get(placeholder, '')
-                )
+        return self._compiled.full.render(data)
+    
+    def render_email(self, data: Dict[str, str]) -> Tuple[Optional[str], str]:
+        """
+        Fill the subject and body of the template with data
         
-        return filled_template
+        Args:
+            data: Dictionary with placeholder keys and their values
+            
+        Returns:
+            Tuple of (subject, body). The subject is the filled <title> text, or
+            None if the template has no <title>. The body is the filled <body>
+            content, or the whole filled template if it has no <body> tag.
+        """
+        compiled = self._compiled
+        subject = compiled.subject.render(data) if compiled.subject is not None else None
+        body = compiled.body.render(data) if compiled.body is not None else compiled.full.render(data)
+        return subject, body
     
     def get_required_fields(self) -> List[str]:
         """Get a list of required fields from the template"""
@@ -62,5 +142,22 @@ class TemplateHandler:
     
     def reload_template(self):
         """Reload the template from file"""
-        self.template_content = self._load_template()
-        self.placeholders = self._extract_placeholders() 
\ No newline at end of file
+        self._compiled = CompiledEmailTemplate(self._load_template())
+    
+    def compile_template(self) -> CompiledEmailTemplate:
+        """Load and compile the template file without putting it into use"""
+        return CompiledEmailTemplate(self._load_template())
+    
+    def swap_template(self, compiled: CompiledEmailTemplate) -> None:
+        """
+        Put a compiled template into use
+
+        This is a single reference assignment, and every render reads the
+        reference once, so a render in progress finishes with the old template.
+        """
+        self._compiled = compiled
+    
+    @staticmethod
+    def missing_fields(compiled: CompiledEmailTemplate, available_fields: Set[str]) -> Set[str]:
+        """Placeholders of a compiled template that none of the available fields can fill"""
+        return compiled.placeholders - set(available_fields)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import os
+import threading
+from typing import Callable, Optional, Set, Tuple
+
+from template_handler import TemplateHandler
+
+class TemplateWatcher:
+    def __init__(self, template_handler: TemplateHandler, available_fields: Optional[Callable[[], Set[str]]] = None,
+                 poll_interval=None):
+        """
+        Watch the template file and hot-swap it into the template handler when it changes
+
+        Changes are detected by polling the file's modification time and size,
+        which works the same on every platform and filesystem. The new template
+        is compiled on the watcher thread and swapped in with a single reference
+        assignment, so the send loop never waits for it.
+
+        Args:
+            template_handler: Handler whose template is replaced
+            available_fields: Callable returning the field names recipients will have
+                (sheet headers plus computed fields). Templates using other
+                placeholders are rejected. None accepts every template.
+            poll_interval: Seconds between checks of the template file
+        """
+        self.template_handler = template_handler
+        self.available_fields = available_fields
+        self.poll_interval = poll_interval or float(os.environ.get('TEMPLATE_WATCH_INTERVAL', 2))
+
+        self._last_seen = self._file_signature()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.template_handler.template_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self) -> None:
+        """Start polling the template file in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch_loop, name='template-watcher', daemon=True)
+        self._thread.start()
+        print(f"Watching {self.template_handler.template_path} for changes every {self.poll_interval:g} seconds.")
+
+    def stop(self) -> None:
+        """Stop polling"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.poll_interval)
+
+    def _watch_loop(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking email template for changes: {str(e)}")
+
+    def check(self) -> bool:
+        """
+        Reload the template if the file changed since the last check
+
+        Returns:
+            True if a new template was swapped in
+        """
+        signature = self._file_signature()
+        if signature is None or signature == self._last_seen:
+            return False
+        # Remember the change even if it's rejected so it's only reported once
+        self._last_seen = signature
+
+        try:
+            compiled = self.template_handler.compile_template()
+        except Exception as e:
+            print(f"Rejected email template change: could not load {self.template_handler.template_path}: {str(e)}")
+            return False
+
+        if self.available_fields is not None:
+            missing = TemplateHandler.missing_fields(compiled, self.available_fields())
+            if missing:
+                print(f"Rejected email template change: no sheet column for placeholders {', '.join(sorted(missing))}. "
+                      f"Still using the previous template.")
+                return False
+
+        self.template_handler.swap_template(compiled)
+        print(f"Reloaded email template. Required fields: {', '.join(sorted(compiled.placeholders))}")
+        return True
@@ -0,0 +1,77 @@
+import os
+import sys
+from typing import List
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import email_bot
+from email_bot import EmailBot
+from fake_backends import FakeSheetsService, FakeGraphSession, FakeMsalApp, NoJitter, build_grid
+from google_sheets import GoogleSheetsHandler
+
+SHEET_RANGE = 'Sheet1!A1:F'
+
+def statuses(grid: List[List[str]]) -> List[str]:
+    """Status of every recipient row"""
+    column = grid[0].index('Status')
+    return [row[column] if len(row) > column else '' for row in grid[1:]]
+
+
+@pytest.fixture
+def bot_env(tmp_path, monkeypatch):
+    """Environment for a bot whose journal, spool, lease and cache files live in tmp_path"""
+    settings = {
+        'GOOGLE_SHEET_ID': 'sheet-a',
+        'GOOGLE_SHEET_RANGE': SHEET_RANGE,
+        'DAILY_EMAIL_LIMIT': '100',
+        'EMAIL_INTERVAL_MINUTES': '0',
+        'RETRY_BASE_DELAY': '0',
+        'RETRY_MAX_DELAY': '0',
+        'SEND_JOURNAL_FILE': str(tmp_path / 'journal.sqlite3'),
+        'SHEETS_WRITE_SPOOL_FILE': str(tmp_path / 'spool.jsonl'),
+        'RECIPIENT_SYNC_SPOOL_FILE': str(tmp_path / 'sync_spool.jsonl'),
+        'AI_SUGGESTION_CACHE_FILE': str(tmp_path / 'suggestions.sqlite3'),
+        'MS_USER_EMAIL': 'sender@example.com',
+    }
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    for name in ('OPENAI_API_KEY', 'RECIPIENT_SOURCE', 'MS_SENDER_MAILBOXES', 'WORKER_LEASE_FILE', 'WORKER_ID',
+                 'SEND_WINDOWS', 'SUPPRESSION_FILE', 'EMAIL_ATTACHMENTS', 'SEND_MODE', 'GRAPH_BATCH_SEND'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(GoogleSheetsHandler, '_authenticate', lambda self: None)
+    monkeypatch.setattr('msal.ConfidentialClientApplication', FakeMsalApp)
+    monkeypatch.setattr(email_bot, 'random', NoJitter)
+    return monkeypatch
+
+
+@pytest.fixture
+def make_bot(bot_env):
+    """
+    Build EmailBots against fake Sheets and Graph backends
+
+    Bots still running at the end of the test are shut down.
+    """
+    bots = []
+
+    def make(grid, sheet_id=None, graph=None, **env):
+        for name, value in env.items():
+            bot_env.setenv(name, value)
+        bot = EmailBot(sheet_id=sheet_id, template_path=os.path.join(REPO_ROOT, 'email_template.html'))
+        bot.sheets = FakeSheetsService(grid)
+        bot.recipient_source.service = bot.sheets
+        bot.graph = graph or FakeGraphSession()
+        bot.outlook_sender.session = bot.graph
+        for mailbox in (bot.sender_pool.mailboxes if bot.sender_pool else []):
+            mailbox.sender.session = bot.graph
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        try:
+            bot.shutdown()
+        except Exception:
+            pass  # Already shut down by the test
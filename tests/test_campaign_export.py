@@ -0,0 +1,25 @@
+import json
+
+from campaign_export import CampaignExporter
+from conftest import build_grid
+
+
+def test_export_skips_what_the_send_loop_would(make_bot, tmp_path, monkeypatch):
+    suppression_file = tmp_path / 'suppressed.txt'
+    suppression_file.write_text('contact1@example.com\n')
+    monkeypatch.setenv('SUPPRESSION_FILE', str(suppression_file))
+
+    grid = build_grid(5)
+    grid[4][1] = 'contact0@example.com'  # row 5 repeats row 2's address
+    bot = make_bot(grid)
+    # Row 4 was sent before a crash, but its status never reached the sheet
+    bot.send_journal.record_intent({'_row_index': 4, 'email': 'contact2@example.com'})
+    bot.send_journal.record_result({'_row_index': 4, 'email': 'contact2@example.com'}, 'Sent')
+
+    output = tmp_path / 'campaign.jsonl'
+    counts = CampaignExporter(bot, str(output), workers=1).run()
+
+    rows = [json.loads(line)['row'] for line in output.read_text().splitlines()]
+    assert rows == [2, 6]
+    assert counts['suppressed'] == 1 and counts['duplicate'] == 1 and counts['journaled'] == 1
+    assert bot.sheets.grid[4][4] == 'Not Sent'
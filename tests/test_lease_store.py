@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from conftest import build_grid
+from lease_store import LeaseStore
+
+
+def test_leasing_requires_a_stable_worker_id(make_bot, tmp_path):
+    with pytest.raises(ValueError, match='WORKER_ID'):
+        make_bot(build_grid(1), WORKER_LEASE_FILE=str(tmp_path / 'leases.sqlite3'))
+
+
+def test_journal_key_survives_a_restart(make_bot, tmp_path):
+    env = {'WORKER_LEASE_FILE': str(tmp_path / 'leases.sqlite3'), 'WORKER_ID': 'worker-1'}
+    first = make_bot(build_grid(1), **env)
+    second = make_bot(build_grid(1), **env)
+    assert first.send_journal.campaign == second.send_journal.campaign == 'sheet-a:worker-1'
+
+
+def rows(*row_indexes):
+    return [{'_row_index': row_index, 'email': f'row{row_index}@example.com'} for row_index in row_indexes]
+
+
+def row_indexes(recipients):
+    return [recipient['_row_index'] for recipient in recipients]
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two workers of one campaign sharing a lease file, with leases that expire quickly"""
+    stores = [LeaseStore(str(tmp_path / 'leases.sqlite3'), 'sheet-a', worker_id, lease_seconds=0.2)
+              for worker_id in ('worker-1', 'worker-2')]
+    yield stores
+    for store in stores:
+        store.close()
+
+
+def test_rows_leased_by_one_worker_are_not_claimed_by_another(workers):
+    first, second = workers
+    assert row_indexes(first.claim(rows(2, 3, 4))[0]) == [2, 3, 4]
+    leased, interrupted = second.claim(rows(2, 3, 4, 5, 6))
+    assert row_indexes(leased) == [5, 6]
+    assert interrupted == []
+
+
+def test_expired_and_released_leases_can_be_claimed(workers):
+    first, second = workers
+    first.claim(rows(2, 3))
+    first.release()
+    assert row_indexes(second.claim(rows(2, 3))[0]) == [2, 3]
+
+    time.sleep(0.3)
+    assert second.claim(rows(4))[0]
+    assert row_indexes(first.claim(rows(2, 3))[0]) == [2, 3]
+    # The worker that lost its lease must not email the row
+    assert second.begin_sending(rows(2, 3)) == []
+
+
+def test_expired_send_is_reported_as_interrupted_once(workers):
+    first, second = workers
+    first.claim(rows(2, 3))
+    assert row_indexes(first.begin_sending(rows(2))) == [2]
+    first.complete({3: 'Sent'})
+
+    time.sleep(0.3)
+    leased, interrupted = second.claim(rows(2, 3))
+    assert leased == []
+    assert row_indexes(interrupted) == [2]
+    assert second.claim(rows(2, 3)) == ([], [])
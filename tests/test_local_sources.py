@@ -0,0 +1,11 @@
+import sys
+
+import pytest
+
+from recipient_source import open_recipient_source
+
+
+def test_parquet_source_without_pyarrow_fails_at_startup(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match='requirements-parquet.txt'):
+        open_recipient_source(str(tmp_path / 'recipients.parquet'))
@@ -0,0 +1,148 @@
+import json
+import os
+
+import pytest
+
+from fake_backends import FakeGraphResponse, FakeGraphSession
+from outlook_sender import OutlookSender
+
+
+class RecordingGraphSession(FakeGraphSession):
+    """Fake Graph session that keeps the body of every POST"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bodies = []
+
+    def post(self, url, headers=None, json=None, data=None, **kwargs):
+        self.bodies.append((url, data))
+        return super().post(url, headers=headers, json=json, data=data, **kwargs)
+
+
+@pytest.fixture
+def make_sender(bot_env, tmp_path):
+    def make(graph=None, attachments=(), inline_max_bytes=64 * 1024):
+        bot_env.setenv('EMAIL_ATTACHMENTS', ','.join(attachments))
+        bot_env.setenv('ATTACHMENT_INLINE_MAX_BYTES', str(inline_max_bytes))
+        sender = OutlookSender()
+        sender.session = graph or RecordingGraphSession()
+        return sender
+    return make
+
+
+def write_file(path, size):
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def emails(count):
+    return [{'to_email': f'contact{i}@example.com', 'subject': 'Hi', 'content_html': '<p>Hi</p>'}
+            for i in range(count)]
+
+
+def test_inline_attachments_go_through_batch(make_sender, tmp_path):
+    sender = make_sender(attachments=[write_file(tmp_path / 'brochure.pdf', 10 * 1024)])
+    assert sender.send_batch(emails(3)) == [True, True, True]
+    assert dict(sender.session.calls) == {'$batch': 1}
+
+    url, data = sender.session.bodies[0]
+    requests = json.loads(data)['requests']
+    assert [request['body']['message']['attachments'][0]['name'] for request in requests] == ['brochure.pdf'] * 3
+
+
+def test_batches_stay_under_the_request_size_limit(make_sender, tmp_path):
+    sender = make_sender(attachments=[write_file(tmp_path / 'brochure.pdf', 600 * 1024)],
+                         inline_max_bytes=1024 * 1024)
+    assert all(sender.send_batch(emails(20)))
+    assert all(len(data) <= 4 * 1024 * 1024 for url, data in sender.session.bodies)
+    assert sender.session.calls['$batch'] == 4
+
+
+def test_large_attachments_use_upload_sessions(make_sender, tmp_path):
+    sender = make_sender(attachments=[write_file(tmp_path / 'catalog.pdf', 1024 * 1024)])
+    assert sender.send_batch(emails(2)) == [True, True]
+    assert sender.session.calls['$batch'] == 0
+    assert sender.session.calls['createDraft'] == 2
+    assert sum(sender.session.uploads.values()) == 2 * 1024 * 1024
+
+
+def test_inline_files_over_the_request_limit_together_are_attached_one_at_a_time(make_sender, tmp_path):
+    sender = make_sender(attachments=[write_file(tmp_path / f'part{i}.pdf', 1200 * 1024) for i in range(3)],
+                         inline_max_bytes=int(2.9 * 1024 * 1024))
+    assert sender.send_batch(emails(2)) == [True, True]
+    assert sender.session.calls['$batch'] == 0
+    assert sender.session.calls['createDraft'] == 2
+    assert sender.session.calls['addAttachment'] == 6
+    assert all(len(data or b'') <= 4 * 1024 * 1024 for url, data in sender.session.bodies)
+    # The drafts were created without the attachments
+    drafts = [json.loads(data) for url, data in sender.session.bodies if url.endswith('/messages')]
+    assert all('attachments' not in draft for draft in drafts)
+
+def test_upload_session_send_uses_the_callers_retries(make_sender, tmp_path):
+    sender = make_sender(graph=FakeGraphSession(error_rate=1.0),
+                         attachments=[write_file(tmp_path / 'catalog.pdf', 1024 * 1024)])
+    assert sender.send_email('contact@example.com', 'Hi', '<p>Hi</p>', retries=2) is False
+    assert sender.session.calls['sendMail'] == 2
+
+
+def test_edited_attachment_replaces_its_cached_encoding(make_sender, tmp_path):
+    path = write_file(tmp_path / 'brochure.pdf', 1024)
+    sender = make_sender(attachments=[path])
+    cache = sender.attachment_cache
+    cache.json_fragment(cache.resolve([path]))
+
+    write_file(tmp_path / 'brochure.pdf', 2048)
+    fragment = cache.json_fragment(cache.resolve([path]))
+    assert cache.stats() == {'files': 1, 'fragments': 1}
+    assert len(json.loads(fragment)[0]['contentBytes']) > 2048
+
+
+class ScriptedBatchSession(FakeGraphSession):
+    """Fake Graph session that answers each recipient in a $batch with the next status from its script"""
+    def __init__(self, scripts):
+        super().__init__()
+        self.scripts = {address: list(statuses) for address, statuses in scripts.items()}
+        self.batches = []
+        self.tokens = []
+
+    def post(self, url, headers=None, data=None, **kwargs):
+        assert url.endswith('/$batch')
+        self.calls['$batch'] += 1
+        self.tokens.append(headers['Authorization'])
+        responses = []
+        recipients = []
+        for request in json.loads(data)['requests']:
+            address = request['body']['message']['toRecipients'][0]['emailAddress']['address']
+            recipients.append(address)
+            script = self.scripts.get(address)
+            status = script.pop(0) if script else 202
+            headers = {'Retry-After': '0'} if status == 429 else {}
+            responses.append({'id': request['id'], 'status': status, 'headers': headers,
+                              'body': None if status == 202 else {'error': {'code': str(status)}}})
+        self.batches.append(recipients)
+        return FakeGraphResponse(200, {'responses': responses})
+
+
+def test_batch_retries_only_the_emails_that_failed_for_a_transient_reason(make_sender):
+    graph = ScriptedBatchSession({'contact1@example.com': [400],
+                                  'contact2@example.com': [503],
+                                  'contact3@example.com': [429, 503]})
+    sender = make_sender(graph=graph)
+    assert sender.send_batch(emails(5), retries=3) == [True, False, True, True, True]
+    assert graph.batches == [[f'contact{i}@example.com' for i in range(5)],
+                             ['contact2@example.com', 'contact3@example.com'],
+                             ['contact3@example.com']]
+
+
+def test_batch_gives_up_on_an_email_after_its_last_attempt(make_sender):
+    graph = ScriptedBatchSession({'contact0@example.com': [503, 503, 503]})
+    sender = make_sender(graph=graph)
+    assert sender.send_batch(emails(2), retries=2) == [False, True]
+    assert graph.calls['$batch'] == 2
+
+
+def test_batch_item_rejected_with_401_is_retried_with_a_new_token(make_sender):
+    graph = ScriptedBatchSession({'contact1@example.com': [401]})
+    sender = make_sender(graph=graph)
+    assert sender.send_batch(emails(2), retries=2) == [True, True]
+    assert graph.batches == [['contact0@example.com', 'contact1@example.com'], ['contact1@example.com']]
+    assert graph.tokens == ['Bearer fake-token-1', 'Bearer fake-token-2']
@@ -0,0 +1,66 @@
+from conftest import build_grid, statuses
+from send_journal import SendJournal
+
+
+def test_restart_restores_each_mailbox_daily_count(make_bot):
+    env = {'MS_SENDER_MAILBOXES': 'a@example.com:2:0,b@example.com:2:0'}
+    grid = build_grid(3)
+    first = make_bot(grid, **env)
+    first.run()
+    assert statuses(first.sheets.grid) == ['Sent'] * 3
+    sent = {mailbox.user_email: mailbox.sent_today for mailbox in first.sender_pool.mailboxes}
+    assert sum(sent.values()) == 3
+
+    second = make_bot(first.sheets.grid, **env)
+    second.initialize(start_scheduler=False)
+    assert second.emails_sent_today == 3
+    for mailbox in second.sender_pool.mailboxes:
+        assert mailbox.sent_today == sent[mailbox.user_email]
+        assert mailbox.rate_limiter.remaining_total == 2 - sent[mailbox.user_email]
+
+
+def test_emailed_addresses_leave_out_failed_sends(tmp_path):
+    journal = SendJournal(path=str(tmp_path / 'journal.sqlite3'), campaign='sheet-a')
+    failed, sent, interrupted, retried = ({'_row_index': row, 'email': f'row{row}@example.com'} for row in range(2, 6))
+    journal.record_intents([failed, sent, interrupted, retried])
+    journal.record_result(failed, 'Failed')
+    journal.record_result(sent, 'Sent')
+    journal.record_result(retried, 'Failed')
+    journal.record_results([({'_row_index': 6, 'email': 'skipped@example.com'}, 'Duplicate')])
+    # A failed row whose status was reset to Not Sent is sent again
+    journal.record_intent(retried)
+    journal.record_result(retried, 'Sent')
+
+    assert journal.emailed_addresses() == ['row3@example.com', 'row4@example.com', 'row5@example.com']
+    journal.close()
+
+
+def test_replay_finishes_what_a_crashed_run_left(make_bot):
+    grid = build_grid(4)
+    grid[1][4] = 'Sent'
+    bot = make_bot(grid)
+    row = {2: 'contact0@example.com', 3: 'contact1@example.com', 4: 'contact2@example.com'}
+    journal = bot.send_journal
+    # Row 2 finished; row 3 was sent but its status never reached the sheet; row 4 crashed mid-send
+    journal.record_intents([{'_row_index': index, 'email': email} for index, email in row.items()])
+    journal.record_result({'_row_index': 2, 'email': row[2]}, 'Sent')
+    journal.record_written(2, 'Sent')
+    journal.record_result({'_row_index': 3, 'email': row[3]}, 'Sent')
+
+    bot.run()
+
+    assert statuses(bot.sheets.grid) == ['Sent', 'Sent', 'Unconfirmed', 'Sent']
+    # Only row 5 was emailed; the interrupted send counts towards today's limit
+    assert bot.graph.emails[202] == 1
+    assert bot.emails_sent_today == 4
+
+
+def test_daily_limit_holds_across_a_restart(make_bot):
+    grid = build_grid(5)
+    first = make_bot(grid, DAILY_EMAIL_LIMIT='3')
+    first.run()
+    second = make_bot(first.sheets.grid, DAILY_EMAIL_LIMIT='3')
+    second.run()
+
+    assert statuses(second.sheets.grid).count('Sent') == 3
+    assert first.graph.emails[202] + second.graph.emails[202] == 3
@@ -0,0 +1,53 @@
+import time
+import asyncio
+import datetime
+
+from async_runner import AsyncEmailBot
+from conftest import build_grid
+
+
+def current_hour_window():
+    """Send window around the current UTC hour"""
+    hour = datetime.datetime.now(datetime.timezone.utc).hour
+    return f'{hour:02d}:00-{hour + 1:02d}:00'
+
+
+def test_daily_reset_follows_the_send_timezone(make_bot):
+    bot = make_bot(build_grid(1), SEND_WINDOWS='09:00-17:00', SEND_TIMEZONE='Pacific/Kiritimati')
+    bot._start_scheduler()
+    trigger = bot.scheduler.get_job('reset_counter').trigger
+    assert str(trigger.timezone) == 'Pacific/Kiritimati'
+
+
+def test_held_recipients_are_capped(make_bot):
+    grid = build_grid(10)
+    grid[0].append('Timezone')
+    for row in grid[1:]:
+        # Six hours ahead of the send windows, so outside them
+        row.append('Etc/GMT-6')
+    bot = make_bot(grid, GOOGLE_SHEET_RANGE='Sheet1!A1:G', SEND_WINDOWS=current_hour_window(),
+                   SEND_DAYS='mon-sun', SEND_TIMEZONE='UTC', SEND_TIMEZONE_COLUMN='Timezone', SEND_MAX_DEFERRED='3')
+    bot.initialize(start_scheduler=False)
+
+    assert bot._next_recipient(wait=False) is None
+    assert len(bot.send_schedule._deferred) == 3
+    assert len(bot.recipient_queue) == 7
+
+
+def test_async_runner_waits_for_a_held_recipients_window(make_bot):
+    grid = build_grid(1)
+    grid[0].append('Timezone')
+    grid[1].append('UTC')
+    bot = make_bot(grid, GOOGLE_SHEET_RANGE='Sheet1!A1:G', SEND_WINDOWS='00:00-24:00', SEND_DAYS='mon-sun',
+                   SEND_TIMEZONE='UTC', SEND_TIMEZONE_COLUMN='Timezone')
+    bot.initialize(start_scheduler=False)
+    held = bot.recipient_queue.next()
+    # The queue is empty and the only recipient's window opens shortly
+    bot.send_schedule.defer(held, time.time() + 0.2)
+
+    async def next_recipient():
+        return await AsyncEmailBot(bot)._next_recipient(asyncio.Event())
+
+    started = time.monotonic()
+    assert asyncio.run(next_recipient()) is held
+    assert time.monotonic() - started >= 0.15
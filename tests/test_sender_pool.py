@@ -0,0 +1,32 @@
+from fake_backends import FakeGraphResponse, FakeGraphSession
+from outlook_sender import OutlookSender
+from sender_pool import Mailbox, SenderPool
+
+
+class OneThrottleGraphSession(FakeGraphSession):
+    """Throttles the first email it sees and accepts every other one"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.throttled = False
+
+    def _outcome(self):
+        if not self.throttled:
+            self.throttled = True
+            return FakeGraphResponse(429, {'error': {'code': 'TooManyRequests'}}, {'Retry-After': '0'})
+        return FakeGraphResponse(202)
+
+
+def test_throttle_inside_a_batch_counts_once(bot_env):
+    sender = OutlookSender()
+    sender.session = OneThrottleGraphSession()
+    mailbox = Mailbox(sender, daily_limit=100, interval_minutes=0, burst=20)
+    pool = SenderPool([mailbox], throttle_threshold=3, cooldown_seconds=300)
+
+    emails = [{'to_email': f'contact{i}@example.com', 'subject': 'Hi', 'content_html': '<p>Hi</p>'}
+              for i in range(20)]
+    results = pool.send_batch(emails, retries=1)
+
+    assert results.count(True) == 19
+    assert mailbox.sent_today == 19 and mailbox.failed_today == 1
+    assert mailbox.consecutive_throttles == 1
+    assert mailbox.cooldown_until == 0.0
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import threading
+
+from conftest import build_grid
+from sheets_writer import BufferedSheetsWriter, campaign_spool_file
+
+
+def test_campaign_spool_file_is_unique_per_campaign():
+    assert campaign_spool_file('.spool.jsonl', None) == '.spool.jsonl'
+    assert campaign_spool_file('.spool.jsonl', 'sheet-a') == '.spool.sheet-a.jsonl'
+    assert campaign_spool_file('.spool.jsonl', 'sheet-a:worker-1') == '.spool.sheet-a_worker-1.jsonl'
+    long_path = '/data/' + 'x' * 100 + '.csv'
+    assert campaign_spool_file('.spool.jsonl', long_path) != campaign_spool_file('.spool.jsonl', long_path + '2')
+
+
+def test_two_campaigns_keep_separate_spools(make_bot):
+    """One campaign's flush and close must not drop the other's unwritten updates"""
+    bot_a = make_bot(build_grid(3), sheet_id='sheet-a')
+    bot_b = make_bot(build_grid(3), sheet_id='sheet-b')
+    bot_a.initialize(start_scheduler=False)
+    bot_b.initialize(start_scheduler=False)
+    assert bot_a.status_writer.spool_file != bot_b.status_writer.spool_file
+
+    # Campaign B's sheet is unreachable, so its update stays spooled
+    def unreachable(updates):
+        raise ConnectionError('sheet unreachable')
+    bot_b.recipient_source.batch_update = unreachable
+    bot_b.status_writer.update_status(3, 'Status', 'Sent')
+    bot_b.status_writer.flush()
+
+    bot_a.status_writer.update_status(2, 'Status', 'Sent')
+    assert bot_a.status_writer.flush() == 2
+    bot_a.status_writer.close()
+    assert not os.path.exists(bot_a.status_writer.spool_file)
+    assert os.path.getsize(bot_b.status_writer.spool_file) > 0
+
+    # B crashes; its restart writes the update to B's sheet only
+    del bot_b.recipient_source.batch_update
+    BufferedSheetsWriter(bot_b.recipient_source, campaign=bot_b.campaign)
+    assert bot_b.sheets.grid[2][4] == 'Sent'
+    assert bot_a.sheets.grid[2][4] == 'Not Sent'
+    assert bot_a.sheets.grid[1][4] == 'Sent'
+
+
+class BlockingSheet:
+    """Recipient source whose batch_update waits until it is released"""
+    def __init__(self):
+        self.written = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = False
+
+    def batch_update(self, updates):
+        self.started.set()
+        assert self.release.wait(5)
+        if self.fail:
+            raise ConnectionError('sheet unreachable')
+        self.written.extend(updates)
+
+
+def spooled_ranges(writer):
+    with open(writer.spool_file, encoding='utf-8') as spool:
+        return [json.loads(line)['range'] for line in spool]
+
+
+def test_add_does_not_wait_for_a_flush_in_flight(tmp_path):
+    sheet = BlockingSheet()
+    writer = BufferedSheetsWriter(sheet, max_pending=100, flush_interval=60, spool_file=str(tmp_path / 'spool.jsonl'))
+    writer.add([{'range': 'Sheet1!E2', 'values': [['Sent']]}])
+    flushing = threading.Thread(target=writer.flush)
+    flushing.start()
+    assert sheet.started.wait(5)
+
+    started = time.monotonic()
+    writer.add([{'range': 'Sheet1!E3', 'values': [['Sent']]}])
+    assert time.monotonic() - started < 1
+
+    sheet.release.set()
+    flushing.join(5)
+    assert [update['range'] for update in sheet.written] == ['Sheet1!E2']
+    # Only the update made during the flush is left in the spool
+    assert spooled_ranges(writer) == ['Sheet1!E3']
+    assert len(writer) == 1
+
+
+def test_failed_flush_keeps_updates_and_newer_values_win(tmp_path):
+    sheet = BlockingSheet()
+    sheet.fail = True
+    writer = BufferedSheetsWriter(sheet, max_pending=100, flush_interval=60, spool_file=str(tmp_path / 'spool.jsonl'))
+    writer.add([{'range': 'Sheet1!E2', 'values': [['Failed']]}])
+    flushing = threading.Thread(target=writer.flush)
+    flushing.start()
+    assert sheet.started.wait(5)
+    writer.add([{'range': 'Sheet1!E2', 'values': [['Sent']]}])
+    sheet.release.set()
+    flushing.join(5)
+
+    sheet.fail = False
+    assert writer.flush() == 1
+    assert sheet.written == [{'range': 'Sheet1!E2', 'values': [['Sent']]}]
+    writer.close()
+    assert not os.path.exists(writer.spool_file)
+
+
+def test_restart_recovers_spooled_updates(tmp_path):
+    spool_file = str(tmp_path / 'spool.jsonl')
+    sheet = BlockingSheet()
+    sheet.fail = True
+    sheet.release.set()
+    crashed = BufferedSheetsWriter(sheet, max_pending=100, flush_interval=60, spool_file=spool_file)
+    crashed.add([{'range': 'Sheet1!E2', 'values': [['Sent']]}, {'range': 'Sheet1!E3', 'values': [['Failed']]}])
+    crashed.flush()
+    crashed.add([{'range': 'Sheet1!E3', 'values': [['Sent']]}])
+    # A write torn by the crash is skipped on recovery
+    with open(spool_file, 'a', encoding='utf-8') as spool:
+        spool.write('{"range": "Sheet1!E4", "val')
+
+    sheet.fail = False
+    restarted = BufferedSheetsWriter(sheet, max_pending=100, flush_interval=60, spool_file=spool_file)
+    assert sheet.written == [{'range': 'Sheet1!E2', 'values': [['Sent']]},
+                             {'range': 'Sheet1!E3', 'values': [['Sent']]}]
+    assert len(restarted) == 0
+    assert os.path.getsize(spool_file) == 0
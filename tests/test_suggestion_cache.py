@@ -0,0 +1,36 @@
+import sqlite3
+
+from suggestion_cache import SuggestionCache
+
+
+def test_repeated_suggestion_stops_the_pool_from_asking_again(tmp_path):
+    cache = SuggestionCache(str(tmp_path / 'suggestions.sqlite3'), variants=3)
+    assert cache.get('Law Firm') is None
+    cache.add('Law Firm', 'Idea A')
+    assert cache.get('Law Firm') is None
+    cache.add('Law Firm', 'Idea A')
+
+    # The model repeated itself, so the pool of one is served instead of missing on every email
+    assert cache.get('law firm') == 'Idea A'
+    assert cache.missing_variants('Law Firm') == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+
+def test_hits_are_written_to_disk_on_the_next_change_not_each_time(tmp_path):
+    path = str(tmp_path / 'suggestions.sqlite3')
+    cache = SuggestionCache(path, variants=1)
+    cache.add('Retail', 'Idea A')
+    cache.add('Dental', 'Idea B')
+    commits = []
+    cache._conn.set_trace_callback(lambda statement: commits.append(statement) if statement == 'COMMIT' else None)
+    for _ in range(10):
+        assert cache.get('Retail') == 'Idea A'
+    assert commits == []
+    cache.close()
+
+    # The last use still decides which sector is evicted first after a restart
+    conn = sqlite3.connect(path)
+    last_used = dict(conn.execute('SELECT sector, last_used FROM suggestions'))
+    conn.close()
+    assert last_used['retail'] > last_used['dental']